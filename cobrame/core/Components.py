@@ -35,18 +35,40 @@ class TranscribedGene(MEComponent):
         self.RNA_type = ''
         self.nucleotide_sequence = ''
 
+    @property
+    def nucleotide_sequence(self):
+        return self._nucleotide_sequence
+
+    @nucleotide_sequence.setter
+    def nucleotide_sequence(self, value):
+        # values derived from the sequence are cached until it is changed
+        self._sequence_cache = {}
+        self._nucleotide_sequence = value
+
     @property
     def nucleotide_count(self):
+        try:
+            return dict(self._sequence_cache["nucleotide_count"])
+        except KeyError:
+            pass
         seq = self.nucleotide_sequence
         counts = {i: seq.count(i) for i in ("A", "T", "G", "C")}
         monophosphate_counts = {dogma.transcription_table[k].replace("tp_c",
                                                                      "mp_c"): v
                                 for k, v in iteritems(counts)}
+        self._sequence_cache["nucleotide_count"] = \
+            dict(monophosphate_counts)
         return monophosphate_counts
 
     @property
     def mass(self):
-        return compute_RNA_mass(self.nucleotide_sequence)
+        try:
+            return self._sequence_cache["mass"]
+        except KeyError:
+            pass
+        mass = compute_RNA_mass(self.nucleotide_sequence)
+        self._sequence_cache["mass"] = mass
+        return mass
 
 
 class TranslatedGene(MEComponent):
@@ -1,21 +1,94 @@
 from __future__ import print_function, division, absolute_import
 
 import re
+from collections import defaultdict
 
 from cobra import Model, DictList
-from numpy import array
-from scipy.sparse import dok_matrix
+from numpy import argsort, array, maximum
+from scipy.sparse import coo_matrix
 from six import iteritems
 
-from cobrame.core.Components import Constraint
+from cobrame.core.Components import Component, Constraint, \
+    create_component
+from cobrame.core.parallel_update import update_reactions_in_parallel
 from cobrame.core.ProcessData import *
 from cobrame.core.MEReactions import *
 from cobrame.util import mu
 
 
+class GlobalInfo(dict):
+    """The global_info dict of an MEModel
+
+    Records which reactions read each key while they are updated by
+    MEModel.update, and marks those reactions dirty when the key is set.
+    """
+
+    def __init__(self, model, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._model = model
+        # {key: set of reaction ids}
+        self._readers = defaultdict(set)
+
+    def _record_read(self, key):
+        model = self.__dict__.get("_model")
+        reaction_id = getattr(model, "_updating_reaction", None)
+        if reaction_id is not None:
+            self._readers[key].add(reaction_id)
+
+    def _mark_dirty(self, key):
+        readers = self.__dict__.get("_readers")
+        dirty = getattr(self.__dict__.get("_model"), "_dirty_reactions", None)
+        if readers is not None and dirty is not None and key in readers:
+            dirty.update(readers[key])
+
+    def __getitem__(self, key):
+        self._record_read(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        self._record_read(key)
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        self._record_read(key)
+        return dict.__contains__(self, key)
+
+    def __setitem__(self, key, value):
+        self._mark_dirty(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._mark_dirty(key)
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *args):
+        self._mark_dirty(key)
+        return dict.pop(self, key, *args)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in iteritems(dict(*args, **kwargs)):
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            self._mark_dirty(key)
+        dict.clear(self)
+
+
 class MEModel(Model):
     def __init__(self, *args):
         Model.__init__(self, *args)
+        self._parametric_cache = {}
+        # reactions to rebuild on update(dirty_only=True), those updated
+        # with dependency tracking and the one currently being updated
+        self._dirty_reactions = set()
+        self._tracked_reactions = set()
+        self._updating_reaction = None
         self.global_info = {}
         self.stoichiometric_data = DictList()
         self.complex_data = DictList()
@@ -33,8 +106,8 @@ class MEModel(Model):
         self._biomass_dilution = SummaryVariable("biomass_dilution")
         self._biomass_dilution.add_metabolites({self._biomass: -1})
         self.add_reaction(self._biomass_dilution)
-        self._biomass_dilution.upper_bound = mu
-        self._biomass_dilution.lower_bound = mu
+        self._biomass_dilution.upper_bound = self.mu
+        self._biomass_dilution.lower_bound = self.mu
         # maintenance energy
         self._gam = 0.
         self._ngam = 0.
@@ -88,6 +161,20 @@ class MEModel(Model):
                             self._ncRNA_biomass_dilution,
                             self._DNA_biomass_dilution))
 
+    @property
+    def global_info(self):
+        return self._global_info
+
+    @global_info.setter
+    def global_info(self, value):
+        old_info = self.__dict__.get("_global_info")
+        new_info = GlobalInfo(self, value)
+        if old_info is not None:
+            for key in old_info._readers:
+                old_info._mark_dirty(key)
+            new_info._readers = old_info._readers
+        self._global_info = new_info
+
     @property
     def unmodeled_protein(self):
         return self.metabolites.get_by_id("protein_dummy")
@@ -110,6 +197,28 @@ class MEModel(Model):
             {self._biomass: 1 + amount}, combine=False)
         self._unmodeled_protein_fraction = value
 
+    @property
+    def mu(self):
+        """the growth rate in mu-dependent stoichiometries and bounds
+
+        This is the sympy symbol cobrame.mu by default. Setting it to
+        cobrame.util.rational.numeric_mu builds the coefficients as
+        RationalFunction records instead, which is much faster than sympy.
+        Reactions built before changing it need to be updated."""
+        return self.__dict__.get("_mu", mu)
+
+    @mu.setter
+    def mu(self, value):
+        # bounds which are the growth rate itself (i.e. biomass_dilution)
+        # are set to the new value
+        old = self.mu
+        for reaction in self.reactions:
+            if reaction.lower_bound == old:
+                reaction.lower_bound = value
+            if reaction.upper_bound == old:
+                reaction.upper_bound = value
+        self._mu = value
+
     @property
     def gam(self):
         return self._gam
@@ -119,7 +228,7 @@ class MEModel(Model):
         if 'GAM' not in self.reactions:
             warn('Adding GAM reaction to model')
             self.add_reaction(SummaryVariable("GAM"))
-            self.reactions.GAM.lower_bound = mu
+            self.reactions.GAM.lower_bound = self.mu
         atp_hydrolysis = {'atp_c': -1, 'h2o_c': -1, 'adp_c': 1, 'h_c': 1,
                           'pi_c': 1}
         for met, coeff in iteritems(atp_hydrolysis):
@@ -142,100 +251,273 @@ class MEModel(Model):
         self.reactions.ATPM.lower_bound = value
         self._ngam = value
 
-    def get_metabolic_flux(self, solution=None):
-        """extract the flux state for metabolic reactions"""
+    def _build_flux_index(self):
+        """map reaction fluxes onto metabolic, transcription and translation
+        fluxes in a single pass over the reactions
+
+        Returns {kind: (ids, matrix)} where multiplying matrix with the
+        vector of reaction fluxes gives the flux of each id."""
+        metabolic = {r.id: i for i, r in enumerate(self.stoichiometric_data)}
+        transcription = {}
+        translation = {r.id: i for i, r in enumerate(self.translation_data)}
+        entries = {kind: ([], [], []) for kind in
+                   ("metabolic", "transcription", "translation")}
+
+        def add_entry(kind, row, column, value):
+            rows, columns, values = entries[kind]
+            rows.append(row)
+            columns.append(column)
+            values.append(value)
+
+        for j, reaction in enumerate(self.reactions):
+            if isinstance(reaction, MetabolicReaction):
+                i = metabolic[reaction.stoichiometric_data.id]
+                add_entry("metabolic", i, j, -1. if reaction.reverse else 1.)
+            elif reaction.id.startswith("EX_") or reaction.id.startswith("DM"):
+                i = metabolic.setdefault(reaction.id, len(metabolic))
+                add_entry("metabolic", i, j, 1.)
+            elif isinstance(reaction, TranscriptionReaction):
+                for rna_id in reaction.transcription_data.RNA_products:
+                    locus_id = rna_id.replace("RNA_", "", 1)
+                    i = transcription.setdefault(locus_id, len(transcription))
+                    add_entry("transcription", i, j, 1.)
+            elif isinstance(reaction, TranslationReaction):
+                i = translation[reaction.translation_data.id]
+                add_entry("translation", i, j, 1.)
+
+        index = {}
+        for kind, id_map in (("metabolic", metabolic),
+                             ("transcription", transcription),
+                             ("translation", translation)):
+            ids = sorted(id_map, key=id_map.get)
+            rows, columns, values = entries[kind]
+            matrix = coo_matrix((values, (rows, columns)),
+                                shape=(len(ids), len(self.reactions)))
+            index[kind] = (ids, matrix.tocsr())
+        return index
+
+    def aggregate_fluxes(self, fluxes, kind):
+        """sum reaction fluxes into metabolic, transcription or translation
+        fluxes
+
+        fluxes: array of reaction fluxes ordered like self.reactions. This
+            can also be a matrix with a column of fluxes for each solution,
+            such as the one returned by sweep_growth_rates.
+
+        kind: "metabolic", "transcription" or "translation"
+
+        Returns a tuple of (ids, aggregated fluxes) where the aggregated
+        fluxes have a row for each id."""
+        cache = self.__dict__.setdefault("_parametric_cache", {})
+        # setting attributes of reactions and process data clears the index
+        key = (len(self.reactions), len(self.stoichiometric_data),
+               len(self.translation_data), len(self.transcription_data))
+        cached_key, index = cache.get("flux_index", (None, None))
+        if cached_key != key:
+            index = self._build_flux_index()
+            cache["flux_index"] = (key, index)
+        ids, matrix = index[kind]
+        return ids, matrix.dot(fluxes)
+
+    def _get_aggregated_flux(self, solution, kind):
         if solution is None:
             solution = self.solution
         if solution.status != "optimal":
             raise ValueError("solution status '%s' is not 'optimal'" %
                              solution.status)
-        flux_dict = {r.id: 0 for r in self.stoichiometric_data}
-        for reaction in self.reactions:
-            if isinstance(reaction, MetabolicReaction):
-                m_reaction_id = reaction.stoichiometric_data.id
-                if reaction.reverse:
-                    flux_dict[m_reaction_id] -= solution.x_dict[reaction.id]
-                else:
-                    flux_dict[m_reaction_id] += solution.x_dict[reaction.id]
-            elif reaction.id.startswith("EX_") or reaction.id.startswith("DM"):
-                flux_dict[reaction.id] = solution.x_dict[reaction.id]
-        return flux_dict
+        if solution.x is not None:
+            x = array(solution.x, dtype=float)
+        else:
+            x = array([solution.x_dict[r.id] for r in self.reactions])
+        ids, values = self.aggregate_fluxes(x, kind)
+        return dict(zip(ids, values.tolist()))
+
+    def get_metabolic_flux(self, solution=None):
+        """extract the flux state for metabolic reactions"""
+        return self._get_aggregated_flux(solution, "metabolic")
 
     def get_transcription_flux(self, solution=None):
         """extract the transcription flux state"""
-        if solution is None:
-            solution = self.solution
-        if solution.status != "optimal":
-            raise ValueError("solution status '%s' is not 'optimal'" %
-                             solution.status)
-        flux_dict = {}
-        for reaction in self.reactions:
-            if isinstance(reaction, TranscriptionReaction):
-                for rna_id in reaction.transcription_data.RNA_products:
-                    locus_id = rna_id.replace("RNA_", "", 1)
-                    if locus_id not in flux_dict:
-                        flux_dict[locus_id] = 0
-                    flux_dict[locus_id] += solution.x_dict[reaction.id]
-        return flux_dict
+        return self._get_aggregated_flux(solution, "transcription")
 
     def get_translation_flux(self, solution=None):
         """extract the translation flux state"""
-        if solution is None:
-            solution = self.solution
-        if solution.status != "optimal":
-            raise ValueError("solution status '%s' is not 'optimal'" %
-                             solution.status)
-        flux_dict = {r.id: 0 for r in self.translation_data}
-        for reaction in self.reactions:
-            if isinstance(reaction, TranslationReaction):
-                protein_id = reaction.translation_data.id
-                flux_dict[protein_id] += solution.x_dict[reaction.id]
-        return flux_dict
-
-    def construct_S(self, growth_rate):
-        """build the stoichiometric matrix at a specific growth rate"""
-        # intialize to 0
-        S = dok_matrix((len(self.metabolites), len(self.reactions)))
-        # populate with stoichiometry
+        return self._get_aggregated_flux(solution, "translation")
+
+    def add_reactions(self, reaction_list):
+        Model.add_reactions(self, reaction_list)
+        self.clear_parametric_cache()
+
+    def clear_parametric_cache(self):
+        """clear the cached parametric stoichiometric matrix and flux indexes
+
+        This is done automatically when reactions are added or updated, and
+        is only needed after directly changing the stoichiometry of reactions
+        which are not MEReactions, reordering self.reactions or changing the
+        RNA_products of transcription data in place."""
+        self._parametric_cache = {}
+
+    def _clear_flux_index(self):
+        self.__dict__.get("_parametric_cache", {}).pop("flux_index", None)
+
+    def get_parametric_S(self):
+        """the stoichiometric matrix as a function of the growth rate
+
+        Returns a cached ParametricMatrix, which evaluates to the
+        stoichiometric matrix at a growth rate when called with it."""
+        # cobrame.solve depends on cobrame.core, so it is imported here
+        from cobrame.solve.symbolic import ParametricMatrix
+        cache = self.__dict__.setdefault("_parametric_cache", {})
+        shape = (len(self.metabolites), len(self.reactions))
+        S = cache.get("S")
+        if S is not None and S.shape == shape:
+            return S
+        met_index = {met.id: i for i, met in enumerate(self.metabolites)}
+        rows = []
+        columns = []
+        values = []
         for i, r in enumerate(self.reactions):
             for met, value in iteritems(r._metabolites):
-                met_index = self.metabolites.index(met)
-                if hasattr(value, "subs"):
-                    S[met_index, i] = float(value.subs(mu, growth_rate))
-                else:
-                    S[met_index, i] = float(value)
+                rows.append(met_index[met.id])
+                columns.append(i)
+                values.append(value)
+        S = cache["S"] = ParametricMatrix(rows, columns, values, shape)
         return S
 
+    def construct_S(self, growth_rate):
+        """build the stoichiometric matrix at a specific growth rate
+
+        Returns a scipy.sparse.csr_matrix"""
+        return self.get_parametric_S()(growth_rate)
+
     def construct_attribute_vector(self, attr_name, growth_rate):
         """build a vector of a reaction attribute at a specific growth rate
 
         Mainly used for upper and lower bounds"""
-        return array([float(value.subs(mu, growth_rate))
-                      if hasattr(value, "subs") else float(value)
-                      for value in self.reactions.list_attr(attr_name)])
-
-    def compute_solution_error(self, solution=None):
+        from cobrame.solve.symbolic import ExpressionArray
+        cache = self.__dict__.setdefault("_parametric_cache", {})
+        values = self.reactions.list_attr(attr_name)
+        # bounds are often set directly, so the cached values are checked
+        cached_values, expressions = cache.get(attr_name, ((), None))
+        if len(cached_values) != len(values) or \
+                any(i is not j for i, j in zip(cached_values, values)):
+            expressions = ExpressionArray(values)
+            cache[attr_name] = (values, expressions)
+        return expressions(growth_rate)
+
+    def compute_solution_error(self, solution=None, n_violations=10):
+        """compute the constraint violations of a solution
+
+        Returns a dict with the max_error and sum_error of the mass
+        balances, the upper_bound_error and lower_bound_error, and the
+        largest violations (at most n_violations of each) with their ids:
+
+        metabolite_errors: [(metabolite id, S * x)]
+        bound_errors: [(reaction id, distance of the flux outside its bounds)]
+        """
         errors = {}
         if solution is None:
             solution = self.solution
         S = self.construct_S(solution.f)
         lb = self.construct_attribute_vector("lower_bound", solution.f)
         ub = self.construct_attribute_vector("upper_bound", solution.f)
-        x = array(solution.x)
-        err = abs(S * x)
+        x = array(solution.x, dtype=float)
+        residual = S.dot(x)
+        err = abs(residual)
         errors["max_error"] = err.max()
         errors["sum_error"] = err.sum()
-        ub_err = min(ub - x)
+        ub_err = (ub - x).min()
         errors["upper_bound_error"] = abs(ub_err) if ub_err < 0 else 0
-        lb_err = min(x - lb)
+        lb_err = (x - lb).min()
         errors["lower_bound_error"] = abs(lb_err) if lb_err < 0 else 0
+        bound_err = maximum(x - ub, lb - x)
+        errors["metabolite_errors"] = [
+            (self.metabolites[i].id, residual[i])
+            for i in argsort(-err)[:n_violations] if err[i] > 0]
+        errors["bound_errors"] = [
+            (self.reactions[i].id, bound_err[i])
+            for i in argsort(-bound_err)[:n_violations] if bound_err[i] > 0]
         return errors
 
-    def update(self):
-        """updates all component reactions"""
-        for r in self.reactions:
-            if hasattr(r, "update"):
-                r.update()
+    def get_components_from_ids(self, id_stoichiometry,
+                                default_type=Component, verbose=True,
+                                reaction=None):
+        """convert {component id: value} to {component: value}
+
+        Components are looked up by id in the metabolites, and missing
+        components are created with create_component and added to the
+        model together after the whole stoichiometry is resolved.
+
+        default_type: class
+            The type of component to create for ids not yet in the model
+
+        verbose: Boolean
+            If True, print the components which are created
+
+        reaction: cobra.Reaction
+            The reaction the stoichiometry is resolved for, which is shown
+            when printing created components
+        """
+        metabolites = self.metabolites
+        object_stoichiometry = {}
+        new_components = []
+        for component_id, value in iteritems(id_stoichiometry):
+            if metabolites.has_id(component_id):
+                component = metabolites.get_by_id(component_id)
+            else:
+                component = create_component(component_id,
+                                             default_type=default_type)
+                if verbose:
+                    print("Created %s in %s" % (repr(component),
+                                                repr(reaction)))
+                new_components.append(component)
+            object_stoichiometry[component] = value
+        if new_components:
+            self.add_metabolites(new_components)
+        return object_stoichiometry
+
+    def _update_reaction(self, reaction):
+        """update a reaction, recording the global_info it reads"""
+        self._updating_reaction = reaction.id
+        try:
+            reaction.update()
+        finally:
+            self._updating_reaction = None
+        self._tracked_reactions.add(reaction.id)
+        self._dirty_reactions.discard(reaction.id)
+
+    def update(self, dirty_only=False, processes=None):
+        """updates all component reactions
+
+        dirty_only: Boolean
+            Only update reactions which depend on process data attributes or
+            global_info entries set since their last update, as well as
+            reactions whose dependencies are unknown because this function
+            never updated them, and reactions whose own attributes (such as
+            the keff of a MetabolicReaction) were set. Changes made in place
+            to containers (such as the stoichiometry dict of process data)
+            are not tracked, and need a full update or an update of the
+            affected reactions.
+
+        processes: int
+            If given, the reactions are updated in this many worker
+            processes (see update_reactions_in_parallel)
+        """
+        self.clear_parametric_cache()
+        if dirty_only:
+            dirty = self._dirty_reactions
+            tracked = self._tracked_reactions
+            reactions = [r for r in self.reactions
+                         if r.id in dirty or r.id not in tracked]
+        else:
+            reactions = self.reactions
+        if processes is not None:
+            update_reactions_in_parallel(self, reactions, processes)
+        else:
+            for r in reactions:
+                if hasattr(r, "update"):
+                    self._update_reaction(r)
+        self._dirty_reactions.clear()
 
     def prune(self,skip=[]):
         """remove all unused metabolites and reactions
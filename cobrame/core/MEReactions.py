@@ -4,11 +4,11 @@ from collections import defaultdict
 from warnings import warn
 
 from cobra import Reaction
-from sympy import Basic
 from six import iteritems, string_types
 
 from cobrame.core.Components import *
 from cobrame.util import mu
+from cobrame.util.rational import is_symbolic
 
 
 class MEReaction(Reaction):
@@ -21,6 +21,36 @@ class MEReaction(Reaction):
 
 
     """
+    # attributes of cobra reactions, which are set rather than read by update
+    _untracked_attributes = frozenset(Reaction("").__dict__) | {"_model"}
+
+    def __setattr__(self, name, value):
+        model = self.__dict__.get("_model")
+        # the reaction needs to be updated after changes to its own data
+        if name not in self._untracked_attributes:
+            dirty = getattr(model, "_dirty_reactions", None)
+            if dirty is not None:
+                dirty.add(self.id)
+        # the fluxes it is aggregated into depend on its id and data
+        if name not in self._untracked_attributes or name == "id":
+            if hasattr(model, "_clear_flux_index"):
+                model._clear_flux_index()
+        Reaction.__setattr__(self, name, value)
+
+    @property
+    def _mu(self):
+        """the growth rate used in the stoichiometry (see MEModel.mu)"""
+        return getattr(self._model, "mu", mu)
+
+    def add_metabolites(self, metabolites, combine=True,
+                        add_to_container_model=True):
+        Reaction.add_metabolites(
+            self, metabolites, combine=combine,
+            add_to_container_model=add_to_container_model)
+        # the stoichiometric matrix cached by the model is no longer valid
+        if hasattr(self._model, "clear_parametric_cache"):
+            self._model.clear_parametric_cache()
+
     def add_modifications(self, process_data_id, stoichiometry, scale=1.):
         """
         Function to add modification process data to reaction stoichiometry
@@ -45,11 +75,14 @@ class MEReaction(Reaction):
         return: stoichiometry
             The dictionary with updated entries
         """
+        mu = self._mu
 
         all_modifications = self._model.modification_data
         process_info = self._model.process_data.get_by_id(process_data_id)
+        process_info._parent_reactions.add(self.id)
         for modification_id, count in iteritems(process_info.modifications):
             modification = all_modifications.get_by_id(modification_id)
+            modification._parent_reactions.add(self.id)
             for mod_comp, mod_count in iteritems(modification.stoichiometry):
                 stoichiometry[mod_comp] += count * mod_count * scale
 
@@ -82,11 +115,14 @@ class MEReaction(Reaction):
         return: stoichiometry
             The dictionary with updated entries
         """
+        mu = self._mu
 
         all_subreactions = self._model.subreaction_data
         process_info = self._model.process_data.get_by_id(process_data_id)
+        process_info._parent_reactions.add(self.id)
         for subreaction_id, count in iteritems(process_info.subreactions):
             subreaction_data = all_subreactions.get_by_id(subreaction_id)
+            subreaction_data._parent_reactions.add(self.id)
             if type(subreaction_data.enzyme) == list:
                 for enzyme in subreaction_data.enzyme:
                     stoichiometry[enzyme] -= mu / subreaction_data.keff / \
@@ -102,7 +138,7 @@ class MEReaction(Reaction):
 
     def add_translocation_pathways(self, process_data_id, protein_id,
                                    stoichiometry):
-
+        mu = self._mu
         all_translocation = self._model.translocation_data
         process_info = self._model.process_data.get_by_id(process_data_id)
         protein = self._model.metabolites.get_by_id(protein_id)
@@ -113,6 +149,7 @@ class MEReaction(Reaction):
 
         for translocation, count in iteritems(process_info.translocation):
             translocation_data = all_translocation.get_by_id(translocation)
+            translocation_data._parent_reactions.add(self.id)
             for metabolite, amount in iteritems(translocation_data.stoichiometry):
                 if translocation_data.length_dependent_energy:
                     stoichiometry[metabolite] += amount * count * \
@@ -170,19 +207,9 @@ class MEReaction(Reaction):
             {cobra.core.Metabolite: value}
         """
 
-        stoic = id_stoichiometry
-        object_stoichiometry = {}
-        mets = self._model.metabolites
-        for key, value in iteritems(stoic):
-            try:
-                object_stoichiometry[mets.get_by_id(key)] = value
-            except KeyError:
-                new_met = create_component(key, default_type=default_type)
-                if verbose:
-                    print("Created %s in %s" % (repr(new_met), repr(self)))
-                object_stoichiometry[new_met] = value
-                self._model.add_metabolites([new_met])
-        return object_stoichiometry
+        return self._model.get_components_from_ids(
+            id_stoichiometry, default_type=default_type, verbose=verbose,
+            reaction=self)
 
 
 class MetabolicReaction(MEReaction):
@@ -247,6 +274,7 @@ class MetabolicReaction(MEReaction):
         process_data._parent_reactions.add(self.id)
 
     def update(self, verbose=True):
+        mu = self._mu
         self.clear_metabolites()
         new_stoichiometry = defaultdict(float)
         stoichiometric_data = self.stoichiometric_data
@@ -336,8 +364,8 @@ class ComplexFormation(MEReaction):
         elements = defaultdict(int)
         cofactor_biomass = 0.
         for component, value in iteritems(object_stoichiometry):
-            if isinstance(value, Basic):
-                value = value.subs(mu, 0)
+            if is_symbolic(value):
+                value = value.subs(self._mu, 0)
             if component == complex_met:
                 continue
             for e, n in iteritems(component.elements):
@@ -393,6 +421,7 @@ class PostTranslationReaction(MEReaction):
         process_data._parent_reactions.add(self.id)
 
     def update(self, verbose=True):
+        mu = self._mu
         self.clear_metabolites()
         stoichiometry = defaultdict(float)
         metabolites = self._model.metabolites
@@ -493,6 +522,7 @@ class TranscriptionReaction(MEReaction):
         process_data._parent_reactions.add(self.id)
 
     def update(self, verbose=True):
+        mu = self._mu
         self.clear_metabolites()
         TU_id = self.transcription_data.id
         stoichiometry = defaultdict(int)
@@ -631,6 +661,7 @@ class TranslationReaction(MEReaction):
         process_data._parent_reactions.add(self.id)
 
     def update(self, verbose=True):
+        mu = self._mu
         self.clear_metabolites()
         translation_data = self.translation_data
         protein_id = translation_data.protein
@@ -777,6 +808,7 @@ class tRNAChargingReaction(MEReaction):
         process_data._parent_reactions.add(self.id)
 
     def update(self, verbose=True):
+        mu = self._mu
         self.clear_metabolites()
         new_stoichiometry = defaultdict(float)
         data = self.tRNA_data
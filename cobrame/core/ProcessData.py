@@ -21,6 +21,19 @@ class ProcessData(object):
         self._parent_reactions = set()
         model.process_data.append(self)
 
+    def __setattr__(self, name, value):
+        model = self.__dict__.get("_model")
+        # reactions built from this process need to be updated
+        parents = self.__dict__.get("_parent_reactions")
+        if parents:
+            dirty = getattr(model, "_dirty_reactions", None)
+            if dirty is not None:
+                dirty.update(parents)
+        # fluxes are aggregated by the ids and products of process data
+        if hasattr(model, "_clear_flux_index"):
+            model._clear_flux_index()
+        object.__setattr__(self, name, value)
+
     @property
     def model(self):
         return self._model
@@ -33,7 +46,7 @@ class ProcessData(object):
     def _update_parent_reactions(self):
         reactions = self._model.reactions
         for i in self._parent_reactions:
-            reactions.get_by_id(i).update()
+            self._model._update_reaction(reactions.get_by_id(i))
 
     def __repr__(self):
         return "<%s %s at 0x%x>" % (self.__class__.__name__, self.id, id(self))
@@ -169,10 +182,26 @@ class TranscriptionData(ProcessData):
         self.modifications = defaultdict(int)
         self.subreactions = defaultdict(int)
 
+    @property
+    def nucleotide_sequence(self):
+        return self._nucleotide_sequence
+
+    @nucleotide_sequence.setter
+    def nucleotide_sequence(self, value):
+        # values derived from the sequence are cached until it is changed
+        self._sequence_cache = {}
+        self._nucleotide_sequence = value
+
     @property
     def nucleotide_count(self):
-        return {transcription_table[i]: self.nucleotide_sequence.count(i)
-                for i in ["A", "T", "G", "C"]}
+        try:
+            return dict(self._sequence_cache["nucleotide_count"])
+        except KeyError:
+            pass
+        counts = {transcription_table[i]: self.nucleotide_sequence.count(i)
+                  for i in ["A", "T", "G", "C"]}
+        self._sequence_cache["nucleotide_count"] = dict(counts)
+        return counts
 
     @property
     def RNA_types(self):
@@ -196,23 +225,20 @@ class TranscriptionData(ProcessData):
         if RNA_types == {"mRNA"}:
             return {}
 
-        # Get dictionary of all nucleotide counts for TU
-        seq = self.nucleotide_sequence
-        counts = {i: seq.count(i) for i in ("A", "T", "G", "C")}
-
-        # Subtract bases contained in RNA_product from dictionary
-        metabolites = self._model.metabolites
-        for product_id in self.RNA_products:
-            gene_seq = metabolites.get_by_id(product_id).nucleotide_sequence
-            for b in ("A", "T", "G", "C"):
-                counts[b] -= gene_seq.count(b)
-
         # First base being a triphosphate will be handled by the reaction
         # producing an extra ppi during transcription. But generally, we add
         # triphosphate bases when transcribing, but excise monophosphate bases.
-        monophosphate_counts = {dogma.transcription_table[k].replace("tp_c",
-                                                                     "mp_c"): v
-                                for k, v in iteritems(counts)}
+        monophosphate_counts = {k.replace("tp_c", "mp_c"): v
+                                for k, v in iteritems(self.nucleotide_count)}
+
+        # Subtract bases contained in RNA_product from dictionary. The
+        # nucleotide counts of the TU and its products are cached, so the
+        # sequences are not counted again.
+        metabolites = self._model.metabolites
+        for product_id in self.RNA_products:
+            gene_count = metabolites.get_by_id(product_id).nucleotide_count
+            for k in monophosphate_counts:
+                monophosphate_counts[k] -= gene_count[k]
 
         return monophosphate_counts
 
@@ -270,8 +296,22 @@ class TranslationData(ProcessData):
         self.nucleotide_sequence = ""
         self.term_enzyme = None
 
+    @property
+    def nucleotide_sequence(self):
+        return self._nucleotide_sequence
+
+    @nucleotide_sequence.setter
+    def nucleotide_sequence(self, value):
+        # values derived from the sequence are cached until it is changed
+        self._sequence_cache = {}
+        self._nucleotide_sequence = value
+
     @property
     def amino_acid_sequence(self):
+        try:
+            return self._sequence_cache["amino_acid_sequence"]
+        except KeyError:
+            pass
         codons = (self.nucleotide_sequence[i: i + 3]
                   for i in range(0, (len(self.nucleotide_sequence)), 3))
         amino_acid_sequence = ''.join(codon_table.get(i, "K") for i in codons)
@@ -284,6 +324,7 @@ class TranslationData(ProcessData):
             amino_acid_sequence = 'M' + ''.join(amino_acid_sequence[1:])
         if "*" in amino_acid_sequence:
             amino_acid_sequence = amino_acid_sequence.replace('*', 'K')
+        self._sequence_cache["amino_acid_sequence"] = amino_acid_sequence
         return amino_acid_sequence
 
     @property
@@ -300,12 +341,16 @@ class TranslationData(ProcessData):
 
     @property
     def codon_count(self):
-        # exclude the last three stop codons from count
-        codons = (self.nucleotide_sequence[i: i + 3]
-                  for i in range(0, (len(self.nucleotide_sequence)-3), 3))
-        codon_count = defaultdict(int)
-        for i in codons:
-            codon_count[i.replace('T', 'U')] += 1
+        try:
+            codon_count = defaultdict(int, self._sequence_cache["codon_count"])
+        except KeyError:
+            # exclude the last three stop codons from count
+            codons = (self.nucleotide_sequence[i: i + 3]
+                      for i in range(0, (len(self.nucleotide_sequence)-3), 3))
+            codon_count = defaultdict(int)
+            for i in codons:
+                codon_count[i.replace('T', 'U')] += 1
+            self._sequence_cache["codon_count"] = dict(codon_count)
 
         # Remove one methionine (AUG) from codon count to account for start
         first_codon = self.first_codon
@@ -320,15 +365,26 @@ class TranslationData(ProcessData):
     @property
     def amino_acid_count(self):
         """count of each amino acid in the protein"""
+        try:
+            return defaultdict(int, self._sequence_cache["amino_acid_count"])
+        except KeyError:
+            pass
         aa_count = defaultdict(int)
         for i in self.amino_acid_sequence:
             aa_count[amino_acids[i]] += 1
+        self._sequence_cache["amino_acid_count"] = dict(aa_count)
         return aa_count
 
     @property
     def mass(self):
         """mass in kDa"""
-        return compute_protein_mass(self.amino_acid_count)
+        try:
+            return self._sequence_cache["mass"]
+        except KeyError:
+            pass
+        mass = compute_protein_mass(self.amino_acid_count)
+        self._sequence_cache["mass"] = mass
+        return mass
 
     @property
     def elongation_subreactions(self):
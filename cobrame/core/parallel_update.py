@@ -0,0 +1,129 @@
+from __future__ import print_function, division, absolute_import
+
+from multiprocessing import Pool, cpu_count
+
+from six import iteritems
+
+from cobrame.core.MEReactions import ComplexFormation
+
+# copy of the model in a worker process and the formulas of its metabolites
+_worker = {}
+
+
+def _init_worker(me_model):
+    _worker["model"] = me_model
+    _worker["formulas"] = {m.id: m.formula for m in me_model.metabolites}
+
+
+def _update_chunk(reaction_ids):
+    """update reactions in the copy of the model held by the worker
+
+    Returns the new stoichiometry, bounds and metabolite formulas of each
+    reaction, or None for reactions which need to be updated in the parent
+    process (complex formations and reactions which added metabolites or
+    reactions to the model), along with the dependencies recorded for the
+    reactions.
+    """
+    model = _worker["model"]
+    formulas = _worker["formulas"]
+    results = []
+    for r_id in reaction_ids:
+        size = (len(model.metabolites), len(model.reactions))
+        reaction = model.reactions.get_by_id(r_id)
+        # complex formulas are built from the formulas of their components,
+        # which may be set by earlier reactions updated in other workers
+        if isinstance(reaction, ComplexFormation):
+            results.append((r_id, None, None, None))
+            continue
+        model._update_reaction(reaction)
+        if size != (len(model.metabolites), len(model.reactions)):
+            results.append((r_id, None, None, None))
+            continue
+        stoichiometry = [(met.id, value)
+                         for met, value in iteritems(reaction._metabolites)]
+        changed_formulas = {}
+        for met in reaction._metabolites:
+            if formulas.get(met.id) != met.formula:
+                changed_formulas[met.id] = formulas[met.id] = met.formula
+        results.append((r_id, stoichiometry,
+                        (reaction.lower_bound, reaction.upper_bound),
+                        changed_formulas))
+    # dependencies recorded while updating the reactions
+    ids = set(reaction_ids)
+    parents = [(data.id, data._parent_reactions & ids)
+               for data in model.process_data
+               if not ids.isdisjoint(data._parent_reactions)]
+    readers = [(key, reactions & ids)
+               for key, reactions in iteritems(model.global_info._readers)
+               if not ids.isdisjoint(reactions)]
+    return results, parents, readers
+
+
+def _set_stoichiometry(reaction, stoichiometry):
+    """replace the stoichiometry of a reaction as clear_metabolites followed
+    by add_metabolites would, without the overhead of either"""
+    for met in reaction._metabolites:
+        met._reaction.discard(reaction)
+    reaction._metabolites = stoichiometry
+    for met in stoichiometry:
+        met._reaction.add(reaction)
+
+
+def update_reactions_in_parallel(me_model, reactions, processes=None,
+                                 chunk_size=None):
+    """update reactions of an ME-model in a pool of worker processes
+
+    Each worker updates reactions in its own copy of the model, and the new
+    stoichiometries, bounds and metabolite formulas are applied to me_model
+    in the order of the reactions. Complex formations and reactions whose
+    update adds metabolites or reactions to the model are updated in this
+    process instead, so the result is the same as a serial update.
+
+    :param list reactions: reactions of me_model to update
+    :param int processes: number of worker processes (defaults to the
+        number of cpus)
+    :param int chunk_size: number of reactions updated per task
+    """
+    if processes is None:
+        processes = cpu_count()
+    reaction_ids = [r.id for r in reactions if hasattr(r, "update")]
+    if chunk_size is None:
+        chunk_size = max(1, len(reaction_ids) // (processes * 4))
+    chunks = [reaction_ids[i:i + chunk_size]
+              for i in range(0, len(reaction_ids), chunk_size)]
+    model_reactions = me_model.reactions
+    metabolites = me_model.metabolites
+    process_data = me_model.process_data
+    readers = me_model.global_info._readers
+    pool = Pool(processes, initializer=_init_worker, initargs=(me_model,))
+    try:
+        # results are applied in the order of the reactions, and reactions
+        # which can not be updated in a worker are updated at their
+        # position, so they see the same model as in a serial update
+        for results, chunk_parents, chunk_readers in \
+                pool.imap(_update_chunk, chunks):
+            for r_id, stoichiometry, bounds, formulas in results:
+                reaction = model_reactions.get_by_id(r_id)
+                try:
+                    stoichiometry = {metabolites.get_by_id(met_id): value
+                                     for met_id, value in stoichiometry}
+                except (KeyError, TypeError):
+                    # not updated by the worker, or uses a metabolite which
+                    # was only added to the model by the worker
+                    me_model._update_reaction(reaction)
+                    continue
+                _set_stoichiometry(reaction, stoichiometry)
+                reaction.lower_bound, reaction.upper_bound = bounds
+                for met_id, formula in iteritems(formulas):
+                    metabolites.get_by_id(met_id).formula = formula
+                me_model._tracked_reactions.add(r_id)
+                me_model._dirty_reactions.discard(r_id)
+            for data_id, parents in chunk_parents:
+                process_data.get_by_id(data_id)._parent_reactions.update(
+                    parents)
+            for key, reaction_ids in chunk_readers:
+                readers[key].update(reaction_ids)
+    finally:
+        pool.close()
+        pool.join()
+    me_model.clear_parametric_cache()
@@ -1,36 +1,263 @@
-import copy
+import json
+from collections import defaultdict
+from numbers import Integral, Real
 
-from cobra.io.json import save_json_model, load_json_model
+from cobra import DictList, Gene, Metabolite, Model, Reaction
+from cobra.io.json import _from_dict, _fix_type, \
+    _REQUIRED_REACTION_ATTRIBUTES, _OPTIONAL_REACTION_ATTRIBUTES, \
+    _REQUIRED_METABOLITE_ATTRIBUTES, _OPTIONAL_METABOLITE_ATTRIBUTES, \
+    _REQUIRED_GENE_ATTRIBUTES, _OPTIONAL_GENE_ATTRIBUTES, \
+    _OPTIONAL_MODEL_ATTRIBUTES
+from six import iteritems, string_types
 from sympy import Basic, sympify, Symbol
 from cobrame import mu
+from cobrame.core.MEModel import GlobalInfo, MEModel
+from cobrame.core.ProcessData import ProcessData
+from cobrame.util.rational import RationalFunction, is_symbolic
 
 mu_temp = Symbol('mu')
 
+
+def _fix_value(value):
+    """convert symbolic values to strings and other values as cobra does"""
+    if is_symbolic(value):
+        return str(value)
+    return _fix_type(value)
+
+
+def _to_dict(cobra_object, required, optional):
+    """convert the attributes of a cobra object to a dict"""
+    new_dict = {key: _fix_value(getattr(cobra_object, key))
+                for key in required}
+    for key, default_value in iteritems(optional):
+        value = getattr(cobra_object, key)
+        if value is not None and (is_symbolic(value) or
+                                  value != default_value):
+            new_dict[key] = _fix_value(value)
+    return new_dict
+
+
+def _reaction_to_dict(reaction):
+    new_reaction = _to_dict(reaction, _REQUIRED_REACTION_ATTRIBUTES -
+                            {"metabolites"}, _OPTIONAL_REACTION_ATTRIBUTES)
+    new_reaction["metabolites"] = {str(met): _fix_value(coeff)
+                                   for met, coeff
+                                   in iteritems(reaction._metabolites)}
+    return new_reaction
+
+
+def _metabolite_to_dict(metabolite):
+    return _to_dict(metabolite, _REQUIRED_METABOLITE_ATTRIBUTES,
+                    _OPTIONAL_METABOLITE_ATTRIBUTES)
+
+
+def _gene_to_dict(gene):
+    new_gene = _to_dict(gene, (), _OPTIONAL_GENE_ATTRIBUTES)
+    new_gene.update({key: str(getattr(gene, key))
+                     for key in _REQUIRED_GENE_ATTRIBUTES})
+    return new_gene
+
+
+# attributes which are stored in the cobra part of each object
+_REACTION_BASE_ATTRIBUTES = frozenset(vars(Reaction()))
+_METABOLITE_BASE_ATTRIBUTES = frozenset(vars(Metabolite()))
+_GENE_BASE_ATTRIBUTES = frozenset(vars(Gene()))
+# model attributes which are stored in other parts of the json, or are
+# rebuilt on load
+_MODEL_SKIPPED_ATTRIBUTES = {"reactions", "metabolites", "genes", "solution",
+                             "_parametric_cache", "_updating_reaction",
+                             "_global_info", "id", "name", "notes",
+                             "annotation", "compartments"}
+# cached values which are saved empty
+_CACHE_ATTRIBUTES = {"_sequence_cache"}
+_DEFAULT_FACTORIES = {i.__name__: i for i in (int, float, bool, str, list,
+                                               set, dict)}
+
+
+def _sorted(items):
+    """sort items if possible, so sets are written in a stable order"""
+    try:
+        return sorted(items)
+    except TypeError:
+        return list(items)
+
+
+def _encode(value):
+    """convert an attribute value to a json-compatible value
+
+    Values which json can not represent are stored as a dict with a single
+    key starting with "$" naming their type, and references to objects of
+    the model are stored by their id."""
+    if value is None or isinstance(value, (bool, string_types)):
+        return value
+    if isinstance(value, Integral):
+        return int(value)
+    if isinstance(value, Real):
+        return float(value)
+    if isinstance(value, RationalFunction):
+        return {"$rational": [list(value.numerator), list(value.denominator)]}
+    if isinstance(value, Basic):
+        return {"$expression": str(value)}
+    if isinstance(value, ProcessData):
+        return {"$process_data": value.id}
+    if isinstance(value, Reaction):
+        return {"$reaction": value.id}
+    if isinstance(value, Metabolite):
+        return {"$metabolite": value.id}
+    if isinstance(value, Gene):
+        return {"$gene": value.id}
+    if isinstance(value, defaultdict):
+        factory = value.default_factory
+        if factory is not None and \
+                _DEFAULT_FACTORIES.get(factory.__name__) is not factory:
+            raise TypeError("can not save a defaultdict of %r" % factory)
+        return {"$defaultdict": None if factory is None else factory.__name__,
+                "items": [[_encode(k), _encode(v)]
+                          for k, v in iteritems(value)]}
+    if isinstance(value, dict):
+        if all(isinstance(k, string_types) and not k.startswith("$")
+               for k in value):
+            return {k: _encode(v) for k, v in iteritems(value)}
+        return {"$dict": [[_encode(k), _encode(v)]
+                          for k, v in iteritems(value)]}
+    if isinstance(value, (set, frozenset)):
+        return {"$set": _sorted(_encode(i) for i in value)}
+    if isinstance(value, tuple):
+        return {"$tuple": [_encode(i) for i in value]}
+    if isinstance(value, list):
+        return [_encode(i) for i in value]
+    raise TypeError("can not save %s to json" % repr(value))
+
+
+def _encode_attributes(obj, skipped):
+    """encode the attributes of an object which are not in skipped"""
+    return {key: {} if key in _CACHE_ATTRIBUTES else _encode(value)
+            for key, value in iteritems(vars(obj)) if key not in skipped}
+
+
+def _add_type(new_dict, obj, base, base_attributes):
+    """add the class and additional attributes of ME objects"""
+    if type(obj) is not base:
+        new_dict["type"] = type(obj).__name__
+        new_dict["attributes"] = _encode_attributes(obj, base_attributes)
+    return new_dict
+
+
+def _me_reaction_to_dict(reaction):
+    return _add_type(_reaction_to_dict(reaction), reaction, Reaction,
+                     _REACTION_BASE_ATTRIBUTES)
+
+
+def _me_metabolite_to_dict(metabolite):
+    return _add_type(_metabolite_to_dict(metabolite), metabolite, Metabolite,
+                     _METABOLITE_BASE_ATTRIBUTES)
+
+
+def _me_gene_to_dict(gene):
+    return _add_type(_gene_to_dict(gene), gene, Gene, _GENE_BASE_ATTRIBUTES)
+
+
+def _process_data_to_dict(process_data):
+    return {"id": process_data.id, "type": type(process_data).__name__,
+            "attributes": _encode_attributes(process_data, {"id", "_model"})}
+
+
+def _process_data_lists(me_model):
+    """{attribute name: DictList} of the process data lists of a model"""
+    return {key: value for key, value in iteritems(vars(me_model))
+            if isinstance(value, DictList) and
+            key not in _MODEL_SKIPPED_ATTRIBUTES}
+
+
+def _write_me_model(outfile, me_model, dump_opts):
+    """write the process data and the ME attributes of a model"""
+    lists = _process_data_lists(me_model)
+    # every process data object is written once, in the order they are in
+    # model.process_data
+    process_data = DictList(me_model.process_data)
+    for data_list in sorted(lists):
+        for data in lists[data_list]:
+            if not process_data.has_id(data.id):
+                process_data.append(data)
+    outfile.write("{")
+    _write_list(outfile, "process_data", process_data,
+                _process_data_to_dict, dump_opts)
+    global_info = me_model.global_info
+    obj = {
+        "process_data_lists": {key: [i.id for i in value]
+                               for key, value in iteritems(lists)},
+        "global_info": _encode(global_info),
+        "global_info_readers": _encode(dict(global_info._readers)),
+        "attributes": {key: _encode(value)
+                       for key, value in iteritems(vars(me_model))
+                       if key not in _MODEL_SKIPPED_ATTRIBUTES and
+                       key not in lists}}
+    for key, value in sorted(iteritems(obj)):
+        outfile.write(",\n" + json.dumps(key) + ": " +
+                      json.dumps(value, allow_nan=False, **dump_opts))
+    outfile.write("}")
+
+
+def _write_list(outfile, key, items, to_dict, dump_opts):
+    """write a JSON list one item at a time"""
+    outfile.write(json.dumps(key) + ": [")
+    for i, item in enumerate(items):
+        if i > 0:
+            outfile.write(", ")
+        outfile.write(json.dumps(to_dict(item), allow_nan=False,
+                                 **dump_opts))
+    outfile.write("]")
+
+
 def save_json_me(me0, file_name, pretty=False):
     """
     Save ME model as json
 
+    The model is written one reaction, metabolite and gene at a time, and
+    symbolic values are converted to strings as they are written, so the
+    model is neither copied nor modified.
+
+    The reactions, metabolites and genes are written as cobrapy does, along
+    with the class and the additional attributes of ME objects. The process
+    data, global_info and the remaining attributes of an MEModel are written
+    to "me_model", so load_json_me can restore an MEModel which can be
+    updated without building it again.
+
     model : :class:`~cobrame.core.MEModel.MEmodel` object
 
     file_name : str or file-like object
     """
-    me = copy.deepcopy(me0)
-
-    for rxn in me.reactions:
-        for met in rxn.metabolites:
-            s = rxn._metabolites[met]
-            if isinstance(s, Basic):
-                rxn._metabolites[met] = str(s)
-        if isinstance(rxn.lower_bound, Basic):
-            rxn.lower_bound = str(rxn.lower_bound)
-        if isinstance(rxn.upper_bound, Basic):
-            rxn.upper_bound = str(rxn.upper_bound)
+    should_close = False
+    if isinstance(file_name, string_types):
+        file_name = open(file_name, 'w')
+        should_close = True
+    dump_opts = {"sort_keys": True} if pretty else {}
 
-    for met in me.metabolites:
-        if isinstance(met._bound, Basic):
-            met._bound = str(met._bound)
-
-    save_json_model(me, file_name)
+    try:
+        file_name.write("{")
+        _write_list(file_name, "reactions", me0.reactions,
+                    _me_reaction_to_dict, dump_opts)
+        file_name.write(",\n")
+        _write_list(file_name, "metabolites", me0.metabolites,
+                    _me_metabolite_to_dict, dump_opts)
+        file_name.write(",\n")
+        _write_list(file_name, "genes", me0.genes, _me_gene_to_dict,
+                    dump_opts)
+        if isinstance(me0, MEModel):
+            file_name.write(",\n" + json.dumps("me_model") + ": ")
+            _write_me_model(file_name, me0, dump_opts)
+        # the remaining model attributes are written like cobra does
+        obj = _to_dict(me0, (), _OPTIONAL_MODEL_ATTRIBUTES)
+        obj["id"] = me0.id
+        obj["version"] = 1
+        for key, value in sorted(iteritems(obj)) if pretty else \
+                iteritems(obj):
+            file_name.write(",\n" + json.dumps(key) + ": " +
+                            json.dumps(value, allow_nan=False, **dump_opts))
+        file_name.write("}\n")
+    finally:
+        if should_close:
+            file_name.close()
 
 
 def get_sympy_expression(value):
@@ -44,43 +271,209 @@ def get_sympy_expression(value):
     expression_value = sympify(value)
     return expression_value.subs(mu_temp, mu)
 
+
+class _ExpressionParser(object):
+    """Converts values loaded from json to floats or sympy expressions
+
+    Each unique string is only parsed once, and mu is passed to sympify
+    directly instead of being substituted into every parsed expression.
+    If rational is True, expressions are converted to RationalFunctions.
+    """
+    def __init__(self, rational=False):
+        self._values = {}
+        self._rational = rational
+
+    def __call__(self, value):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return self._values[value]
+        except KeyError:
+            result = sympify(value, locals={"mu": mu})
+            if self._rational:
+                result = RationalFunction.from_sympy(result)
+            self._values[value] = result
+            return result
+
+
+def _class_registry():
+    """{name: class} of the subclasses of the cobra classes and of the
+    ProcessData classes
+
+    The cobra classes themselves are not included, because objects of those
+    are written without a type."""
+    registry = {"ProcessData": ProcessData}
+    classes = [i for base in (Reaction, Metabolite, Gene, ProcessData)
+               for i in base.__subclasses__()]
+    while classes:
+        cls = classes.pop()
+        registry.setdefault(cls.__name__, cls)
+        classes.extend(cls.__subclasses__())
+    return registry
+
+
+class _Decoder(object):
+    """Converts values written by _encode back, resolving references to
+    the objects of the model being loaded"""
+    def __init__(self):
+        self.objects = {"$reaction": {}, "$metabolite": {}, "$gene": {},
+                        "$process_data": {}}
+
+    def __call__(self, value):
+        if isinstance(value, list):
+            return [self(i) for i in value]
+        if not isinstance(value, dict):
+            return value
+        if "$defaultdict" in value:
+            factory = value["$defaultdict"]
+            return defaultdict(
+                None if factory is None else _DEFAULT_FACTORIES[factory],
+                ((self(k), self(v)) for k, v in value["items"]))
+        if len(value) != 1 or not next(iter(value)).startswith("$"):
+            return {k: self(v) for k, v in iteritems(value)}
+        (key, content), = iteritems(value)
+        if key in self.objects:
+            return self.objects[key][content]
+        if key == "$expression":
+            return sympify(content, locals={"mu": mu})
+        if key == "$rational":
+            return RationalFunction(*content)
+        if key == "$dict":
+            return {self(k): self(v) for k, v in content}
+        if key == "$set":
+            return {self(i) for i in content}
+        if key == "$tuple":
+            return tuple(self(i) for i in content)
+        raise ValueError("unknown value type %s" % key)
+
+
+def _create(registry, obj, base):
+    """create an object with the class in obj, initialized as its cobra
+    base class so the attributes of its own class can be restored"""
+    cls = registry[obj["type"]] if "type" in obj else base
+    if not issubclass(cls, base):
+        raise TypeError("%s is not a %s" % (cls.__name__, base.__name__))
+    new_object = cls.__new__(cls)
+    base.__init__(new_object, obj["id"])
+    return new_object
+
+
+def _set_attributes(new_object, obj, decode, parse, parsed=()):
+    """set the cobra attributes and ME attributes of a loaded object"""
+    for key, value in iteritems(obj):
+        if key in ("type", "attributes", "metabolites", "reaction",
+                   "reversibility"):
+            continue
+        setattr(new_object, key, parse(value) if key in parsed else value)
+    if "attributes" in obj:
+        new_object.__dict__.update(decode(obj["attributes"]))
+
+
+def _load_me_model(obj):
+    """create an MEModel from json written by save_json_me"""
+    me_obj = obj["me_model"]
+    registry = _class_registry()
+    decode = _Decoder()
+    me = MEModel.__new__(MEModel)
+    Model.__init__(me, obj["id"])
+
+    # create all objects first, so their attributes can refer to each other
+    metabolites = [_create(registry, i, Metabolite)
+                   for i in obj["metabolites"]]
+    genes = [_create(registry, i, Gene) for i in obj["genes"]]
+    reactions = [_create(registry, i, Reaction) for i in obj["reactions"]]
+    process_data = []
+    for i in me_obj["process_data"]:
+        cls = registry[i["type"]]
+        if not issubclass(cls, ProcessData):
+            raise TypeError("%s is not a ProcessData" % cls.__name__)
+        data = cls.__new__(cls)
+        data.__dict__.update(id=i["id"], _model=me)
+        process_data.append(data)
+    for kind, objects in (("$metabolite", metabolites), ("$gene", genes),
+                          ("$reaction", reactions),
+                          ("$process_data", process_data)):
+        decode.objects[kind] = {i.id: i for i in objects}
+
+    attributes = decode(me_obj["attributes"])
+    # stoichiometries and bounds are written as strings of sympy
+    # expressions, which are converted to RationalFunctions if the model
+    # uses them for mu
+    parse = _ExpressionParser(
+        rational=isinstance(attributes.get("_mu"), RationalFunction))
+
+    for new_object, i in zip(metabolites, obj["metabolites"]):
+        _set_attributes(new_object, i, decode, parse, {"_bound"})
+    me.add_metabolites(metabolites)
+    for new_object, i in zip(genes, obj["genes"]):
+        _set_attributes(new_object, i, decode, parse)
+        new_object._model = me
+    me.genes.extend(genes)
+    for data, i in zip(process_data, me_obj["process_data"]):
+        data.__dict__.update(decode(i["attributes"]))
+    metabolite_ids = decode.objects["$metabolite"]
+    for new_object, i in zip(reactions, obj["reactions"]):
+        _set_attributes(new_object, i, decode, parse,
+                        {"lower_bound", "upper_bound"})
+        new_object._metabolites = {metabolite_ids[k]: parse(v)
+                                   for k, v in iteritems(i["metabolites"])}
+    me.add_reactions(reactions)
+
+    for key, value in iteritems(obj):
+        if key in {"name", "notes", "compartments", "annotation"}:
+            setattr(me, key, value)
+    me.__dict__.update(attributes)
+    for key, ids in iteritems(me_obj["process_data_lists"]):
+        setattr(me, key, DictList(decode.objects["$process_data"][i]
+                                  for i in ids))
+    me._parametric_cache = {}
+    me._updating_reaction = None
+    me._global_info = GlobalInfo(me, decode(me_obj["global_info"]))
+    me._global_info._readers = defaultdict(
+        set, decode(me_obj["global_info_readers"]))
+    return me
+
+
 def load_json_me(file_name):
     """
     Load ME model from json
 
+    Models written by save_json_me are restored as an MEModel with all of
+    its process data and the classes of its reactions and metabolites, so
+    it can be updated. Other json models are loaded as cobrapy models with
+    the symbolic values converted back to sympy expressions.
+
+    Identical symbolic values are only parsed once.
+
     file_name : str or file-like object
     """
-    me = load_json_model(file_name)
+    should_close = False
+    if isinstance(file_name, string_types):
+        file_name = open(file_name, 'r')
+        should_close = True
+    try:
+        obj = json.load(file_name)
+    finally:
+        if should_close:
+            file_name.close()
+
+    if "me_model" in obj:
+        return _load_me_model(obj)
+
+    me = _from_dict(obj)
+    parse = _ExpressionParser()
 
     # Re-convert stoichiometries back to sympy
     for rxn in me.reactions:
-        for met in rxn.metabolites:
-            s =rxn._metabolites[met]
-            try:
-                rxn._metabolites[met] = float(s)
-            except ValueError:
-                rxn._metabolites[met] = get_sympy_expression(s)
-        try:
-            rxn.lower_bound = float(rxn.lower_bound)
-        except ValueError:
-            rxn.lower_bound = get_sympy_expression(rxn.lower_bound)
-        try:
-            rxn.upper_bound = float(rxn.upper_bound)
-        except ValueError:
-            rxn.upper_bound = get_sympy_expression(rxn.upper_bound)
+        stoichiometry = rxn._metabolites
+        for met, value in iteritems(stoichiometry):
+            stoichiometry[met] = parse(value)
+        rxn.lower_bound = parse(rxn.lower_bound)
+        rxn.upper_bound = parse(rxn.upper_bound)
 
     for met in me.metabolites:
-        b = met._bound
-        try:
-            met._bound = float(b)
-        except ValueError:
-            met._bound = get_sympy_expression(b)
+        met._bound = parse(met._bound)
 
     return me
-
-
-"""
-Add ME objects to the cobrapy json-schema
-Particularly, translation_data, etc.
-"""
-#json_schema
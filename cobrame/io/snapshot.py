@@ -0,0 +1,126 @@
+from __future__ import print_function, division, absolute_import
+
+import json
+import zlib
+from struct import Struct
+
+from numpy import dtype, frombuffer, fromfile, memmap, uint8
+from six import iteritems, string_types, StringIO
+
+from cobrame.io.jsonme import _Decoder, _encode, load_json_me, save_json_me
+from cobrame.solve.problem import CompiledMEProblem, problem_arrays
+
+_MAGIC = b"COBRAMES"
+_VERSION = 1
+# magic, format version and length of the json header
+_PREAMBLE = Struct("<8sII")
+# arrays are aligned so they can be viewed directly in the mapped file
+_ALIGNMENT = 64
+
+
+def save_snapshot(me_model, file_name, compiled_expressions=None,
+                  cache_dir=None, include_model=True):
+    """save a binary snapshot of an ME-model
+
+    The snapshot stores the arrays of problem_arrays uncompressed and
+    aligned in a single file, after a json header with the name, dtype,
+    shape and offset of every array. load_snapshot can then memory-map
+    the file, so processes loading the same snapshot share its pages and
+    can build and solve the LP without creating any cobra objects.
+
+    :param CompiledExpressions compiled_expressions: the compiled
+        expressions of me_model (see compile_expressions)
+    :param str cache_dir: directory with cached compiled expressions
+    :param bool include_model: also store the model itself (as compressed
+        json written by save_json_me), so it can be restored with
+        ModelSnapshot.load_model
+    """
+    arrays = problem_arrays(me_model, compiled_expressions, cache_dir)
+    if include_model:
+        model_json = StringIO()
+        save_json_me(me_model, model_json)
+        arrays["model_json"] = frombuffer(zlib.compress(
+            model_json.getvalue().encode("utf-8")), dtype=uint8)
+    layout = {}
+    offset = 0
+    for name in sorted(arrays):
+        value = arrays[name]
+        if value.dtype.hasobject:
+            raise TypeError("array %s can not be saved" % name)
+        offset += -offset % _ALIGNMENT
+        layout[name] = {"dtype": value.dtype.str, "shape": list(value.shape),
+                        "offset": offset}
+        offset += value.nbytes
+    header = json.dumps({"id": me_model.id,
+                         "global_info": _encode(me_model.global_info),
+                         "arrays": layout}, sort_keys=True).encode("utf-8")
+    # array offsets are relative to the aligned end of the header
+    start = _PREAMBLE.size + len(header)
+    start += -start % _ALIGNMENT
+
+    should_close = False
+    if isinstance(file_name, string_types):
+        file_name = open(file_name, "wb")
+        should_close = True
+    try:
+        file_name.write(_PREAMBLE.pack(_MAGIC, _VERSION, len(header)))
+        file_name.write(header)
+        position = _PREAMBLE.size + len(header)
+        for name in sorted(arrays):
+            target = start + layout[name]["offset"]
+            file_name.write(b"\0" * (target - position))
+            file_name.write(arrays[name].tobytes())
+            position = target + arrays[name].nbytes
+    finally:
+        if should_close:
+            file_name.close()
+
+
+def load_snapshot(file_name, mmap=True):
+    """load a snapshot written by save_snapshot
+
+    :param bool mmap: memory-map the file instead of reading it, so only
+        the pages which are used are loaded and processes loading the same
+        snapshot share them. The arrays are read-only.
+
+    Returns a :class:`ModelSnapshot`, which is a CompiledMEProblem
+    """
+    with open(file_name, "rb") as infile:
+        magic, version, header_size = _PREAMBLE.unpack(
+            infile.read(_PREAMBLE.size))
+        if magic != _MAGIC:
+            raise ValueError("%s is not a cobrame snapshot" % file_name)
+        if version != _VERSION:
+            raise ValueError("unsupported snapshot version %d" % version)
+        header = json.loads(infile.read(header_size).decode("utf-8"))
+    start = _PREAMBLE.size + header_size
+    start += -start % _ALIGNMENT
+    if mmap:
+        data = memmap(file_name, dtype=uint8, mode="r")
+    else:
+        data = fromfile(file_name, dtype=uint8)
+        data.flags.writeable = False
+    arrays = {}
+    for name, info in iteritems(header["arrays"]):
+        array_dtype = dtype(info["dtype"])
+        shape = tuple(info["shape"])
+        size = array_dtype.itemsize
+        for i in shape:
+            size *= i
+        offset = start + info["offset"]
+        arrays[name] = data[offset:offset + size].view(array_dtype).reshape(
+            shape)
+    return ModelSnapshot(header["id"], arrays,
+                         _Decoder()(header["global_info"]))
+
+
+class ModelSnapshot(CompiledMEProblem):
+    """A CompiledMEProblem loaded from a snapshot, which can also restore
+    the model itself"""
+
+    def load_model(self):
+        """restore the MEModel stored in the snapshot"""
+        if "model_json" not in self.arrays:
+            raise ValueError("the snapshot does not include the model")
+        model_json = zlib.decompress(self.arrays["model_json"].tobytes())
+        return load_json_me(StringIO(model_json.decode("utf-8")))
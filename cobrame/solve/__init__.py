@@ -2,3 +2,5 @@ from __future__ import absolute_import
 
 from cobrame.solve.algorithms import *
 from cobrame.solve.symbolic import *
+from cobrame.solve.parallel import *
+from cobrame.solve.problem import *
@@ -14,8 +14,9 @@ try:
     import soplex
 except ImportError as e:
     soplex = None
-    warn("soplex import failed with error '%s'" % e.message)
+    warn("soplex import failed with error '%s'" % e)
 
+from cobrame.solve.problem import CompiledMEProblem
 from cobrame.solve.symbolic import *
 
 try:
@@ -38,36 +39,236 @@ def get_ME_solver(solver=None):
         return solver
 
 
+def _create_problem(solver, me_model, growth_rate):
+    """create the LP of an ME-model or a CompiledMEProblem
+
+    Returns the LP and the model (or the solver view of the
+    CompiledMEProblem) to pass to the solver along with it."""
+    if isinstance(me_model, CompiledMEProblem):
+        me_model = me_model.solver_view(growth_rate)
+    return solver.create_problem(me_model), me_model
+
+
+def _get_compiled_expressions(me_model, compiled_expressions, cache_dir):
+    if compiled_expressions is not None:
+        return compiled_expressions
+    if isinstance(me_model, CompiledMEProblem):
+        return me_model.compiled_expressions
+    return compile_expressions(me_model, cache_dir=cache_dir)
+
+
+def _objective(me_model):
+    """(index, coefficient) of each reaction in the objective"""
+    if isinstance(me_model, CompiledMEProblem):
+        coefficients = me_model.objective_coefficients
+        return [(i, coefficients[i])
+                for i in coefficients.nonzero()[0].tolist()]
+    return [(i, reaction.objective_coefficient)
+            for i, reaction in enumerate(me_model.reactions)
+            if reaction.objective_coefficient != 0]
+
+
+def _interpolate_root(margins):
+    """estimate the growth rate at which the feasibility margin reaches 0
+
+    margins is a list of (mu, objective value) for feasible growth rates in
+    increasing order. The objective (flux through the dummy reaction)
+    shrinks towards 0 as mu approaches the maximum growth rate. The estimate
+    is the root of the inverse quadratic interpolation (mu as a quadratic
+    function of the objective) through the last three points, or of the
+    secant through the last two if that is not defined. Returns None if
+    neither is defined.
+    """
+    if len(margins) >= 3:
+        (mu0, f0), (mu1, f1), (mu2, f2) = margins[-3:]
+        if f0 != f1 and f0 != f2 and f1 != f2:
+            return mu0 * f1 * f2 / ((f0 - f1) * (f0 - f2)) + \
+                mu1 * f0 * f2 / ((f1 - f0) * (f1 - f2)) + \
+                mu2 * f0 * f1 / ((f2 - f0) * (f2 - f1))
+    if len(margins) >= 2:
+        (mu1, f1), (mu2, f2) = margins[-2:]
+        if f1 != f2:
+            return mu2 - f2 * (mu2 - mu1) / (f2 - f1)
+    return None
+
+
+def _bracket_growth_rate(try_mus, min_mu, max_mu, n_points=1):
+    """find a feasible growth rate and a higher infeasible one
+
+    try_mus(mus) solves the LP at each growth rate in mus (in parallel if it
+    can) and returns the objective value of each, or None for the growth
+    rates at which the solve was not optimal. min_mu is tried first, along
+    with max_mu if n_points > 1, and 0 if min_mu is infeasible. The upper
+    end is then raised from max_mu in steps of 1, n_points at a time, until
+    an infeasible growth rate is found.
+
+    Returns the feasible and the infeasible growth rate, and a list of
+    (mu, objective value) for the feasible growth rates in increasing
+    order.
+    """
+    margins = []
+
+    def solve(mus):
+        values = try_mus(mus)
+        margins.extend((mu, value) for mu, value in zip(mus, values)
+                       if value is not None)
+        return values
+
+    if n_points > 1:
+        min_value, max_value = solve([min_mu, max_mu])
+    else:
+        min_value, = solve([min_mu])
+    if min_value is None:
+        # Try 0 if min_mu failed
+        if min_mu == 0 or solve([0])[0] is None:
+            raise ValueError("0 needs to be feasible")
+        min_mu = 0
+    if n_points == 1:
+        max_value, = solve([max_mu])
+    lower, upper = min_mu, max_mu
+    # If max_mu was feasible, keep increasing it
+    while max_value is not None:
+        lower = upper
+        mus = [upper + i + 1 for i in range(n_points)]
+        values = solve(mus)
+        upper, max_value = mus[-1], values[-1]
+        # the interval ends at the first infeasible mu
+        for mu, value in zip(mus, values):
+            if value is None:
+                upper, max_value = mu, None
+                break
+            lower = mu
+    return lower, upper, sorted(margins)
+
+
+def _narrow_growth_rate(try_mu, lower, upper, margins, mu_accuracy,
+                        method="bisection"):
+    """narrow the interval between a feasible lower and an infeasible upper
+    growth rate down to mu_accuracy
+
+    try_mu(mu) returns the objective value at mu, or None if the solve was
+    not optimal, and margins is the list of (mu, objective value) for the
+    feasible growth rates returned by _bracket_growth_rate, which is
+    extended with the new ones. See binary_search for the methods.
+
+    Returns the feasible and the infeasible end of the final interval.
+    """
+    # probes are kept at least this far from the estimate and the ends
+    tol = 0.45 * mu_accuracy
+    widths = []
+    estimate = None
+    while upper - lower > mu_accuracy:
+        widths.append(upper - lower)
+        mu = None
+        # as in Brent's method, only interpolate while the interval halved
+        # in the last two steps, and the search is at most two solves
+        # behind bisection
+        if method == "brent" and \
+                (len(widths) < 3 or widths[-1] <= 0.5 * widths[-3]) and \
+                widths[-1] * 2 ** (len(widths) - 3) <= widths[0]:
+            new_estimate = _interpolate_root(margins)
+            if new_estimate is not None and lower < new_estimate < upper:
+                # the change in the estimate bounds the error of the last one
+                offset = tol if estimate is None else \
+                    max(tol, abs(new_estimate - estimate))
+                estimate = new_estimate
+                # step past the estimate towards the farther end, so that an
+                # accurate estimate closes the interval from both sides, and
+                # bisect instead of stepping next to an end already solved
+                if upper - estimate > estimate - lower:
+                    mu = estimate + offset
+                else:
+                    mu = estimate - offset
+                if not lower + tol <= mu <= upper - tol:
+                    mu = None
+        if mu is None:
+            mu = (lower + upper) * 0.5
+        value = try_mu(mu)
+        if value is None:
+            upper = mu
+        else:
+            lower = mu
+            margins.append((mu, value))
+    return lower, upper
+
+
+def _search_growth_rate(try_mu, min_mu, max_mu, mu_accuracy,
+                        method="bisection"):
+    """bracket and narrow down the maximum growth rate with try_mu
+
+    See _bracket_growth_rate and _narrow_growth_rate. Returns the feasible
+    and the infeasible end of the final interval.
+    """
+    lower, upper, margins = _bracket_growth_rate(
+        lambda mus: [try_mu(mu) for mu in mus], min_mu, max_mu)
+    return _narrow_growth_rate(try_mu, lower, upper, margins, mu_accuracy,
+                               method)
+
+
+def _check_search_method(method, reset_obj=False):
+    if method not in ("bisection", "brent"):
+        raise ValueError("method must be 'bisection' or 'brent'")
+    if method == "brent" and reset_obj:
+        warn("the brent search needs the objective, using bisection")
+        return "bisection"
+    return method
+
+
 def binary_search(me_model, min_mu=0, max_mu=2, mu_accuracy=1e-9,
                   solver=None, verbose=True, compiled_expressions=None,
-                  debug=True, reset_obj=False, **solver_args):
+                  debug=True, reset_obj=False, cache_dir=None,
+                  method="bisection", **solver_args):
     """Computes maximum feasible growth rate (mu) through a binary search
 
     The objective function of the model should be set to a dummy
     reaction which forces translation of a dummy protein.
 
+    me_model can also be a CompiledMEProblem (as can the model passed to
+    the other functions in this module), in which case the LP is built from
+    its arrays and the solution is stored in its solution attribute.
+
     :param float max_mu: A guess for a growth rate which will be infeasible
     :param float min_mu: A guess for a growth rate which will be feasible
     :param float mu_accuracy: The final error in mu after the binary search
     :param boolean verbose: will print out each mu in the binary search
-    :param dict compiled_expressions: precompiled symbolic expressions in the
-        model
+    :param CompiledExpressions compiled_expressions: precompiled symbolic
+        expressions in the model (see compile_expressions)
+    :param str cache_dir: directory used to cache the compiled expressions
+        between runs if compiled_expressions is not passed in
+    :param str method: "bisection" halves the interval at every step.
+        "brent" uses the objective value of the feasible solves as a
+        feasibility margin which reaches 0 at the maximum growth rate, and
+        estimates where by inverse quadratic interpolation. Infeasible
+        solves have no objective value, so they only bound the interval.
+        Each step solves just past the estimate towards the farther end of
+        the interval, so an accurate estimate closes the interval from both
+        sides. As in Brent's method, it bisects instead whenever the
+        interval did not halve in the last two steps, or the search is more
+        than two solves behind bisection. This usually takes far fewer
+        solves than bisection, and at most a few more. It requires the
+        objective to be kept (reset_obj=False).
+
+    The number of LP solves and the time taken are stored in the n_solves and
+    search_time attributes of the returned solution. The same LP is modified
+    and resolved for every mu, so the solver warm starts each solve from the
+    basis of the previous one.
 
     """
 
+    method = _check_search_method(method, reset_obj)
     if solver is not None:
         debug = False  # other solvers can't handle debug mode
     solver = get_ME_solver(solver)
-    lp = solver.create_problem(me_model)
+    lp, lp_model = _create_problem(solver, me_model, max_mu)
+    objective = _objective(me_model)
     # reset the objective for faster feasibility solving
     if reset_obj:
-        for i, reaction in enumerate(me_model.reactions):
-            if reaction.objective_coefficient != 0:
-                solver.change_variable_objective(lp, i, 0)
+        for i, _ in objective:
+            solver.change_variable_objective(lp, i, 0)
     for name, value in iteritems(solver_args):
         solver.set_parameter(lp, name, value)
-    if compiled_expressions is None:
-        compiled_expressions = compile_expressions(me_model)
+    compiled_expressions = _get_compiled_expressions(
+        me_model, compiled_expressions, cache_dir)
     feasible_mu = []
     infeasible_mu = []
 
@@ -110,71 +311,82 @@ def binary_search(me_model, min_mu=0, max_mu=2, mu_accuracy=1e-9,
             if verbose:
                 print(success_str_base % mu + debug_str)
             feasible_mu.append(mu)
-            return True
+            return solver.get_objective_value(lp) if method == "brent" \
+                else 0.
         else:
             infeasible_mu.append(mu)
             if verbose:
                 if status != "infeasible" and debug:
                     debug_str += "(status: %s)" % status
                 print(failure_str_base % mu + debug_str)
-            return False
+            return None
 
     start = time()
-    # find highest possible value of mu try the edges of binary search
-    if not try_mu(min_mu):
-        # Try 0 if min_mu failed
-        if min_mu == 0 or not try_mu(0):
-            raise ValueError("0 needs to be feasible")
-    while try_mu(max_mu):  # If max_mu was feasible, keep increasing
-        max_mu += 1
-    while infeasible_mu[-1] - feasible_mu[-1] > mu_accuracy:
-        try_mu((infeasible_mu[-1] + feasible_mu[-1]) * 0.5)
+    _search_growth_rate(try_mu, min_mu, max_mu, mu_accuracy, method)
     # now we want to solve with the objective
     if reset_obj:
-        for i, reaction in enumerate(me_model.reactions):
-            if reaction.objective_coefficient != 0:
-                solver.change_variable_objective(
-                    lp, i, reaction.objective_coefficient)
+        for i, coefficient in objective:
+            solver.change_variable_objective(lp, i, coefficient)
     try_mu(feasible_mu[-1])
-    me_model.solution = solver.format_solution(lp, me_model)
+    me_model.solution = solver.format_solution(lp, lp_model)
     me_model.solution.f = feasible_mu[-1]
+    me_model.solution.n_solves = len(feasible_mu) + len(infeasible_mu)
+    me_model.solution.search_time = time() - start
 
     if verbose:
         print("completed in %.1f seconds and %d iterations" %
-              (time() - start, len(feasible_mu) + len(infeasible_mu)))
+              (me_model.solution.search_time, me_model.solution.n_solves))
     return me_model.solution
 
 
-def create_lp_at_growth_rate(me_model, growth_rate, compiled_expressions=None,
-                             solver=None, **solver_args):
+def _create_lp(me_model, growth_rate, compiled_expressions=None,
+               solver=None, cache_dir=None, **solver_args):
+    """create the LP at a growth rate
 
+    Returns the LP, the solver and the model to format solutions with"""
     if growth_rate == 0 and me_model.global_info.get('k_deg', 0) != 0:
         warn('Due to mRNA degradation constraint formulation the model is '
              'infeasible at mu = 0. Using mu = .1 instead.')
         growth_rate = .1
     solver = get_ME_solver(solver)
-    lp = solver.create_problem(me_model)
+    lp, lp_model = _create_problem(solver, me_model, growth_rate)
     for name, value in iteritems(solver_args):
         lp.set_parameter(name, value)
     # substitute in values
-    if compiled_expressions is None:
-        compiled_expressions = compile_expressions(me_model)
+    compiled_expressions = _get_compiled_expressions(
+        me_model, compiled_expressions, cache_dir)
     substitute_mu(lp, growth_rate, compiled_expressions, solver)
+    return lp, solver, lp_model
+
+
+def create_lp_at_growth_rate(me_model, growth_rate, compiled_expressions=None,
+                             solver=None, cache_dir=None, **solver_args):
+    lp, solver, _ = _create_lp(
+        me_model, growth_rate, compiled_expressions=compiled_expressions,
+        solver=solver, cache_dir=cache_dir, **solver_args)
     return (lp, solver)
 
 
 def solve_at_growth_rate(me_model, growth_rate, **solver_args):
-    lp, solver = create_lp_at_growth_rate(me_model, growth_rate,
-                                          **solver_args)
+    lp, solver, lp_model = _create_lp(me_model, growth_rate, **solver_args)
     # solve and return
     solver.solve_problem(lp)
-    me_model.solution = solver.format_solution(lp, me_model)
+    me_model.solution = solver.format_solution(lp, lp_model)
     if me_model.solution.status == "optimal":
         me_model.solution.f = growth_rate
     return me_model.solution
 
 
 def fva(me_model, growth_rate, reaction_list, skip_check=False, **solver_args):
+    if isinstance(me_model, CompiledMEProblem):
+        # the objective is reset in the LP instead of the model
+        lp, solver, lp_model = _create_lp(me_model, growth_rate,
+                                          **solver_args)
+        if not skip_check:
+            for i, _ in _objective(me_model):
+                solver.change_variable_objective(lp, i, 0)
+        return calculate_lp_variability(lp, solver, lp_model, reaction_list)
+
     # store objective
     if skip_check:
         obj = {}
@@ -0,0 +1,604 @@
+from __future__ import print_function, division, absolute_import
+
+from importlib import import_module
+from math import ceil, log
+from multiprocessing import Pool, cpu_count
+from os.path import isfile
+from time import time
+from warnings import warn
+
+from cobra.solvers import solver_dict
+from numpy import array, empty, errstate, isfinite, isnan, nan
+import pandas
+from six import iteritems, string_types
+
+from cobrame.core.Components import TranscribedGene
+from cobrame.solve.algorithms import Red, Green, Normal, \
+    _bracket_growth_rate, _check_search_method, _create_lp, \
+    _get_compiled_expressions, _objective, _search_growth_rate
+from cobrame.solve.problem import CompiledMEProblem
+from cobrame.solve.symbolic import substitute_mu
+
+# state of a worker process, set up once by _init_worker
+_worker = {}
+
+
+def _solver_name(solver):
+    """name a solver so it can be sent to (and imported in) a worker"""
+    if solver is None or isinstance(solver, string_types):
+        return solver
+    return solver.__name__
+
+
+def _load_solver(solver):
+    if solver is None or solver in solver_dict:
+        return solver
+    return import_module(solver)
+
+
+def _reaction_ids(me_model):
+    """ids of the reactions of an ME-model or a CompiledMEProblem"""
+    if isinstance(me_model, CompiledMEProblem):
+        return me_model.reaction_ids
+    return [reaction.id for reaction in me_model.reactions]
+
+
+def _init_worker(me_model, growth_rate, solver, compiled_expressions,
+                 solver_args, reset_obj=False):
+    """build the LP of a worker process once, to be modified by each task"""
+    lp, solver, lp_model = _create_lp(
+        me_model, growth_rate, solver=_load_solver(solver),
+        compiled_expressions=compiled_expressions, **solver_args)
+    if reset_obj:
+        for i, _ in _objective(me_model):
+            solver.change_variable_objective(lp, i, 0)
+    _worker.update(me_model=me_model, lp=lp, solver=solver,
+                   lp_model=lp_model,
+                   compiled_expressions=compiled_expressions)
+
+
+def _create_pool(me_model, growth_rate, processes, solver,
+                 compiled_expressions, solver_args, reset_obj=False):
+    if processes is None:
+        processes = cpu_count()
+    return Pool(processes, initializer=_init_worker,
+                initargs=(me_model, growth_rate, _solver_name(solver),
+                          compiled_expressions, solver_args, reset_obj))
+
+
+def _worker_try_mu(mu):
+    """solve the worker LP at mu and return the objective value, or None
+    if the solve was not optimal"""
+    lp = _worker["lp"]
+    solver = _worker["solver"]
+    # the model is infeasible at mu = 0 with mRNA degradation
+    if mu == 0 and _worker["me_model"].global_info.get('k_deg', 0) != 0:
+        mu = .1
+    substitute_mu(lp, mu, _worker["compiled_expressions"], solver)
+    solver.solve_problem(lp)
+    if solver.get_status(lp) != "optimal":
+        return None
+    return solver.get_objective_value(lp)
+
+
+def _worker_solve_at_mu(mu):
+    _worker_try_mu(mu)
+    return _worker["solver"].format_solution(_worker["lp"],
+                                             _worker["lp_model"])
+
+
+def _finite_at(compiled_expressions, mu):
+    """whether every compiled expression has a finite value at mu"""
+    try:
+        with errstate(divide="ignore", invalid="ignore"):
+            values = compiled_expressions.evaluate(mu)
+    except ZeroDivisionError:
+        return False
+    return all(isfinite(i).all() for i in values)
+
+
+def _solve_fluxes(lp, solver, me_model, lp_model, mu, compiled_expressions):
+    """solve the LP at mu and return its fluxes (None if not optimal)
+
+    lp_model is the model (or solver view) the LP was created from."""
+    # the model can not be solved at mu = 0 with mRNA degradation or other
+    # expressions in 1/mu, which evaluate to inf or nan there
+    if mu == 0 and (me_model.global_info.get('k_deg', 0) != 0 or
+                    not _finite_at(compiled_expressions, mu)):
+        return None
+    substitute_mu(lp, mu, compiled_expressions, solver)
+    solver.solve_problem(lp)
+    if solver.get_status(lp) != "optimal":
+        return None
+    return array(solver.format_solution(lp, lp_model).x)
+
+
+def _worker_fluxes(mu):
+    return _solve_fluxes(_worker["lp"], _worker["solver"],
+                         _worker["me_model"], _worker["lp_model"], mu,
+                         _worker["compiled_expressions"])
+
+
+def _worker_variability(reaction_ids):
+    """minimize and maximize each reaction in the LP of the worker
+
+    Both solves of a reaction and all reactions in a chunk reuse the same
+    LP, so each solve warm starts from the basis of the previous one.
+    """
+    lp = _worker["lp"]
+    solver = _worker["solver"]
+    reactions = _worker["lp_model"].reactions
+    results = []
+    for r_id in reaction_ids:
+        i = reactions.index(r_id)
+        solver.change_variable_objective(lp, i, 1.)
+        values = []
+        for sense in ("minimize", "maximize"):
+            solver.solve_problem(lp, objective_sense=sense)
+            value = solver.get_objective_value(lp) \
+                if solver.get_status(lp) == "optimal" else None
+            values.append(value)
+        solver.change_variable_objective(lp, i, 0.)
+        results.append((r_id, values[0], values[1]))
+    return results
+
+
+_FVA_HEADER = "id\tminimum\tmaximum"
+
+
+def _format_fva_value(value):
+    # repr of a python float round trips, unlike %r of a numpy scalar
+    return "None" if value is None else repr(float(value))
+
+
+def _parse_fva_value(value):
+    return None if value == "None" else float(value)
+
+
+def _read_fva_checkpoint(checkpoint):
+    """read the results of a previous run from a checkpoint file
+
+    The last line is ignored if it is malformed or does not end in a
+    newline, as happens when a run is interrupted while writing it. Any
+    other malformed line, or a file which does not start with the header
+    of a checkpoint, raises a ValueError.
+
+    Returns the results and the length of the file up to the last line
+    read, at which new results should be appended.
+    """
+    results = {}
+    if checkpoint is None or not isfile(checkpoint):
+        return results, 0
+    with open(checkpoint, "rb") as infile:
+        content = infile.read()
+    if len(content) == 0:
+        return results, 0
+    lines = content.split(b"\n")
+    # never overwrite a file which is not a checkpoint
+    if lines[0] != _FVA_HEADER.encode() or len(lines) == 1:
+        raise ValueError("%s is not an FVA checkpoint" % checkpoint)
+    end = len(lines[0]) + 1
+    # the last item is the part of the file after the last newline
+    for i, line in enumerate(lines[1:-1], 1):
+        try:
+            r_id, minimum, maximum = line.decode("utf-8").split("\t")
+            results[r_id] = {"minimum": _parse_fva_value(minimum),
+                             "maximum": _parse_fva_value(maximum)}
+        except ValueError:
+            if i < len(lines) - 2 or lines[-1]:
+                raise ValueError("line %d of the FVA checkpoint %s is "
+                                 "malformed" % (i + 1, checkpoint))
+            break
+        end += len(line) + 1
+    return results, end
+
+
+def iter_fva(me_model, growth_rate, reaction_list, processes=None,
+             chunk_size=50, checkpoint=None, skip_check=False, solver=None,
+             compiled_expressions=None, cache_dir=None, **solver_args):
+    """Run flux variability analysis in parallel, yielding results as
+    they are computed
+
+    The reactions are split into chunks of chunk_size which are solved by
+    a pool of worker processes, each of which builds its LP at growth_rate
+    only once.
+
+    :param float growth_rate: growth rate at which to run FVA
+    :param list reaction_list: reactions (or their ids) to run FVA on
+    :param int processes: number of worker processes (defaults to the
+        number of cpus)
+    :param int chunk_size: number of reactions solved by a worker per task
+    :param str checkpoint: file to which results are appended as they are
+        computed. Reactions already in the file are not solved again, so an
+        interrupted run can be resumed by passing the same file. A
+        ValueError is raised if an existing file is not a checkpoint.
+    :param bool skip_check: keep the objective of the model instead of
+        resetting it in the LP (as in fva)
+
+    Yields (reaction id, {"minimum": value, "maximum": value}) for each
+    reaction, starting with those read from the checkpoint. The value is
+    None if the solve was not optimal.
+
+    """
+    reaction_ids = [str(r) for r in reaction_list]
+    done, end = _read_fva_checkpoint(checkpoint)
+    for r_id in reaction_ids:
+        if r_id in done:
+            yield r_id, done[r_id]
+    todo = [r_id for r_id in reaction_ids if r_id not in done]
+    if len(todo) == 0:
+        return
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    compiled_expressions = _get_compiled_expressions(
+        me_model, compiled_expressions, cache_dir)
+    outfile = None
+    pool = _create_pool(me_model, growth_rate, processes, solver,
+                        compiled_expressions, solver_args,
+                        reset_obj=not skip_check)
+    try:
+        if checkpoint is not None:
+            outfile = open(checkpoint, "a")
+            # drop a line cut short by an interruption
+            outfile.truncate(end)
+            if end == 0:
+                outfile.write(_FVA_HEADER + "\n")
+        for results in pool.imap_unordered(_worker_variability, chunks):
+            if outfile is not None:
+                for r_id, minimum, maximum in results:
+                    outfile.write("%s\t%s\t%s\n" % (
+                        r_id, _format_fva_value(minimum),
+                        _format_fva_value(maximum)))
+                outfile.flush()
+            for r_id, minimum, maximum in results:
+                yield r_id, {"minimum": minimum, "maximum": maximum}
+    finally:
+        if outfile is not None:
+            outfile.close()
+        pool.terminate()
+        pool.join()
+
+
+def parallel_fva(me_model, growth_rate, reaction_list, processes=None,
+                 chunk_size=50, checkpoint=None, skip_check=False,
+                 **solver_args):
+    """Run flux variability analysis in parallel
+
+    Returns the same dict of {reaction id: {"minimum": value,
+    "maximum": value}} as fva. See iter_fva for the parameters.
+
+    """
+    return dict(iter_fva(me_model, growth_rate, reaction_list,
+                         processes=processes, chunk_size=chunk_size,
+                         checkpoint=checkpoint, skip_check=skip_check,
+                         **solver_args))
+
+
+def sweep_growth_rates(me_model, mus, processes=None, solver=None,
+                       compiled_expressions=None, cache_dir=None,
+                       **solver_args):
+    """Solve the model at each growth rate in mus
+
+    The LP is only created once and then modified for each growth rate, so
+    each solve warm starts from the basis of the solve at the previous
+    growth rate.
+
+    :param list mus: growth rates to solve at, ideally in sorted order
+    :param int processes: if given, the growth rates are split into
+        contiguous blocks which are solved by this many worker processes
+    :returns: array of the fluxes with a row for each reaction of
+        me_model and a column for each mu. The column is nan for
+        growth rates at which the solve was not optimal, and at mu = 0 if
+        the model can not be solved there (with mRNA degradation or other
+        expressions in 1/mu).
+    :rtype: numpy.ndarray
+
+    """
+    mus = [float(i) for i in mus]
+    compiled_expressions = _get_compiled_expressions(
+        me_model, compiled_expressions, cache_dir)
+    n_reactions = len(_reaction_ids(me_model))
+    if len(mus) == 0:
+        return empty((n_reactions, 0))
+    # the LP is created away from mu = 0, where expressions in 1/mu are
+    # not defined
+    start = next((mu for mu in mus if mu != 0), .1)
+    if processes is None:
+        lp, solver, lp_model = _create_lp(
+            me_model, start, compiled_expressions=compiled_expressions,
+            solver=solver, **solver_args)
+        results = [_solve_fluxes(lp, solver, me_model, lp_model, mu,
+                                 compiled_expressions) for mu in mus]
+    else:
+        pool = _create_pool(me_model, start, processes, solver,
+                            compiled_expressions, solver_args)
+        try:
+            chunksize = int(ceil(len(mus) / max(processes, 1)))
+            results = pool.map(_worker_fluxes, mus, chunksize=chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    fluxes = empty((n_reactions, len(mus)))
+    for j, x in enumerate(results):
+        fluxes[:, j] = nan if x is None else x
+    return fluxes
+
+
+def _condition_changes(me_model, condition):
+    """translate a condition into changes to the LP of me_model
+
+    Knockouts are applied as in MEModel.remove_genes_from_model: the RNA is
+    removed from its reactions, while the reactions of the protein, the
+    metabolic reactions of its complexes and transcription reactions with
+    no remaining transcribed genes are blocked.
+
+    Returns a tuple of ({reaction index: (lower, upper)},
+    {(metabolite index, reaction index): coefficient}) for the changes and
+    the same for their reversal.
+
+    Knockouts need the reactions of the genes, so a CompiledMEProblem only
+    supports changes to bounds.
+    """
+    reaction_index = {r_id: i for i, r_id in
+                      enumerate(_reaction_ids(me_model))}
+    bounds = {}
+    coefficients = {}
+    for r_id, (lower_bound, upper_bound) in iteritems(
+            condition.get("bounds", {})):
+        bounds[reaction_index[r_id]] = (lower_bound, upper_bound)
+    knockouts = condition.get("knockouts", ())
+
+    # symbolic values are reset when substituting the next growth rate
+    def numeric(value):
+        return 0. if hasattr(value, "subs") else value
+
+    if isinstance(me_model, CompiledMEProblem):
+        if len(knockouts) > 0:
+            raise ValueError("knockouts are not supported for a "
+                             "CompiledMEProblem")
+        indexes = list(bounds)
+        # the bounds which depend on mu are nan
+        lower_bounds, upper_bounds = (
+            [0. if isnan(i) else i for i in
+             me_model.arrays[name][indexes].tolist()]
+            for name in ("lower_bounds", "upper_bounds"))
+        revert_bounds = dict(zip(indexes, zip(lower_bounds, upper_bounds)))
+        return (bounds, coefficients), (revert_bounds, {})
+    reactions = me_model.reactions
+    metabolites = me_model.metabolites
+    removed_RNA = set()
+    for gene in knockouts:
+        RNA = metabolites.get_by_id('RNA_' + gene)
+        removed_RNA.add(RNA)
+        for reaction in RNA.reactions:
+            coefficients[metabolites.index(RNA),
+                         reactions.index(reaction)] = 0.
+        protein = metabolites.get_by_id('protein_' + gene)
+        blocked = set(protein.reactions)
+        for cplx in protein.complexes:
+            blocked.update(cplx.metabolic_reactions)
+        for reaction in blocked:
+            bounds[reactions.index(reaction)] = (0., 0.)
+    if len(knockouts) > 0:
+        for t in reactions.query('transcription_TU'):
+            if not any(isinstance(product, TranscribedGene) and
+                       product not in removed_RNA for product in t.products):
+                bounds[reactions.index(t)] = (0., 0.)
+
+    revert_bounds = {}
+    for i in bounds:
+        reaction = reactions[i]
+        revert_bounds[i] = (numeric(reaction.lower_bound),
+                            numeric(reaction.upper_bound))
+    revert_coefficients = {}
+    for i, j in coefficients:
+        revert_coefficients[i, j] = numeric(
+            reactions[j]._metabolites[metabolites[i]])
+    return (bounds, coefficients), (revert_bounds, revert_coefficients)
+
+
+def _apply_changes(lp, solver, changes):
+    bounds, coefficients = changes
+    for i, (lower_bound, upper_bound) in iteritems(bounds):
+        solver.change_variable_bounds(lp, i, lower_bound, upper_bound)
+    for (i, j), value in iteritems(coefficients):
+        solver.change_coefficient(lp, i, j, value)
+
+
+def _worker_screen(args):
+    """search the growth rate of the worker LP with a condition applied"""
+    name, changes, revert, min_mu, max_mu, mu_accuracy, method = args
+    lp = _worker["lp"]
+    solver = _worker["solver"]
+    compiled_expressions = _worker["compiled_expressions"]
+    start = time()
+    tried = []
+
+    def try_mu(mu):
+        # the model is infeasible at mu = 0 with mRNA degradation
+        if mu == 0 and _worker["me_model"].global_info.get('k_deg', 0) != 0:
+            mu = .1
+        substitute_mu(lp, mu, compiled_expressions, solver)
+        _apply_changes(lp, solver, changes)
+        solver.solve_problem(lp)
+        tried.append(mu)
+        if solver.get_status(lp) != "optimal":
+            return None
+        return solver.get_objective_value(lp)
+
+    try:
+        lower, _ = _search_growth_rate(try_mu, min_mu, max_mu, mu_accuracy,
+                                       method)
+    except ValueError:  # infeasible at min_mu and 0
+        return name, nan, "infeasible", len(tried), time() - start
+    finally:
+        _apply_changes(lp, solver, revert)
+    # feasible only at 0, so the condition can not grow
+    status = "infeasible" if lower == 0 else "optimal"
+    return name, lower, status, len(tried), time() - start
+
+
+def screen_conditions(me_model, conditions, processes=None, min_mu=0,
+                      max_mu=2, mu_accuracy=1e-9, solver=None, verbose=True,
+                      method="bisection", compiled_expressions=None,
+                      cache_dir=None, **solver_args):
+    """Compute the maximum growth rate of the model under many conditions
+
+    Each condition is a dict of changes relative to me_model with the keys
+
+    * "bounds": {reaction id: (lower_bound, upper_bound)}, for example to
+      change the exchange reactions open in a medium
+    * "knockouts": list of genes to knock out (as in
+      MEModel.remove_genes_from_model). A CompiledMEProblem only supports
+      changes to bounds.
+
+    The model itself is not modified. The conditions are instead translated
+    into changes to the LP, which are applied to and reverted from the LP
+    built once by each worker process while it searches the growth rate of
+    the condition as binary_search does.
+
+    :param conditions: dict of {name: condition} or a list of conditions
+    :param int processes: number of worker processes (defaults to the
+        number of cpus)
+    :param boolean verbose: print the result of each condition
+    :param str method: "bisection" or "brent" (see binary_search)
+    :returns: DataFrame indexed by the condition names with the columns
+        growth_rate, status, n_solves and search_time. The status is
+        "infeasible" for conditions which can not grow, with a growth_rate
+        of nan if the LP is infeasible at 0 and of 0 if it is only
+        feasible at 0.
+    :rtype: pandas.DataFrame
+
+    """
+    method = _check_search_method(method)
+    if not isinstance(conditions, dict):
+        conditions = dict(enumerate(conditions))
+    if min_mu == 0 and me_model.global_info.get('k_deg', 0) != 0:
+        warn('Due to mRNA degradation constraint formulation the model is '
+             'infeasible at mu = 0. Using mu = .1 instead.')
+        min_mu = .1
+    compiled_expressions = _get_compiled_expressions(
+        me_model, compiled_expressions, cache_dir)
+    tasks = []
+    for name, condition in iteritems(conditions):
+        changes, revert = _condition_changes(me_model, condition)
+        tasks.append((name, changes, revert, min_mu, max_mu, mu_accuracy,
+                      method))
+    if verbose:
+        str_places = int(abs(round(log(mu_accuracy)/log(10)))) + 1
+        num_format = "%." + str(str_places) + "f"
+        success_str_base = "%s\t" + Green + num_format + "\t+" + Normal
+        failure_str_base = "%s\t" + Red + num_format + "\t-" + Normal
+        print("condition\tmu\tstatus")
+    results = []
+    pool = _create_pool(me_model, min_mu, processes, solver,
+                        compiled_expressions, solver_args)
+    try:
+        for result in pool.imap(_worker_screen, tasks, chunksize=1):
+            if verbose:
+                print((success_str_base if result[2] == "optimal"
+                       else failure_str_base) % result[:2])
+            results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+    columns = ["growth_rate", "status", "n_solves", "search_time"]
+    return pandas.DataFrame([i[1:] for i in results],
+                            index=[i[0] for i in results], columns=columns)
+
+
+def parallel_binary_search(me_model, min_mu=0, max_mu=2, mu_accuracy=1e-9,
+                           processes=None, solver=None, verbose=True,
+                           compiled_expressions=None, cache_dir=None,
+                           **solver_args):
+    """Computes maximum feasible growth rate (mu) with a parallel k-section
+
+    Every round solves k = processes growth rates evenly spaced in the
+    current interval at once, each in a separate worker process holding its
+    own LP, which shrinks the interval by a factor of k + 1 per round.
+    Otherwise this behaves as binary_search, and the result agrees with it
+    to within mu_accuracy.
+
+    :param float max_mu: A guess for a growth rate which will be infeasible
+    :param float min_mu: A guess for a growth rate which will be feasible
+    :param float mu_accuracy: The final error in mu after the search
+    :param int processes: number of worker processes (defaults to the
+        number of cpus)
+    :param solver: solver module or the name of a cobra solver. Modules
+        which are not cobra solvers are imported by name in the workers.
+    :param boolean verbose: will print out each mu in the search
+    :param CompiledExpressions compiled_expressions: precompiled symbolic
+        expressions in the model (see compile_expressions)
+    :param str cache_dir: directory used to cache the compiled expressions
+        between runs if compiled_expressions is not passed in
+
+    The number of LP solves, rounds and the time taken are stored in the
+    n_solves, n_rounds and search_time attributes of the returned solution.
+
+    """
+    compiled_expressions = _get_compiled_expressions(
+        me_model, compiled_expressions, cache_dir)
+    if processes is None:
+        processes = cpu_count()
+    if min_mu == 0 and me_model.global_info.get('k_deg', 0) != 0:
+        warn('Due to mRNA degradation constraint formulation the model is '
+             'infeasible at mu = 0. Using mu = .1 instead.')
+        min_mu = .1
+    k = max(processes, 1)
+    feasible_mu = []
+    infeasible_mu = []
+
+    # String formatting for display
+    str_places = int(abs(round(log(mu_accuracy)/log(10)))) + 1
+    num_format = "%." + str(str_places) + "f"
+    if verbose:
+        success_str_base = Green + num_format + "\t+" + Normal
+        failure_str_base = Red + num_format + "\t-" + Normal
+        print("%s\tstatus" % "mu".ljust(str_places + 2))
+
+    def try_mus(mus):
+        """solve each mu in a worker and return the objective value of each
+        (None if infeasible)"""
+        rounds.append(mus)
+        values = pool.map(_worker_try_mu, mus, chunksize=1)
+        for mu, value in zip(mus, values):
+            feasible = value is not None
+            (feasible_mu if feasible else infeasible_mu).append(mu)
+            if verbose:
+                print((success_str_base if feasible else failure_str_base)
+                      % mu)
+        return values
+
+    start = time()
+    rounds = []
+    pool = _create_pool(me_model, min_mu, processes, solver,
+                        compiled_expressions, solver_args)
+    try:
+        # the edges of the search are tried together, and the upper end
+        # is raised k steps at a time
+        lower, upper, _ = _bracket_growth_rate(try_mus, min_mu, max_mu,
+                                               n_points=k)
+        while upper - lower > mu_accuracy:
+            width = upper - lower
+            mus = [lower + width * (i + 1) / (k + 1) for i in range(k)]
+            # the interval ends at the first infeasible mu
+            for mu, value in zip(mus, try_mus(mus)):
+                if value is None:
+                    upper = mu
+                    break
+                lower = mu
+        solution = pool.apply(_worker_solve_at_mu, (lower,))
+    finally:
+        pool.close()
+        pool.join()
+
+    me_model.solution = solution
+    me_model.solution.f = lower
+    me_model.solution.n_solves = len(feasible_mu) + len(infeasible_mu) + 1
+    me_model.solution.n_rounds = len(rounds)
+    me_model.solution.search_time = time() - start
+
+    if verbose:
+        print("completed in %.1f seconds, %d iterations and %d rounds" %
+              (me_model.solution.search_time, me_model.solution.n_solves,
+               len(rounds)))
+    return me_model.solution
@@ -0,0 +1,329 @@
+from __future__ import print_function, division, absolute_import
+
+from cobra import DictList
+from numpy import arange, array, concatenate, cumsum, diff, empty, \
+    frombuffer, nan, repeat, uint8
+from scipy.sparse import coo_matrix, csr_matrix
+from six import iteritems
+
+from cobrame.solve.symbolic import CompiledExpressions, compile_expressions
+from cobrame.util.rational import is_symbolic
+
+
+def _string_table(strings):
+    """encode strings as (utf-8 data, offsets) arrays"""
+    encoded = [i.encode("utf-8") for i in strings]
+    offsets = concatenate(([0], cumsum([len(i) for i in encoded]))).astype(
+        "<i8")
+    return frombuffer(b"".join(encoded), dtype=uint8), offsets
+
+
+def _read_string_table(data, offsets):
+    """decode a string table written by _string_table"""
+    data = data.tobytes()
+    offsets = offsets.tolist()
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8")
+            for i in range(len(offsets) - 1)]
+
+
+def _sense_codes(senses):
+    return array([ord(i) for i in senses], dtype=uint8)
+
+
+def problem_arrays(me_model, compiled_expressions=None, cache_dir=None):
+    """the numeric content of an ME-model as a dict of numpy arrays
+
+    The stoichiometric matrix is stored as a CSR matrix of its constant
+    entries, with the entries depending on mu set to 0. Those are given by
+    the compiled expressions, and "S_expression_positions" holds the
+    position of each compiled coefficient in the data of the matrix.
+    Reaction and metabolite bounds depending on mu are nan.
+    """
+    if compiled_expressions is None:
+        compiled_expressions = compile_expressions(me_model,
+                                                   cache_dir=cache_dir)
+    metabolites = me_model.metabolites
+    reactions = me_model.reactions
+    met_index = {met.id: i for i, met in enumerate(metabolites)}
+    rows = []
+    columns = []
+    values = []
+    symbolic = []
+    for j, reaction in enumerate(reactions):
+        for met, value in iteritems(reaction._metabolites):
+            if is_symbolic(value):
+                symbolic.append(len(values))
+                value = 0.
+            rows.append(met_index[met.id])
+            columns.append(j)
+            values.append(float(value))
+    shape = (len(metabolites), len(reactions))
+    pattern = coo_matrix((arange(len(values)), (rows, columns)),
+                         shape=shape).tocsr()
+    # position of each entry in the data of the CSR matrix
+    positions = empty(len(values), dtype="<i8")
+    positions[pattern.data] = arange(len(values))
+    positions = positions[array(symbolic, dtype=int)]
+    if len(positions) != len(compiled_expressions.coefficients) or \
+            (pattern.indices[positions] !=
+             compiled_expressions.coefficient_reactions).any():
+        raise ValueError("compiled expressions do not match the model")
+
+    def bounds(values):
+        return array([nan if is_symbolic(i) else float(i) for i in values])
+
+    arrays = {
+        "S_data": array(values)[pattern.data],
+        "S_indices": pattern.indices.astype("<i8"),
+        "S_indptr": pattern.indptr.astype("<i8"),
+        "S_shape": array(shape, dtype="<i8"),
+        "S_expression_positions": positions,
+        "lower_bounds": bounds(reactions.list_attr("lower_bound")),
+        "upper_bounds": bounds(reactions.list_attr("upper_bound")),
+        "objective_coefficients": array(
+            reactions.list_attr("objective_coefficient"), dtype=float),
+        "integer_variables": array(
+            [i == "integer" for i in reactions.list_attr("variable_kind")]),
+        "metabolite_bounds": bounds([i._bound for i in metabolites]),
+        "constraint_senses": _sense_codes(
+            [i._constraint_sense for i in metabolites]),
+    }
+    for name, objects in (("reaction_ids", reactions),
+                          ("metabolite_ids", metabolites)):
+        arrays[name + "__data"], arrays[name + "__offsets"] = \
+            _string_table([i.id for i in objects])
+    arrays.update(compiled_expressions.to_arrays("expressions__"))
+    return arrays
+
+
+class CompiledMEProblem(object):
+    """An ME-model compiled into arrays for solving
+
+    This holds everything needed to build and solve the LP of an ME-model
+    (the ids, the sparsity pattern and constant values of S, the compiled
+    mu-dependent coefficients and bounds, the constant bounds and the
+    objective) in a few numpy arrays, without any cobra objects. It can be
+    passed to the functions in cobrame.solve.algorithms in place of the
+    model.
+
+    Use from_model to compile a model, or cobrame.io.snapshot.load_snapshot
+    to load one from a memory-mapped snapshot.
+
+    :param str id: id of the model
+    :param dict arrays: {name: numpy.array} (see problem_arrays)
+    :param dict global_info: global_info of the model
+    """
+    def __init__(self, id, arrays, global_info):
+        self.id = id
+        self.arrays = arrays
+        self.global_info = global_info
+        self.solution = None
+        self._reaction_ids = None
+        self._metabolite_ids = None
+        self._compiled_expressions = None
+        self._solver_view = None
+
+    def __getstate__(self):
+        # the solver view is cheaper to rebuild than to pickle
+        state = dict(self.__dict__)
+        state["_solver_view"] = None
+        return state
+
+    @classmethod
+    def from_model(cls, me_model, compiled_expressions=None, cache_dir=None):
+        """compile an ME-model
+
+        :param CompiledExpressions compiled_expressions: the compiled
+            expressions of me_model (see compile_expressions)
+        :param str cache_dir: directory with cached compiled expressions
+        """
+        if compiled_expressions is None:
+            compiled_expressions = compile_expressions(me_model,
+                                                       cache_dir=cache_dir)
+        problem = cls(me_model.id, problem_arrays(
+            me_model, compiled_expressions), dict(me_model.global_info))
+        problem._compiled_expressions = compiled_expressions
+        return problem
+
+    @property
+    def reaction_ids(self):
+        if self._reaction_ids is None:
+            self._reaction_ids = _read_string_table(
+                self.arrays["reaction_ids__data"],
+                self.arrays["reaction_ids__offsets"])
+        return self._reaction_ids
+
+    @property
+    def metabolite_ids(self):
+        if self._metabolite_ids is None:
+            self._metabolite_ids = _read_string_table(
+                self.arrays["metabolite_ids__data"],
+                self.arrays["metabolite_ids__offsets"])
+        return self._metabolite_ids
+
+    @property
+    def compiled_expressions(self):
+        """the compiled expressions of the model (CompiledExpressions)"""
+        if self._compiled_expressions is None:
+            self._compiled_expressions = CompiledExpressions.from_arrays(
+                self.arrays, "expressions__")
+        return self._compiled_expressions
+
+    @property
+    def shape(self):
+        return tuple(self.arrays["S_shape"].tolist())
+
+    def construct_S(self, growth_rate):
+        """build the stoichiometric matrix at a growth rate
+
+        Returns a scipy.sparse.csr_matrix"""
+        arrays = self.arrays
+        data = array(arrays["S_data"])
+        data[arrays["S_expression_positions"]] = \
+            self.compiled_expressions.coefficients(growth_rate)
+        return csr_matrix((data, arrays["S_indices"], arrays["S_indptr"]),
+                          shape=self.shape)
+
+    def _evaluate(self, name, indexes, expressions, growth_rate):
+        values = array(self.arrays[name])
+        values[indexes] = expressions(growth_rate)
+        return values
+
+    def construct_bounds(self, growth_rate):
+        """the (lower_bounds, upper_bounds) of the reactions at a growth
+        rate"""
+        compiled = self.compiled_expressions
+        return (self._evaluate("lower_bounds", compiled.bound_reactions,
+                               compiled.lower_bounds, growth_rate),
+                self._evaluate("upper_bounds", compiled.bound_reactions,
+                               compiled.upper_bounds, growth_rate))
+
+    def construct_metabolite_bounds(self, growth_rate):
+        """the bounds of the metabolite constraints at a growth rate"""
+        compiled = self.compiled_expressions
+        return self._evaluate("metabolite_bounds",
+                              compiled.bound_metabolites,
+                              compiled.metabolite_bounds, growth_rate)
+
+    @property
+    def constraint_senses(self):
+        return [chr(i) for i in self.arrays["constraint_senses"].tolist()]
+
+    @property
+    def objective_coefficients(self):
+        return self.arrays["objective_coefficients"]
+
+    def solver_view(self, growth_rate):
+        """a minimal stand-in for the model with the values at a growth rate
+
+        The create_problem and format_solution functions of cobra solver
+        interfaces read the reactions and metabolites of a model. The view
+        provides them as light objects with only the attributes those
+        functions use, built from the arrays. The LP created from it can be
+        moved to other growth rates with substitute_mu and
+        compiled_expressions as usual.
+
+        As the solver interfaces do not accept matrices, building the view
+        still takes a Python object per reaction and metabolite. It is only
+        built once and cached, and later calls just set the values which
+        depend on mu, so the view returned by an earlier call changes too.
+        """
+        if self._solver_view is None:
+            self._solver_view = self._build_solver_view(growth_rate)
+            return self._solver_view
+        view = self._solver_view
+        compiled = self.compiled_expressions
+        for (variable, constraint), value in zip(
+                view._coefficient_entries,
+                compiled.coefficients(growth_rate).tolist()):
+            variable._metabolites[constraint] = value
+        reactions = view.reactions
+        for i, lower_bound, upper_bound in zip(
+                compiled.bound_reactions.tolist(),
+                compiled.lower_bounds(growth_rate).tolist(),
+                compiled.upper_bounds(growth_rate).tolist()):
+            reaction = list.__getitem__(reactions, i)
+            reaction.lower_bound = lower_bound
+            reaction.upper_bound = upper_bound
+        metabolites = view.metabolites
+        for i, bound in zip(compiled.bound_metabolites.tolist(),
+                            compiled.metabolite_bounds(growth_rate).tolist()):
+            list.__getitem__(metabolites, i)._bound = bound
+        return view
+
+    def _build_solver_view(self, growth_rate):
+        S = self.construct_S(growth_rate).tocsc()
+        lower_bounds, upper_bounds = self.construct_bounds(growth_rate)
+        constraints = [
+            _Constraint(i, bound, sense) for i, bound, sense in zip(
+                self.metabolite_ids,
+                self.construct_metabolite_bounds(growth_rate).tolist(),
+                self.constraint_senses)]
+        variables = []
+        rows = S.indices.tolist()
+        values = S.data.tolist()
+        indptr = S.indptr.tolist()
+        for j, (r_id, lower_bound, upper_bound, objective, integer) in \
+                enumerate(zip(self.reaction_ids, lower_bounds.tolist(),
+                              upper_bounds.tolist(),
+                              self.objective_coefficients.tolist(),
+                              self.arrays["integer_variables"].tolist())):
+            variable = _Variable(r_id, lower_bound, upper_bound, objective,
+                                 "integer" if integer else "continuous")
+            for k in range(indptr[j], indptr[j + 1]):
+                constraint = constraints[rows[k]]
+                variable._metabolites[constraint] = values[k]
+                constraint._reaction.add(variable)
+            variables.append(variable)
+        view = _SolverView(self.id, variables, constraints)
+        # the (reaction, metabolite) of each compiled coefficient
+        arrays = self.arrays
+        positions = arrays["S_expression_positions"]
+        S_rows = repeat(arange(self.shape[0]), diff(arrays["S_indptr"]))
+        view._coefficient_entries = [
+            (variables[j], constraints[i]) for i, j in zip(
+                S_rows[positions].tolist(),
+                arrays["S_indices"][positions].tolist())]
+        return view
+
+
+class _Variable(object):
+    """a reaction in a _SolverView"""
+    __slots__ = ("id", "lower_bound", "upper_bound", "objective_coefficient",
+                 "variable_kind", "_metabolites")
+
+    def __init__(self, id, lower_bound, upper_bound, objective_coefficient,
+                 variable_kind):
+        self.id = id
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.objective_coefficient = objective_coefficient
+        self.variable_kind = variable_kind
+        self._metabolites = {}
+
+    def __str__(self):
+        return self.id
+
+
+class _Constraint(object):
+    """a metabolite in a _SolverView"""
+    __slots__ = ("id", "_bound", "_constraint_sense", "_reaction")
+
+    def __init__(self, id, bound, constraint_sense):
+        self.id = id
+        self._bound = bound
+        self._constraint_sense = constraint_sense
+        self._reaction = set()
+
+    def __str__(self):
+        return self.id
+
+
+class _SolverView(object):
+    """reactions and metabolites of a CompiledMEProblem, as solver
+    interfaces read them from a model"""
+    def __init__(self, id, reactions, metabolites):
+        self.id = id
+        self.reactions = DictList(reactions)
+        self.metabolites = DictList(metabolites)
+        self._coefficient_entries = []
@@ -1,7 +1,19 @@
-from six import iteritems
-from sympy import Basic, lambdify
+from collections import defaultdict
+from errno import EEXIST
+from hashlib import sha1
+from os import close, makedirs, remove, rename
+from os.path import isfile, join
+from tempfile import mkstemp
+from warnings import warn
+
+from numpy import arange, array, empty, zeros, broadcast_to, load, savez
+from numpy.polynomial.polynomial import polyval
+from scipy.sparse import coo_matrix, csr_matrix
+from six import iteritems, text_type
+from sympy import Add, Basic, S, Symbol, expand, lambdify, sympify
 
 from cobrame import mu
+from cobrame.util.rational import RationalFunction, is_symbolic
 
 
 def _compile(expr, variable=mu):
@@ -16,45 +28,518 @@ def _eval(expr, mu):
     return expr(mu) if callable(expr) else expr
 
 
-def compile_expressions(me_model, variable=mu):
-    """compiles symbolic expressions of mu to functions
+def _is_function(expr, variable=mu):
+    """whether expr is a function of the growth rate (and not a constant)"""
+    if isinstance(expr, RationalFunction):
+        return True
+    return isinstance(expr, Basic) and variable in expr.free_symbols
 
-    The compiled expressions dict has the following key value pairs:
-    (met_index, rxn_index): stoichiometry,
-    (None, rxn_index): (lower_bound, upper_bound)
-    (met_index, None): (met_bound, met_constraint_sense)
 
+def _padded_coefficients(polynomials):
+    """stack polynomial coefficients into a (degree + 1, n) array"""
+    result = zeros((max(len(i) for i in polynomials), len(polynomials)))
+    for j, coefficients in enumerate(polynomials):
+        result[:len(coefficients), j] = coefficients
+    return result
+
+
+def _parameterize(expr, parameters, symbols):
+    """replace the numeric constants in expr with placeholder symbols
+
+    The values of the replaced constants are appended to parameters in the
+    order of the placeholder symbols. Integers are left in place because they
+    are usually exponents which determine the structure of the expression.
     """
-    expressions = {}
-    for i, r in enumerate(me_model.reactions):
-        # stoichiometry
+    if expr.is_Number:
+        if expr.is_Integer:
+            return expr
+        if len(symbols) == len(parameters):
+            symbols.append(Symbol("_p%d" % len(symbols)))
+        parameters.append(float(expr))
+        return symbols[len(parameters) - 1]
+    if not expr.args:
+        return expr
+    return expr.func(*[_parameterize(arg, parameters, symbols)
+                       for arg in expr.args], evaluate=False)
+
+
+def _decompose(shape, variable=mu):
+    """split a parameterized expression into (coefficient, template) terms
+
+    The expression is expanded into a sum of terms, and each term is split
+    into a coefficient which is independent of mu and the remaining
+    template. For example, ``_p0*mu/(mu + _p1) + _p2*mu`` becomes
+    ``[(_p0, mu/(mu + _p1)), (_p2, mu)]``. The few templates which are
+    shared by most expressions in an ME-model (``mu``, ``1/mu``,
+    ``mu/(mu + kt*r0)``, ...) then only need to be evaluated once.
+    """
+    terms = defaultdict(lambda: S.Zero)
+    for term in Add.make_args(expand(shape)):
+        coefficient, template = term.as_independent(variable, as_Add=False)
+        terms[template] += coefficient
+    return [(coefficient, template)
+            for template, coefficient in iteritems(terms)]
+
+
+def _evaluate_parameters(expr, symbols, parameters, size):
+    """evaluate an expression of placeholder symbols for arrays of values"""
+    value = lambdify(symbols, expr, modules="numpy")(*parameters)
+    return broadcast_to(array(value, dtype=float), (size,))
+
+
+class ExpressionArray(object):
+    """A vector of expressions of mu evaluated in a single vectorized pass
+
+    Expressions which only differ in their numeric constants (i.e. have the
+    same shape) are expanded only once, and every expression is canonicalized
+    into a linear combination of a small set of unique templates (see
+    _decompose), giving a sparse matrix of scalar coefficients. Evaluating
+    the array then only requires evaluating the unique templates followed by
+    one sparse matrix-vector product.
+
+    Templates which only differ in their numeric constants additionally
+    share one compiled function, which is called with the constants of every
+    template in the group stacked into arrays. RationalFunction entries are
+    evaluated directly from their stacked polynomial coefficients, and all
+    other entries which are not sympy expressions are treated as constants.
+
+    :param list expressions: sympy expressions, RationalFunctions or numbers
+    :param sympy.Symbol variable: the symbol for the growth rate
+    """
+    def __init__(self, expressions, variable=mu):
+        self.variable = variable
+        self.size = len(expressions)
+        self._constants = zeros(self.size)
+        symbols = []
+        shapes = {}
+        rational = []
+        for i, expr in enumerate(expressions):
+            if isinstance(expr, RationalFunction):
+                rational.append(i)
+                continue
+            if not _is_function(expr, variable):
+                self._constants[i] = float(expr)
+                continue
+            parameters = []
+            shape = _parameterize(expr, parameters, symbols)
+            positions, parameter_list = shapes.setdefault(shape, ([], []))
+            positions.append(i)
+            parameter_list.append(parameters)
+
+        # {canonical template: {placeholder values: column}}
+        templates = defaultdict(dict)
+        n_templates = 0
+        rows = []
+        columns = []
+        values = []
+        for shape, (positions, parameter_list) in iteritems(shapes):
+            n_parameters = len(parameter_list[0])
+            shape_symbols = symbols[:n_parameters]
+            parameters = array(parameter_list).T
+            for coefficient, template in _decompose(shape, variable):
+                coefficients = _evaluate_parameters(
+                    coefficient, shape_symbols, parameters, len(positions))
+                if variable not in template.free_symbols:
+                    self._constants[positions] += \
+                        coefficients * _evaluate_parameters(
+                            template, shape_symbols, parameters,
+                            len(positions))
+                    continue
+                # rename the placeholders in order of appearance so that
+                # equal templates from different shapes are merged
+                used = [symbols.index(p) for p in sorted(
+                    template.free_symbols - {variable}, key=symbols.index)]
+                instances = templates[template.xreplace(
+                    {symbols[k]: symbols[j] for j, k in enumerate(used)})]
+                for i, row_values, value in zip(positions, parameter_list,
+                                                coefficients.tolist()):
+                    key = tuple(row_values[k] for k in used)
+                    try:
+                        column = instances[key]
+                    except KeyError:
+                        column = instances[key] = n_templates
+                        n_templates += 1
+                    rows.append(i)
+                    columns.append(column)
+                    values.append(value)
+
+        self._coefficients = coo_matrix(
+            (values, (rows, columns)), shape=(self.size, n_templates)).tocsr()
+        self._set_rational(array(rational, dtype=int),
+                           [expressions[i].numerator for i in rational],
+                           [expressions[i].denominator for i in rational])
+        # (columns, compiled function, parameter arrays, template)
+        self._groups = []
+        self.n_templates = n_templates
+        for template, instances in iteritems(templates):
+            used = symbols[:len(template.free_symbols) - 1]
+            function = lambdify([variable] + used, template, modules="numpy")
+            self._groups.append((array(list(instances.values())), function,
+                                 list(array(list(instances), ndmin=2).T),
+                                 template))
+
+    def _set_rational(self, positions, numerators, denominators):
+        """store the RationalFunction entries as coefficient arrays"""
+        self._rational_positions = positions
+        if len(positions) > 0:
+            numerators = _padded_coefficients(numerators)
+            denominators = _padded_coefficients(denominators)
+        else:
+            numerators = denominators = zeros((1, 0))
+        self._numerators = numerators
+        self._denominators = denominators
+
+    @property
+    def n_shapes(self):
+        """number of compiled functions used to evaluate the templates"""
+        return len(self._groups)
+
+    def __len__(self):
+        return self.size
+
+    def evaluate_templates(self, value):
+        """evaluate the unique templates at mu = value"""
+        result = empty(self.n_templates)
+        for positions, function, parameters, _ in self._groups:
+            result[positions] = broadcast_to(function(value, *parameters),
+                                             positions.shape)
+        return result
+
+    def __call__(self, value):
+        """evaluate every expression at mu = value"""
+        result = self._constants + \
+            self._coefficients.dot(self.evaluate_templates(value))
+        if len(self._rational_positions) > 0:
+            result[self._rational_positions] = \
+                polyval(value, self._numerators) / \
+                polyval(value, self._denominators)
+        return result
+
+    def to_arrays(self, prefix=""):
+        """export the compiled array as a dict of numpy arrays
+
+        The templates are stored as strings and are recompiled by
+        from_arrays, all other content is numeric."""
+        coefficients = self._coefficients
+        arrays = {"constants": self._constants,
+                  "data": coefficients.data,
+                  "indices": coefficients.indices,
+                  "indptr": coefficients.indptr,
+                  "shape": array(coefficients.shape),
+                  "templates": array([str(i[3]) for i in self._groups],
+                                     dtype=text_type),
+                  "rational_positions": self._rational_positions,
+                  "numerators": self._numerators,
+                  "denominators": self._denominators}
+        for i, (columns, _, parameters, _) in enumerate(self._groups):
+            arrays["columns_%d" % i] = columns
+            arrays["parameters_%d" % i] = \
+                array(parameters).reshape(len(parameters), len(columns))
+        return {prefix + key: value for key, value in iteritems(arrays)}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix="", variable=mu):
+        """rebuild an ExpressionArray exported with to_arrays"""
+        self = cls.__new__(cls)
+        self.variable = variable
+        self._constants = arrays[prefix + "constants"]
+        self.size = len(self._constants)
+        shape = tuple(arrays[prefix + "shape"])
+        self._coefficients = csr_matrix(
+            (arrays[prefix + "data"], arrays[prefix + "indices"],
+             arrays[prefix + "indptr"]), shape=shape)
+        self.n_templates = shape[1]
+        self._groups = []
+        for i, template in enumerate(arrays[prefix + "templates"]):
+            parameters = arrays[prefix + "parameters_%d" % i]
+            template = sympify(str(template),
+                               locals={variable.name: variable})
+            used = [Symbol("_p%d" % j) for j in range(len(parameters))]
+            function = lambdify([variable] + used, template, modules="numpy")
+            self._groups.append((arrays[prefix + "columns_%d" % i], function,
+                                 list(parameters), template))
+        self._rational_positions = arrays.get(prefix + "rational_positions",
+                                              zeros(0, dtype=int))
+        self._numerators = arrays.get(prefix + "numerators", zeros((1, 0)))
+        self._denominators = arrays.get(prefix + "denominators",
+                                        zeros((1, 0)))
+        return self
+
+    def __getstate__(self):
+        # compiled functions can not be pickled, so only the arrays are
+        # and the templates are recompiled when unpickling
+        state = self.to_arrays()
+        state["variable"] = self.variable
+        return state
+
+    def __setstate__(self, state):
+        variable = state.pop("variable")
+        self.__dict__.update(
+            self.from_arrays(state, variable=variable).__dict__)
+
+
+class ParametricMatrix(object):
+    """A sparse matrix with entries which may be expressions of mu
+
+    The numeric entries are stored in a constant CSR matrix, and the entries
+    depending on mu are compiled into an ExpressionArray ordered like the
+    data of a CSR matrix with their sparsity pattern. Evaluating the matrix
+    at a growth rate then only takes one array evaluation and a sparse add.
+
+    rows, columns, values: entries of the matrix (as in a COO matrix)
+    """
+
+    def __init__(self, rows, columns, values, shape, variable=mu):
+        self.shape = shape
+        constant_entries = ([], [], [])
+        symbolic_entries = ([], [], [])
+        for row, column, value in zip(rows, columns, values):
+            if _is_function(value, variable):
+                entries = symbolic_entries
+            else:
+                entries = constant_entries
+                value = float(value)
+            entries[0].append(row)
+            entries[1].append(column)
+            entries[2].append(value)
+        rows, columns, values = constant_entries
+        self._constant = coo_matrix((values, (rows, columns)),
+                                    shape=shape).tocsr()
+        rows, columns, expressions = symbolic_entries
+        # the data of the pattern is the position of each expression
+        pattern = coo_matrix((arange(len(expressions)), (rows, columns)),
+                             shape=shape).tocsr()
+        self._indices = pattern.indices
+        self._indptr = pattern.indptr
+        self.expressions = ExpressionArray(
+            [expressions[i] for i in pattern.data], variable)
+
+    def __call__(self, value):
+        """evaluate the matrix at mu = value as a CSR matrix"""
+        symbolic = csr_matrix(
+            (self.expressions(value), self._indices, self._indptr),
+            shape=self.shape)
+        return self._constant + symbolic
+
+
+class CompiledExpressions(object):
+    """All symbolic expressions in an ME-model compiled to numpy arrays
+
+    Stoichiometric coefficients, reaction bounds and metabolite bounds which
+    depend on mu are stored as index arrays into the LP alongside an
+    ExpressionArray for their values.
+
+    :param numpy.array coefficient_metabolites: row index of each coefficient
+    :param numpy.array coefficient_reactions: column index of each coefficient
+    :param numpy.array bound_reactions: reactions with symbolic bounds
+    :param numpy.array bound_metabolites: metabolites with symbolic bounds
+    :param list constraint_senses: constraint sense of each
+        bound_metabolites entry
+    """
+    def __init__(self, me_model, variable=mu):
+        metabolite_index = {met: i
+                            for i, met in enumerate(me_model.metabolites)}
+        met_indexes = []
+        rxn_indexes = []
+        coefficients = []
+        bound_reactions = []
+        lower_bounds = []
+        upper_bounds = []
+        for i, r in enumerate(me_model.reactions):
+            # stoichiometry
+            for met, stoic in iteritems(r._metabolites):
+                if is_symbolic(stoic):
+                    met_indexes.append(metabolite_index[met])
+                    rxn_indexes.append(i)
+                    coefficients.append(stoic)
+            # If either the lower or upper reaction bounds are symbolic
+            if is_symbolic(r.lower_bound) or is_symbolic(r.upper_bound):
+                bound_reactions.append(i)
+                lower_bounds.append(r.lower_bound)
+                upper_bounds.append(r.upper_bound)
+        # Metabolite bound
+        bound_metabolites = []
+        senses = []
+        metabolite_bounds = []
+        for i, metabolite in enumerate(me_model.metabolites):
+            if is_symbolic(metabolite._bound):
+                bound_metabolites.append(i)
+                senses.append(metabolite._constraint_sense)
+                metabolite_bounds.append(metabolite._bound)
+
+        self.coefficient_metabolites = array(met_indexes, dtype=int)
+        self.coefficient_reactions = array(rxn_indexes, dtype=int)
+        self.coefficients = ExpressionArray(coefficients, variable)
+        self.bound_reactions = array(bound_reactions, dtype=int)
+        self.lower_bounds = ExpressionArray(lower_bounds, variable)
+        self.upper_bounds = ExpressionArray(upper_bounds, variable)
+        self.bound_metabolites = array(bound_metabolites, dtype=int)
+        self.constraint_senses = senses
+        self.metabolite_bounds = ExpressionArray(metabolite_bounds, variable)
+
+    def __len__(self):
+        return len(self.coefficients) + len(self.bound_reactions) + \
+            len(self.bound_metabolites)
+
+    _index_arrays = ("coefficient_metabolites", "coefficient_reactions",
+                     "bound_reactions", "bound_metabolites")
+    _expression_arrays = ("coefficients", "lower_bounds", "upper_bounds",
+                          "metabolite_bounds")
+
+    def to_arrays(self, prefix=""):
+        """export the compiled expressions as a dict of numpy arrays"""
+        arrays = {name: getattr(self, name) for name in self._index_arrays}
+        arrays["constraint_senses"] = array(self.constraint_senses,
+                                            dtype=text_type)
+        arrays = {prefix + key: value for key, value in iteritems(arrays)}
+        for name in self._expression_arrays:
+            arrays.update(getattr(self, name).to_arrays(
+                prefix + name + "__"))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix="", variable=mu):
+        """rebuild compiled expressions exported with to_arrays"""
+        self = cls.__new__(cls)
+        for name in self._index_arrays:
+            setattr(self, name, arrays[prefix + name])
+        self.constraint_senses = [
+            str(i) for i in arrays[prefix + "constraint_senses"]]
+        for name in self._expression_arrays:
+            setattr(self, name, ExpressionArray.from_arrays(
+                arrays, prefix + name + "__", variable))
+        return self
+
+    def save(self, file_name):
+        """save the compiled expressions to an uncompressed .npz file"""
+        with open(file_name, "wb") as outfile:
+            savez(outfile, **self.to_arrays())
+
+    @classmethod
+    def load(cls, file_name, variable=mu):
+        """load compiled expressions written by save"""
+        with load(file_name) as arrays:
+            return cls.from_arrays(dict(arrays), variable=variable)
+
+    def evaluate(self, mu):
+        """evaluate all expressions at a growth rate
+
+        returns a tuple of (coefficients, lower_bounds, upper_bounds,
+        metabolite_bounds) arrays, ordered like the corresponding index
+        arrays"""
+        return (self.coefficients(mu), self.lower_bounds(mu),
+                self.upper_bounds(mu), self.metabolite_bounds(mu))
+
+
+def _expression_string(expr):
+    """a string which uniquely represents an expression
+
+    This is much faster to generate than str(expr), which is not needed
+    for hashing since the string does not have to be human readable."""
+    if isinstance(expr, RationalFunction):
+        return "RationalFunction(%r,%r)" % (expr.numerator, expr.denominator)
+    if not isinstance(expr, Basic):
+        return repr(float(expr))
+    if expr.is_Number:
+        return str(int(expr)) if expr.is_Integer else repr(float(expr))
+    if not expr.args:
+        return str(expr)
+    return expr.func.__name__ + "(" + \
+        ",".join(_expression_string(arg) for arg in expr.args) + ")"
+
+
+def model_fingerprint(me_model, variable=mu):
+    """hash of the symbolic content of a model
+
+    The fingerprint covers the order of the reactions and metabolites and the
+    position and string of every symbolic stoichiometry and bound, i.e. all
+    of the information used by compile_expressions.
+    """
+    fingerprint = sha1(variable.name.encode())
+    for r in me_model.reactions:
+        items = [r.id]
         for met, stoic in iteritems(r._metabolites):
-            if isinstance(stoic, Basic):
-                expressions[(me_model.metabolites.index(met), i)] = \
-                    lambdify(variable, stoic)
-        # If either the lower or upper reaction bounds are symbolic
-        if isinstance(r.lower_bound, Basic) or \
-                isinstance(r.upper_bound, Basic):
-            expressions[(None, i)] = (_compile(r.lower_bound, variable),
-                                      _compile(r.upper_bound, variable))
-    # Metabolite bound
-    for i, metabolite in enumerate(me_model.metabolites):
-        if isinstance(metabolite._bound, Basic):
-            expressions[(i, None)] = (_compile(metabolite._bound, variable),
-                                      metabolite._constraint_sense)
-    return expressions
+            if is_symbolic(stoic):
+                items.append(met.id + ":" + _expression_string(stoic))
+        if is_symbolic(r.lower_bound) or is_symbolic(r.upper_bound):
+            items.append("bounds:" + _expression_string(r.lower_bound) +
+                         "," + _expression_string(r.upper_bound))
+        fingerprint.update(("\t".join(items) + "\n").encode())
+    for metabolite in me_model.metabolites:
+        items = [metabolite.id]
+        if is_symbolic(metabolite._bound):
+            items.append(metabolite._constraint_sense + ":" +
+                         _expression_string(metabolite._bound))
+        fingerprint.update(("\t".join(items) + "\n").encode())
+    return fingerprint.hexdigest()
 
 
-def substitute_mu(lp, mu, compiled_exressions, solver_module=None):
-    """substitute mu into a constructed LP
+# version of the layout of the cached arrays, which is part of the names
+# of cache entries so that entries written by other versions are not loaded
+_CACHE_VERSION = 2
+
+
+def _make_cache_dir(cache_dir):
+    # other processes may create the directory at the same time
+    try:
+        makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != EEXIST:
+            raise
+
+
+def compile_expressions(me_model, variable=mu, cache_dir=None):
+    """compiles symbolic expressions of mu to vectorized functions
+
+    Returns a :class:`CompiledExpressions` with an index array and a
+    vectorized evaluator for the symbolic stoichiometries, reaction bounds
+    and metabolite bounds in the model.
+
+    cache_dir: str or None
+        If given, the compiled expressions are stored in this directory
+        under the fingerprint of the model (see model_fingerprint), and
+        loaded from there instead of being recompiled when a model with the
+        same symbolic content is compiled again. A changed model has a new
+        fingerprint, and entries of other cache versions have other names,
+        so stale entries are never used.
 
-    mu: float
     """
-    # This only works for object-oriented solver interfaces. For other
-    # solvers, need to pass in solver_module
-    if solver_module is None:
-        solver_module = lp.__class__
-    for index, expr in iteritems(compiled_exressions):
+    if cache_dir is None:
+        return CompiledExpressions(me_model, variable)
+
+    file_name = join(cache_dir, "cobrame_v%d_%s.npz" %
+                     (_CACHE_VERSION, model_fingerprint(me_model, variable)))
+    if isfile(file_name):
+        try:
+            return CompiledExpressions.load(file_name, variable)
+        except Exception as e:
+            warn("could not load cached expressions '%s': %s" %
+                 (file_name, str(e)))
+    compiled_expressions = CompiledExpressions(me_model, variable)
+    _make_cache_dir(cache_dir)
+    # write to a temporary file first so concurrent processes never load a
+    # partially written cache entry
+    fd, temp_name = mkstemp(dir=cache_dir, suffix=".npz")
+    close(fd)
+    try:
+        compiled_expressions.save(temp_name)
+        rename(temp_name, file_name)
+    except Exception:
+        remove(temp_name)
+        raise
+    return compiled_expressions
+
+
+def _substitute_mu_dict(lp, mu, compiled_expressions, solver_module):
+    """substitute mu using the legacy dict of compiled expressions
+
+    The dict has the following key value pairs:
+    (met_index, rxn_index): stoichiometry,
+    (None, rxn_index): (lower_bound, upper_bound)
+    (met_index, None): (met_bound, met_constraint_sense)
+
+    """
+    for index, expr in iteritems(compiled_expressions):
         if index[0] is None:  # reaction bounds
             solver_module.change_variable_bounds(
                 lp, index[1], _eval(expr[0], mu), _eval(expr[1], mu))
@@ -64,3 +549,44 @@ def substitute_mu(lp, mu, compiled_exressions, solver_module=None):
         else:  # stoichiometry
             solver_module.change_coefficient(lp, index[0], index[1],
                                              _eval(expr, mu))
+
+
+def substitute_mu(lp, mu, compiled_exressions, solver_module=None):
+    """substitute mu into a constructed LP
+
+    mu: float
+
+    compiled_exressions: :class:`CompiledExpressions` (or a dict in the
+    format previously returned by compile_expressions)
+
+    All values are computed in one vectorized pass, and then set in the LP
+    through the change_variable_bounds, change_constraint and
+    change_coefficient functions of the solver interface.
+    """
+    # This only works for object-oriented solver interfaces. For other
+    # solvers, need to pass in solver_module
+    if solver_module is None:
+        solver_module = lp.__class__
+    if isinstance(compiled_exressions, dict):
+        _substitute_mu_dict(lp, mu, compiled_exressions, solver_module)
+        return
+    coefficients, lower_bounds, upper_bounds, metabolite_bounds = \
+        compiled_exressions.evaluate(mu)
+
+    change_variable_bounds = solver_module.change_variable_bounds
+    for i, lb, ub in zip(compiled_exressions.bound_reactions.tolist(),
+                         lower_bounds.tolist(), upper_bounds.tolist()):
+        change_variable_bounds(lp, i, lb, ub)
+
+    change_constraint = solver_module.change_constraint
+    for i, sense, value in zip(compiled_exressions.bound_metabolites.tolist(),
+                               compiled_exressions.constraint_senses,
+                               metabolite_bounds.tolist()):
+        change_constraint(lp, i, sense, value)
+
+    change_coefficient = solver_module.change_coefficient
+    for i, j, value in zip(
+            compiled_exressions.coefficient_metabolites.tolist(),
+            compiled_exressions.coefficient_reactions.tolist(),
+            coefficients.tolist()):
+        change_coefficient(lp, i, j, value)
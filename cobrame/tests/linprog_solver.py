@@ -0,0 +1,103 @@
+"""A minimal cobra solver interface on scipy.optimize.linprog for the tests
+
+The LP is stored as dense arrays, so this is only suitable for small
+models. Symbolic values are set to 0 when the problem is created, as they
+are substituted by substitute_mu before solving.
+"""
+from __future__ import division, absolute_import
+
+from cobra.core.Solution import Solution
+from numpy import array, concatenate, vstack, zeros
+from scipy.optimize import linprog
+
+solver_name = "linprog"
+
+
+def _float(value):
+    try:
+        return float(value)
+    except TypeError:
+        return 0.
+
+
+class LP(object):
+    pass
+
+
+def create_problem(model, **kwargs):
+    lp = LP()
+    metabolite_index = {met.id: i for i, met in enumerate(model.metabolites)}
+    n_reactions = len(model.reactions)
+    lp.S = zeros((len(model.metabolites), n_reactions))
+    lp.lower_bounds = zeros(n_reactions)
+    lp.upper_bounds = zeros(n_reactions)
+    lp.objective = zeros(n_reactions)
+    for j, reaction in enumerate(model.reactions):
+        lp.lower_bounds[j] = _float(reaction.lower_bound)
+        lp.upper_bounds[j] = _float(reaction.upper_bound)
+        lp.objective[j] = reaction.objective_coefficient
+        for met, value in reaction._metabolites.items():
+            lp.S[metabolite_index[met.id], j] = _float(value)
+    lp.bounds = array([_float(met._bound) for met in model.metabolites])
+    lp.senses = [met._constraint_sense for met in model.metabolites]
+    lp.status = None
+    return lp
+
+
+def change_variable_bounds(lp, index, lower_bound, upper_bound):
+    lp.lower_bounds[index] = lower_bound
+    lp.upper_bounds[index] = upper_bound
+
+
+def change_variable_objective(lp, index, value):
+    lp.objective[index] = value
+
+
+def change_coefficient(lp, met_index, rxn_index, value):
+    lp.S[met_index, rxn_index] = value
+
+
+def change_constraint(lp, met_index, sense, value):
+    lp.senses[met_index] = sense
+    lp.bounds[met_index] = value
+
+
+def set_parameter(lp, name, value):
+    pass
+
+
+def solve_problem(lp, objective_sense="maximize", **kwargs):
+    sign = -1. if objective_sense == "maximize" else 1.
+    equal = [i for i, sense in enumerate(lp.senses) if sense == "E"]
+    less = [i for i, sense in enumerate(lp.senses) if sense == "L"]
+    greater = [i for i, sense in enumerate(lp.senses) if sense == "G"]
+    A_ub = b_ub = None
+    if less or greater:
+        A_ub = vstack([lp.S[less], -lp.S[greater]])
+        b_ub = concatenate([lp.bounds[less], -lp.bounds[greater]])
+    result = linprog(sign * lp.objective, A_ub=A_ub, b_ub=b_ub,
+                     A_eq=lp.S[equal], b_eq=lp.bounds[equal],
+                     bounds=list(zip(lp.lower_bounds, lp.upper_bounds)),
+                     method="highs")
+    lp.status = {0: "optimal", 2: "infeasible"}.get(result.status, "failed")
+    lp.x = result.x
+    lp.objective_value = sign * result.fun if lp.status == "optimal" \
+        else None
+    return lp.status
+
+
+def get_status(lp):
+    return lp.status
+
+
+def get_objective_value(lp):
+    return lp.objective_value
+
+
+def format_solution(lp, model):
+    solution = Solution(lp.objective_value, status=lp.status)
+    if lp.status == "optimal":
+        solution.x = lp.x.tolist()
+        solution.x_dict = {reaction.id: value for reaction, value in
+                           zip(model.reactions, solution.x)}
+    return solution
@@ -0,0 +1,46 @@
+from __future__ import division, absolute_import, print_function
+
+from random import Random
+
+from cobrame.util.building import _TUIndex
+
+
+def scan_TUs(TUs, left_pos, right_pos, strand):
+    """the TUs containing a gene, found as build_reactions_from_genbank did
+    before _TUIndex"""
+    return [TU_id for TU_id, start, stop, TU_strand in TUs
+            if start - 1 <= left_pos and stop >= right_pos and
+            TU_strand == strand]
+
+
+def test_TU_index():
+    TUs = [("outer", 1, 100, "+"), ("nested", 11, 50, "+"),
+           ("same_start", 11, 30, "+"), ("after", 101, 200, "+"),
+           ("minus", 1, 200, "-")]
+    index = _TUIndex(TUs)
+    # nested TUs and TUs with identical starts
+    assert sorted(index.containing(10, 30, "+")) == \
+        ["nested", "outer", "same_start"]
+    assert sorted(index.containing(10, 31, "+")) == ["nested", "outer"]
+    # a gene spanning the boundary of two TUs is in neither
+    assert index.containing(90, 110, "+") == []
+    assert index.containing(100, 110, "+") == ["after"]
+    assert index.containing(90, 110, "-") == ["minus"]
+    assert index.containing(0, 10, "x") == []
+
+    rand = Random(0)
+    TUs = []
+    for i in range(200):
+        start = rand.randint(1, 1000)
+        TUs.append(("TU%d" % i, start, start + rand.randint(0, 300),
+                    rand.choice("+-")))
+    # identical starts and stops
+    TUs.extend([("TU_start", TUs[0][1], TUs[0][2] + 5, TUs[0][3]),
+                ("TU_copy", ) + TUs[1][1:]])
+    index = _TUIndex(TUs)
+    for _ in range(1000):
+        left_pos = rand.randint(0, 1300)
+        right_pos = left_pos + rand.randint(1, 200)
+        strand = rand.choice("+-")
+        assert sorted(index.containing(left_pos, right_pos, strand)) == \
+            sorted(scan_TUs(TUs, left_pos, right_pos, strand))
@@ -0,0 +1,90 @@
+from __future__ import division, absolute_import, print_function
+
+import json
+
+import pytest
+from six import StringIO
+
+from cobrame import mu
+from cobrame.core.MEModel import MEModel
+from cobrame.core.MEReactions import MetabolicReaction
+from cobrame.io.jsonme import load_json_me, save_json_me
+from cobrame.tests.test_symbolic import get_symbolic_model
+from cobrame.tests.test_update import get_metabolic_model
+
+
+def test_save_json_me():
+    model = get_symbolic_model()
+    outfile = StringIO()
+    save_json_me(model, outfile)
+    saved = json.loads(outfile.getvalue())
+    assert [i["id"] for i in saved["reactions"]] == \
+        [i.id for i in model.reactions]
+    reaction = saved["reactions"][model.reactions.index("R1")]
+    assert reaction["upper_bound"] == "2*mu"
+    assert reaction["metabolites"]["c"] == 2.
+    assert reaction["metabolites"]["b"] == str(3 * mu / 65. / 3600.)
+    # the model itself is not modified
+    assert model.reactions.R1.upper_bound == 2 * mu
+
+
+def test_load_json_me():
+    model = get_symbolic_model()
+    outfile = StringIO()
+    save_json_me(model, outfile)
+    outfile.seek(0)
+    loaded = load_json_me(outfile)
+    for reaction in model.reactions:
+        loaded_reaction = loaded.reactions.get_by_id(reaction.id)
+        assert loaded_reaction.upper_bound == reaction.upper_bound
+        for met, value in reaction._metabolites.items():
+            loaded_value = loaded_reaction._metabolites[
+                loaded.metabolites.get_by_id(met.id)]
+            if hasattr(value, "subs"):
+                assert loaded_value.free_symbols == {mu}
+                value = value.subs(mu, 0.3)
+                loaded_value = loaded_value.subs(mu, 0.3)
+            assert float(loaded_value) == pytest.approx(float(value))
+
+
+def test_load_json_me_model():
+    model = get_metabolic_model()
+    model.global_info["met_start_codons"] = {"AUG", "GUG"}
+    outfile = StringIO()
+    save_json_me(model, outfile)
+    outfile.seek(0)
+    loaded = load_json_me(outfile)
+    assert isinstance(loaded, MEModel)
+    assert [i.id for i in loaded.process_data] == \
+        [i.id for i in model.process_data]
+    assert loaded.global_info == model.global_info
+    reaction = loaded.reactions.R1_FWD
+    assert isinstance(reaction, MetabolicReaction)
+    assert reaction.stoichiometric_data is loaded.stoichiometric_data.R1
+    assert loaded.reactions.biomass_dilution.upper_bound == mu
+    # the loaded model can be updated
+    data = loaded.stoichiometric_data.R1
+    data._stoichiometry = {"a": -2, "b": 1}
+    assert loaded._dirty_reactions == {"R1_FWD"}
+    loaded.update(dirty_only=True)
+    assert reaction.metabolites[loaded.metabolites.a] == -2
+
+
+def test_snapshot(tmpdir):
+    from cobrame.io.snapshot import load_snapshot, save_snapshot
+    model = get_symbolic_model()
+    file_name = str(tmpdir.join("model.snapshot"))
+    save_snapshot(model, file_name)
+    snapshot = load_snapshot(file_name)
+    assert snapshot.reaction_ids == [i.id for i in model.reactions]
+    assert snapshot.metabolite_ids == [i.id for i in model.metabolites]
+    growth_rate = 0.4
+    assert abs(snapshot.construct_S(growth_rate) -
+               model.construct_S(growth_rate)).max() < 1e-12
+    lower_bounds, upper_bounds = snapshot.construct_bounds(growth_rate)
+    assert list(upper_bounds) == pytest.approx(list(
+        model.construct_attribute_vector("upper_bound", growth_rate)))
+    # the arrays are mapped read-only
+    assert not snapshot.arrays["S_data"].flags.writeable
+    loaded = snapshot.load_model()
+    assert loaded.reactions.R1.upper_bound == 2 * mu
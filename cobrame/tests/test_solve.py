@@ -0,0 +1,324 @@
+from __future__ import division, absolute_import, print_function
+
+import pytest
+from numpy import isnan
+from cobra.core.Solution import Solution
+
+import linprog_solver
+from cobrame.core.Components import Complex, Metabolite, TranscribedGene, \
+    TranslatedGene
+from cobrame.core.MEModel import MEModel
+from cobrame.core.MEReactions import ComplexFormation, MEReaction, \
+    MetabolicReaction
+from cobrame.solve.algorithms import binary_search, fva, \
+    solve_at_growth_rate
+from cobrame.solve.parallel import iter_fva, parallel_binary_search, \
+    parallel_fva, screen_conditions, sweep_growth_rates
+from cobrame.util import mu
+from cobrame.util.rational import numeric_mu
+
+
+class MarginSolver(object):
+    """solver interface whose LP is feasible while margin(mu) >= 0
+
+    The growth rate is read from the bounds of biomass_dilution set by
+    substitute_mu, and the objective value is the margin."""
+    def __init__(self, margin):
+        self.margin = margin
+
+    @staticmethod
+    def create_problem(model):
+        return {"index": model.reactions.index("biomass_dilution")}
+
+    @staticmethod
+    def change_variable_bounds(lp, index, lower_bound, upper_bound):
+        if index == lp["index"]:
+            lp["mu"] = upper_bound
+
+    @staticmethod
+    def change_constraint(lp, met_index, sense, value):
+        pass
+
+    @staticmethod
+    def change_coefficient(lp, met_index, rxn_index, value):
+        pass
+
+    def solve_problem(self, lp):
+        lp["margin"] = self.margin(lp["mu"])
+
+    @staticmethod
+    def get_status(lp):
+        return "optimal" if lp["margin"] >= 0 else "infeasible"
+
+    @staticmethod
+    def get_objective_value(lp):
+        return lp["margin"]
+
+    def format_solution(self, lp, model):
+        return Solution(lp["margin"], status=self.get_status(lp))
+
+
+def get_growth_model():
+    """a model which grows up to mu = (sqrt(5) - 1) / 2
+
+    Growth uses 1 + mu of the 1 unit of a taken up, and the rest is
+    consumed by the objective."""
+    model = MEModel("growth")
+    model.add_metabolites([Metabolite("a")])
+    uptake = MEReaction("EX_a")
+    growth = MEReaction("growth")
+    dummy = MEReaction("dummy")
+    model.add_reactions([uptake, growth, dummy])
+    uptake.add_metabolites({model.metabolites.a: 1})
+    uptake.upper_bound = 1
+    growth.add_metabolites({model.metabolites.a: -(1 + mu),
+                            model._biomass: 1})
+    dummy.add_metabolites({model.metabolites.a: -1})
+    dummy.objective_coefficient = 1
+    return model
+
+
+def get_gene_model():
+    """a model which grows on a or b, each through the enzyme of a gene"""
+    model = get_growth_model()
+    model.add_metabolites([Metabolite("b")])
+    uptake = MEReaction("EX_b")
+    model.add_reaction(uptake)
+    uptake.add_metabolites({model.metabolites.b: 1})
+    uptake.upper_bound = 1
+    model.remove_reactions([model.reactions.growth])
+    for gene, substrate in (("g1", "a"), ("g2", "b")):
+        RNA = TranscribedGene("RNA_" + gene)
+        protein = TranslatedGene("protein_" + gene)
+        cplx = Complex("CPLX_" + gene)
+        model.add_metabolites([RNA, protein, cplx])
+        substrate = model.metabolites.get_by_id(substrate)
+        transcription = MEReaction("transcription_TU_" + gene)
+        translation = MEReaction("translation_" + gene)
+        formation = ComplexFormation("formation_CPLX_" + gene)
+        formation._complex_id = cplx.id
+        growth = MetabolicReaction("growth_" + gene)
+        model.add_reactions([transcription, translation, formation, growth])
+        transcription.add_metabolites({substrate: -0.01, RNA: 1})
+        translation.add_metabolites({substrate: -0.01, RNA: -1,
+                                     protein: 1})
+        formation.add_metabolites({protein: -1, cplx: 1})
+        growth.add_metabolites({substrate: -(1 + mu), model._biomass: 1,
+                                cplx: -mu / 10})
+    return model
+
+
+@pytest.mark.parametrize("margin", [
+    lambda mu: 0.7321 - mu,
+    lambda mu: 0.7321 ** 2 - mu ** 2,
+    lambda mu: 1 - 2.5 ** (8 * (mu - 0.7321)),
+    # margins of ME-models shrink roughly as a rational function of mu
+    lambda mu: 0.05 * (0.7321 - mu) / (mu + 0.3)])
+def test_brent_search(margin):
+    model = MEModel("search")
+    mu_accuracy = 1e-9
+    bisection = binary_search(model, mu_accuracy=mu_accuracy, verbose=False,
+                              solver=MarginSolver(margin))
+    brent = binary_search(model, mu_accuracy=mu_accuracy, verbose=False,
+                          solver=MarginSolver(margin), method="brent")
+    assert abs(bisection.f - 0.7321) < mu_accuracy
+    assert abs(brent.f - bisection.f) < mu_accuracy
+    assert brent.n_solves <= bisection.n_solves
+
+
+def test_parallel_binary_search():
+    model = get_growth_model()
+    mu_accuracy = 1e-6
+    serial = binary_search(model, mu_accuracy=mu_accuracy, verbose=False,
+                           solver=linprog_solver)
+    assert abs(serial.f - (5 ** 0.5 - 1) / 2) < mu_accuracy
+    parallel = parallel_binary_search(model, mu_accuracy=mu_accuracy,
+                                      processes=3, verbose=False,
+                                      solver=linprog_solver)
+    assert abs(parallel.f - serial.f) < mu_accuracy
+    assert parallel.n_rounds < serial.n_solves
+
+
+def test_parallel_fva():
+    model = get_growth_model()
+    reactions = ["EX_a", "growth", "dummy"]
+    serial = fva(model, 0.5, reactions, solver=linprog_solver)
+    assert serial["dummy"]["maximum"] == pytest.approx(0.25)
+    # results are yielded as they are computed
+    results = iter_fva(model, 0.5, reactions, processes=2, chunk_size=1,
+                       solver=linprog_solver)
+    assert next(results)[0] in reactions
+    results.close()
+    parallel = parallel_fva(model, 0.5, reactions, processes=2,
+                            chunk_size=1, solver=linprog_solver)
+    assert set(parallel) == set(reactions)
+    for r_id in reactions:
+        for what in ("minimum", "maximum"):
+            assert parallel[r_id][what] == \
+                pytest.approx(serial[r_id][what], abs=1e-9)
+
+
+def test_fva_checkpoint(tmpdir):
+    model = get_growth_model()
+    reactions = ["EX_a", "growth", "dummy"]
+    checkpoint = str(tmpdir.join("fva.tsv"))
+    # a run interrupted while writing the line of growth
+    with open(checkpoint, "w") as outfile:
+        outfile.write("id\tminimum\tmaximum\nEX_a\t7.0\tNone\n"
+                      "growth\t0.5\t0.4")
+    results = parallel_fva(model, 0.5, reactions, processes=2,
+                           chunk_size=1, checkpoint=checkpoint,
+                           solver=linprog_solver)
+    # EX_a is not solved again
+    assert results["EX_a"] == {"minimum": 7.0, "maximum": None}
+    assert results["growth"]["maximum"] == pytest.approx(0.5)
+    with open(checkpoint) as infile:
+        lines = infile.read().splitlines()
+    assert len(lines) == 4
+    assert sorted(line.split("\t")[0] for line in lines[1:]) == \
+        sorted(reactions)
+    for line in lines[2:]:
+        assert [float(i) for i in line.split("\t")[1:]] == \
+            [results[line.split("\t")[0]][what]
+             for what in ("minimum", "maximum")]
+    # the finished checkpoint is read without solving
+    assert parallel_fva(model, 0.5, reactions, checkpoint=checkpoint,
+                        solver=None) == results
+    # only the last line may be malformed
+    with open(checkpoint, "w") as outfile:
+        outfile.write("id\tminimum\tmaximum\nEX_a\tnp.float64(7.0)\t1.0\n"
+                      "growth\t0.5\t0.5\n")
+    with pytest.raises(ValueError):
+        parallel_fva(model, 0.5, reactions, checkpoint=checkpoint,
+                     solver=linprog_solver)
+    # files which are not checkpoints are not overwritten
+    with open(checkpoint, "w") as outfile:
+        outfile.write("some other file\n")
+    with pytest.raises(ValueError):
+        parallel_fva(model, 0.5, reactions, checkpoint=checkpoint,
+                     solver=linprog_solver)
+    with open(checkpoint) as infile:
+        assert infile.read() == "some other file\n"
+
+
+@pytest.mark.parametrize("processes", [None, 2])
+@pytest.mark.parametrize("k_deg", [12., 0.])
+@pytest.mark.parametrize("growth_rate", [mu, numeric_mu])
+def test_sweep_growth_rates(processes, k_deg, growth_rate):
+    model = get_growth_model()
+    # the coefficients of degradation fluxes divide by mu, and mRNA
+    # degradation makes the model infeasible at mu = 0
+    model.global_info["k_deg"] = k_deg
+    degradation = MEReaction("degradation")
+    model.add_reaction(degradation)
+    degradation.add_metabolites({model.metabolites.a: -0.01 / growth_rate})
+    degradation.upper_bound = 0
+    fluxes = sweep_growth_rates(model, [0, 0.3, 0.9], processes=processes,
+                                solver=linprog_solver)
+    assert fluxes.shape == (len(model.reactions), 3)
+    assert isnan(fluxes[:, 0]).all()
+    growth = model.reactions.index("growth")
+    assert fluxes[growth, 1] == pytest.approx(0.3)
+    # infeasible as the growth uses more than the uptake of a
+    assert isnan(fluxes[:, 2]).all()
+
+
+@pytest.mark.parametrize("method", ["bisection", "brent"])
+def test_screen_conditions(method):
+    model = get_gene_model()
+    conditions = {"base": {}, "g1": {"knockouts": ["g1"]},
+                  "no_b": {"bounds": {"EX_b": (0, 0)}},
+                  "dead": {"knockouts": ["g1"],
+                           "bounds": {"EX_b": (0, 0)}}}
+    mu_accuracy = 1e-6
+    results = screen_conditions(model, conditions, processes=2,
+                                mu_accuracy=mu_accuracy, verbose=False,
+                                method=method, solver=linprog_solver)
+    assert model.reactions.EX_b.upper_bound == 1
+    assert results.status["dead"] == "infeasible"
+    assert results.growth_rate["dead"] == 0
+
+    def growth_rate(**bounds):
+        for r_id, value in bounds.items():
+            model.reactions.get_by_id(r_id).upper_bound = value
+        solution = binary_search(model, mu_accuracy=mu_accuracy,
+                                 verbose=False, solver=linprog_solver)
+        for r_id in bounds:
+            model.reactions.get_by_id(r_id).upper_bound = 1000 \
+                if r_id.startswith("growth") else 1
+        return solution.f
+
+    expected = {"base": growth_rate(), "g1": growth_rate(growth_g1=0),
+                "no_b": growth_rate(EX_b=0)}
+    assert expected["base"] > expected["g1"] > 0
+    for name, value in expected.items():
+        assert results.status[name] == "optimal"
+        assert abs(results.growth_rate[name] - value) < mu_accuracy
+
+
+@pytest.mark.parametrize("compile_problem", ["compiled", "snapshot"])
+def test_solve_compiled_problem(compile_problem, tmpdir):
+    from cobrame.io.snapshot import load_snapshot, save_snapshot
+    from cobrame.solve.problem import CompiledMEProblem
+    model = get_growth_model()
+    if compile_problem == "compiled":
+        problem = CompiledMEProblem.from_model(model)
+    else:
+        file_name = str(tmpdir.join("model.snapshot"))
+        save_snapshot(model, file_name, include_model=False)
+        problem = load_snapshot(file_name)
+    mu_accuracy = 1e-6
+    reactions = [i.id for i in model.reactions]
+
+    def same_fluxes(solution, expected):
+        assert solution.x == pytest.approx(expected.x, abs=1e-9)
+
+    expected = binary_search(model, mu_accuracy=mu_accuracy, verbose=False,
+                             solver=linprog_solver)
+    solution = binary_search(problem, mu_accuracy=mu_accuracy,
+                             verbose=False, solver=linprog_solver)
+    assert solution.f == expected.f
+    same_fluxes(solution, expected)
+    solution = parallel_binary_search(problem, mu_accuracy=mu_accuracy,
+                                      processes=2, verbose=False,
+                                      solver=linprog_solver)
+    assert abs(solution.f - expected.f) < mu_accuracy
+    assert problem.solution is solution
+    same_fluxes(solve_at_growth_rate(problem, 0.3, solver=linprog_solver),
+                solve_at_growth_rate(model, 0.3, solver=linprog_solver))
+
+    expected = fva(model, 0.5, reactions, solver=linprog_solver)
+    for results in (fva(problem, 0.5, reactions, solver=linprog_solver),
+                    parallel_fva(problem, 0.5, reactions, processes=2,
+                                 chunk_size=2, solver=linprog_solver)):
+        assert set(results) == set(reactions)
+        for r_id in reactions:
+            for what in ("minimum", "maximum"):
+                assert results[r_id][what] == \
+                    pytest.approx(expected[r_id][what], abs=1e-9)
+
+    mus = [0.3, 0.5, 0.9]
+    expected = sweep_growth_rates(model, mus, solver=linprog_solver)
+    for processes in (None, 2):
+        fluxes = sweep_growth_rates(problem, mus, processes=processes,
+                                    solver=linprog_solver)
+        assert fluxes.shape == expected.shape
+        assert (isnan(fluxes) == isnan(expected)).all()
+        assert fluxes[~isnan(fluxes)] == \
+            pytest.approx(expected[~isnan(expected)], abs=1e-9)
+
+    # conditions on a compiled problem can only change bounds
+    conditions = {"base": {}, "more_a": {"bounds": {"EX_a": (0, 2)}}}
+    results = screen_conditions(problem, conditions, processes=2,
+                                mu_accuracy=mu_accuracy, verbose=False,
+                                solver=linprog_solver)
+    expected = screen_conditions(model, conditions, processes=2,
+                                 mu_accuracy=mu_accuracy, verbose=False,
+                                 solver=linprog_solver)
+    assert list(results.status) == ["optimal"] * 2
+    assert results.growth_rate["more_a"] == pytest.approx(1, abs=1e-5)
+    assert abs(results.growth_rate - expected.growth_rate).max() < \
+        mu_accuracy
+    with pytest.raises(ValueError):
+        screen_conditions(problem, [{"knockouts": ["g1"]}], processes=1,
+                          verbose=False, solver=linprog_solver)
@@ -0,0 +1,226 @@
+from __future__ import division, absolute_import, print_function
+
+import pytest
+from sympy import sympify
+
+from cobrame import mu
+from cobrame.core.MEModel import MEModel
+from cobrame.core.Components import Metabolite
+from cobrame.core.MEReactions import MEReaction
+from cobrame.solve.symbolic import ExpressionArray, _CACHE_VERSION, \
+    _make_cache_dir, compile_expressions, substitute_mu
+
+
+def get_symbolic_model():
+    model = MEModel("symbolic")
+    model.add_metabolites([Metabolite(i) for i in ("a", "b", "c")])
+    for i in range(5):
+        reaction = MEReaction("R%d" % i)
+        model.add_reaction(reaction)
+        kt = 4.5 + i
+        reaction.add_metabolites({
+            "a": -(i + 1) * mu / (mu + kt * 0.087),
+            "b": (i + 2) * mu / 65. / 3600.,
+            "c": 2.,
+        })
+        reaction.upper_bound = (i + 1) * mu
+    return model
+
+
+class FakeLP(object):
+    def __init__(self):
+        self.coefficients = {}
+        self.bounds = {}
+        self.constraints = {}
+
+    @staticmethod
+    def change_coefficient(lp, met_index, rxn_index, value):
+        lp.coefficients[met_index, rxn_index] = value
+
+    @staticmethod
+    def change_variable_bounds(lp, rxn_index, lower_bound, upper_bound):
+        lp.bounds[rxn_index] = (lower_bound, upper_bound)
+
+    @staticmethod
+    def change_constraint(lp, met_index, sense, value):
+        lp.constraints[met_index] = (sense, value)
+
+
+def test_compile_expressions():
+    model = get_symbolic_model()
+    compiled = compile_expressions(model)
+    growth_rate = 0.43
+    lp = FakeLP()
+    substitute_mu(lp, growth_rate, compiled)
+    symbolic = 0
+    for j, reaction in enumerate(model.reactions):
+        for met, value in reaction._metabolites.items():
+            if not hasattr(value, "subs"):
+                continue
+            symbolic += 1
+            i = model.metabolites.index(met)
+            expected = float(value.subs(mu, growth_rate))
+            assert lp.coefficients[i, j] == pytest.approx(expected, rel=1e-12)
+        if hasattr(reaction.upper_bound, "subs"):
+            assert lp.bounds[j][1] == pytest.approx(
+                float(reaction.upper_bound.subs(mu, growth_rate)))
+    assert len(lp.coefficients) == symbolic
+    # coefficients are factored into a few templates (mu and mu / (mu + c))
+    # and templates only differing in their constants share one function
+    assert compiled.coefficients.n_templates == 6
+    assert compiled.coefficients.n_shapes == 2
+
+
+def test_substitute_mu_legacy_dict():
+    from sympy import lambdify
+    model = get_symbolic_model()
+    model.metabolites.c._bound = 2 * mu
+    # the dict format previously returned by compile_expressions
+    legacy = {}
+    for j, reaction in enumerate(model.reactions):
+        for met, value in reaction._metabolites.items():
+            if hasattr(value, "subs"):
+                legacy[model.metabolites.index(met), j] = lambdify(mu, value)
+        bounds = (reaction.lower_bound, reaction.upper_bound)
+        if any(hasattr(i, "subs") for i in bounds):
+            legacy[None, j] = tuple(lambdify(mu, i) for i in bounds)
+    for i, met in enumerate(model.metabolites):
+        if hasattr(met._bound, "subs"):
+            legacy[i, None] = (lambdify(mu, met._bound),
+                               met._constraint_sense)
+    compiled_lp = FakeLP()
+    substitute_mu(compiled_lp, 0.43, compile_expressions(model))
+    legacy_lp = FakeLP()
+    substitute_mu(legacy_lp, 0.43, legacy)
+    for attribute in ("coefficients", "bounds", "constraints"):
+        compiled = getattr(compiled_lp, attribute)
+        expected = getattr(legacy_lp, attribute)
+        assert set(compiled) == set(expected)
+        for key, value in expected.items():
+            assert compiled[key] == pytest.approx(value, rel=1e-12)
+    assert compiled_lp.constraints[model.metabolites.index("c")] == \
+        ("E", pytest.approx(0.86))
+
+
+def test_compiled_expression_cache(tmpdir):
+    model = get_symbolic_model()
+    cache_dir = str(tmpdir)
+    compiled = compile_expressions(model, cache_dir=cache_dir)
+    assert len(tmpdir.listdir()) == 1
+    cached = compile_expressions(model, cache_dir=cache_dir)
+    for expected, value in zip(compiled.evaluate(0.3), cached.evaluate(0.3)):
+        assert list(value) == list(expected)
+    # modifying the model invalidates the cached entry
+    model.reactions.R0.add_metabolites({"c": mu}, combine=False)
+    compile_expressions(model, cache_dir=cache_dir)
+    assert len(tmpdir.listdir()) == 2
+    # the directory may be created by another process in the meantime
+    cache_dir = str(tmpdir.join("new"))
+    _make_cache_dir(cache_dir)
+    compile_expressions(model, cache_dir=cache_dir)
+    assert tmpdir.join("new").listdir()[0].basename.startswith(
+        "cobrame_v%d_" % _CACHE_VERSION)
+
+
+def test_construct_S():
+    model = get_symbolic_model()
+    growth_rate = 0.7
+    S = model.construct_S(growth_rate)
+    assert S.format == "csr"
+    assert S.shape == (len(model.metabolites), len(model.reactions))
+    for j, reaction in enumerate(model.reactions):
+        for met, value in reaction._metabolites.items():
+            i = model.metabolites.index(met)
+            expected = float(value.subs(mu, growth_rate)) \
+                if hasattr(value, "subs") else value
+            assert S[i, j] == pytest.approx(expected, rel=1e-12)
+
+
+def test_parametric_S_cache():
+    model = get_symbolic_model()
+    S = model.get_parametric_S()
+    assert model.get_parametric_S() is S
+    c = model.metabolites.index("c")
+    j = model.reactions.index("R0")
+    assert model.construct_S(0.5)[c, j] == 2.
+    # updating a reaction invalidates the cached matrix
+    model.reactions.R0.add_metabolites({"c": mu}, combine=False)
+    assert model.get_parametric_S() is not S
+    assert model.construct_S(0.5)[c, j] == 0.5
+    # bounds are checked against the cached values
+    j = model.reactions.index("R1")
+    assert model.construct_attribute_vector("upper_bound", 0.5)[j] == 1.
+    model.reactions.R1.upper_bound = 3.
+    assert model.construct_attribute_vector("upper_bound", 0.5)[j] == 3.
+
+
+def test_compute_solution_error():
+    from cobra.core.Solution import Solution
+    model = get_symbolic_model()
+    x = [0.] * len(model.reactions)
+    j = model.reactions.index("R1")
+    x[j] = 2.
+    x[model.reactions.index("biomass_dilution")] = 0.5
+    errors = model.compute_solution_error(Solution(0.5, x=x))
+    # R1 is bounded by 2 * mu
+    assert errors["upper_bound_error"] == pytest.approx(1.)
+    assert errors["bound_errors"] == [("R1", pytest.approx(1.))]
+    assert errors["max_error"] == pytest.approx(4.)
+    assert errors["metabolite_errors"][0] == ("c", pytest.approx(4.))
+    # a, b, c and biomass are not balanced
+    assert len(errors["metabolite_errors"]) == 4
+
+
+def test_rational_function():
+    from cobrame.util.rational import RationalFunction, numeric_mu
+    kt = 4.5 * 0.087
+    value = -2 * numeric_mu / (numeric_mu + kt)
+    expected = -2 * mu / (mu + kt)
+    assert isinstance(value, RationalFunction)
+    assert value(0.3) == pytest.approx(float(expected.subs(mu, 0.3)))
+    assert value < 0 and abs(value) > 0
+    assert numeric_mu / numeric_mu == 1.
+    assert RationalFunction.from_sympy(expected) == value
+    assert float(sympify(str(value)).subs("mu", 0.3)) == \
+        pytest.approx(value(0.3))
+    # rational functions are evaluated like sympy expressions
+    compiled = ExpressionArray([value, expected, 2.])(0.3)
+    assert list(compiled) == pytest.approx([value(0.3)] * 2 + [2.])
+    model = get_symbolic_model()
+    model.mu = numeric_mu
+    assert model.reactions.biomass_dilution.upper_bound is numeric_mu
+    model.reactions.R0.add_metabolites({"a": value}, combine=False)
+    j = model.reactions.index("R0")
+    assert model.construct_S(0.3)[model.metabolites.index("a"), j] == \
+        pytest.approx(value(0.3))
+    assert model.construct_attribute_vector("upper_bound", 0.3)[
+        model.reactions.index("biomass_dilution")] == pytest.approx(0.3)
+
+
+def test_compiled_problem():
+    from cobrame.solve.problem import CompiledMEProblem
+    model = get_symbolic_model()
+    problem = CompiledMEProblem.from_model(model)
+    growth_rate = 0.3
+    assert abs(problem.construct_S(growth_rate) -
+               model.construct_S(growth_rate)).max() < 1e-12
+    view = problem.solver_view(growth_rate)
+    assert [i.id for i in view.reactions] == [i.id for i in model.reactions]
+    reaction = view.reactions.get_by_id("R1")
+    assert reaction.upper_bound == pytest.approx(2 * growth_rate)
+    a = view.metabolites.get_by_id("a")
+    assert reaction in a._reaction
+    assert reaction._metabolites[a] == pytest.approx(
+        float(model.reactions.R1.metabolites[model.metabolites.a].subs(
+            mu, growth_rate)))
+    # the view is cached and moved to other growth rates
+    assert problem.solver_view(0.5) is view
+    fresh = CompiledMEProblem.from_model(model).solver_view(0.5)
+    for cached, reaction in zip(view.reactions, fresh.reactions):
+        assert (cached.lower_bound, cached.upper_bound) == \
+            (reaction.lower_bound, reaction.upper_bound)
+        assert {met.id: value for met, value in
+                cached._metabolites.items()} == \
+            {met.id: value for met, value in reaction._metabolites.items()}
+    assert [i._bound for i in view.metabolites] == \
+        [i._bound for i in fresh.metabolites]
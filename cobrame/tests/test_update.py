@@ -0,0 +1,273 @@
+from __future__ import division, absolute_import, print_function
+
+import pytest
+from numpy import arange
+
+from cobrame.core.MEModel import MEModel
+from cobrame.core.parallel_update import update_reactions_in_parallel
+from cobrame.core.Components import Complex, Metabolite, \
+    TranscribedGene
+from cobrame.core.MEReactions import MetabolicReaction, TranscriptionReaction
+from cobrame.core.ProcessData import ComplexData, StoichiometricData, \
+    TranscriptionData, TranslationData
+from cobrame.util import mu
+from cobrame.util.building import add_complex_to_model, \
+    add_transcription_reaction, add_translation_reaction, \
+    create_transcribed_gene
+from cobrame.util.mass import compute_RNA_mass
+
+
+def get_metabolic_model():
+    model = MEModel("metabolic")
+    model.add_metabolites([Metabolite(i) for i in ("a", "b")])
+    for i in range(3):
+        data = StoichiometricData("R%d" % i, model)
+        data._stoichiometry = {"a": -1, "b": i + 1}
+        reaction = MetabolicReaction("R%d_FWD" % i)
+        model.add_reaction(reaction)
+        reaction.stoichiometric_data = data
+    model.update()
+    return model
+
+
+def get_expression_model():
+    """a model with the transcription, translation and complex formation of
+    two genes"""
+    model = MEModel("expression")
+    model.global_info = {"kt": 4.5, "k_deg": 12., "r0": 0.087,
+                         "m_rr": 1453., "f_rRNA": .86, "m_aa": .109,
+                         "m_nt": .324, "f_mRNA": .02,
+                         "met_start_codons": {"AUG"}}
+    formulas = {"atp_c": "C10H12N5O13P3", "utp_c": "C9H11N2O15P3",
+                "gtp_c": "C10H12N5O14P3", "ctp_c": "C9H12N3O14P3",
+                "amp_c": "C10H12N5O7P", "ump_c": "C9H11N2O9P",
+                "gmp_c": "C10H12N5O8P", "cmp_c": "C9H12N3O8P",
+                "met__L_c": "C5H11NO2S", "lys__L_c": "C6H15N2O2",
+                "ala__L_c": "C3H7NO2", "ppi_c": "HO7P2", "h2o_c": "H2O",
+                "h_c": "H", "adp_c": "C10H12N5O10P2", "pi_c": "HO4P"}
+    for met_id, formula in sorted(formulas.items()):
+        met = Metabolite(met_id)
+        met.formula = formula
+        model.add_metabolites([met])
+    model.add_metabolites([Complex(i) for i in
+                           ("RNAP", "ribosome", "RNA_degradosome")])
+    for gene, sequence in (("g1", "ATGAAAGCTTAA"),
+                           ("g2", "ATGGCTGCTAAATAA")):
+        create_transcribed_gene(model, gene, 0, len(sequence), sequence, "+",
+                                "mRNA")
+        add_transcription_reaction(model, "TU_" + gene, {gene}, sequence,
+                                   update=False)
+        model.transcription_data.get_by_id("TU_" + gene).RNA_polymerase = \
+            "RNAP"
+        add_translation_reaction(model, gene, dna_sequence=sequence)
+        add_complex_to_model(model, "CPLX_" + gene, {"protein_" + gene: 2})
+        model.complex_data.get_by_id("CPLX_" + gene).create_complex_formation(
+            verbose=False)
+    return model
+
+
+def test_update_dirty_only():
+    model = get_metabolic_model()
+    assert len(model._dirty_reactions) == 0
+    data = model.stoichiometric_data.R1
+    data.upper_bound = 10.
+    data._stoichiometry = {"a": -2, "b": 1}
+    assert model._dirty_reactions == {"R1_FWD"}
+    model.update(dirty_only=True)
+    reaction = model.reactions.R1_FWD
+    assert reaction.upper_bound == 10.
+    assert reaction.metabolites[model.metabolites.a] == -2
+    assert model.reactions.R0_FWD.upper_bound == 1000.
+    assert len(model._dirty_reactions) == 0
+
+
+def test_update_dirty_reaction_attributes():
+    model = get_metabolic_model()
+    model.add_metabolites([Complex("CPLX")])
+    reaction = model.reactions.R1_FWD
+    reaction.complex_data = ComplexData("CPLX", model)
+    model.update()
+    reaction.keff = 130.
+    assert model._dirty_reactions == {"R1_FWD"}
+    model.update(dirty_only=True)
+    assert reaction.metabolites[model.metabolites.CPLX] == -mu / 130. / 3600.
+    # membership tests of global_info are recorded as reads
+    model.global_info = {}
+    model._updating_reaction = "R0_FWD"
+    assert "k_deg" not in model.global_info
+    model._updating_reaction = None
+    model.global_info["k_deg"] = 12.
+    assert model._dirty_reactions == {"R0_FWD"}
+
+
+def test_aggregate_fluxes():
+    model = get_metabolic_model()
+    data = TranscriptionData("TU1", model, RNA_products={"RNA_g1"})
+    transcription = TranscriptionReaction("transcription_TU1")
+    model.add_reaction(transcription)
+    transcription.transcription_data = data
+    fluxes = arange(len(model.reactions), dtype=float)
+
+    def aggregate(kind):
+        ids, values = model.aggregate_fluxes(fluxes, kind)
+        return dict(zip(ids, values.tolist()))
+
+    index = model.reactions.index
+    assert aggregate("metabolic") == {"R%d" % i: index("R%d_FWD" % i)
+                                      for i in range(3)}
+    assert aggregate("transcription") == {"g1": index("transcription_TU1")}
+    # the cached index follows changes to reactions and process data
+    model.reactions.R1_FWD.reverse = True
+    assert aggregate("metabolic")["R1"] == -index("R1_FWD")
+    model.reactions.R0_FWD.stoichiometric_data = "R2"
+    assert aggregate("metabolic")["R2"] == index("R0_FWD") + index("R2_FWD")
+    model.stoichiometric_data.R1.id = "R3"
+    assert "R3" in aggregate("metabolic")
+    data.RNA_products = {"RNA_g2"}
+    assert aggregate("transcription") == {"g2": index("transcription_TU1")}
+
+
+def test_update_in_parallel():
+    model = get_metabolic_model()
+    model.stoichiometric_data.R2._stoichiometry = {"a": -3, "b": 1}
+    model.update(processes=2)
+    for i, reaction in enumerate(model.reactions.query("_FWD")):
+        data = model.stoichiometric_data.get_by_id("R%d" % i)
+        assert {met.id: value for met, value in
+                reaction.metabolites.items()} == data.stoichiometry
+        assert reaction in model.metabolites.a.reactions
+
+
+def test_update_expression_in_parallel():
+    serial = get_expression_model()
+    serial.update()
+    model = get_expression_model()
+    update_reactions_in_parallel(model, model.reactions, processes=2,
+                                 chunk_size=1)
+    assert [i.id for i in model.metabolites] == \
+        [i.id for i in serial.metabolites]
+    for reaction in serial.reactions:
+        parallel = model.reactions.get_by_id(reaction.id)
+        assert {met.id: value for met, value in
+                parallel.metabolites.items()} == \
+            {met.id: value for met, value in reaction.metabolites.items()}
+        assert (parallel.lower_bound, parallel.upper_bound) == \
+            (reaction.lower_bound, reaction.upper_bound)
+    for met in serial.metabolites:
+        assert model.metabolites.get_by_id(met.id).formula == met.formula
+    # complex formulas are built from the formulas of translated proteins
+    assert model.metabolites.CPLX_g1.formula == "C30H58N8O10S2"
+    assert len(model._dirty_reactions) == 0
+
+
+def test_update_expression_numeric_mu():
+    from cobrame.util.rational import numeric_mu
+    symbolic = get_expression_model()
+    symbolic.update()
+    model = get_expression_model()
+    model.mu = numeric_mu
+    model.update()
+    growth_rate = 0.3
+
+    def evaluate(value):
+        if hasattr(value, "subs"):
+            return float(value.subs(mu, growth_rate))
+        elif callable(value):
+            return value(growth_rate)
+        return value
+
+    for reaction in symbolic.reactions:
+        numeric = model.reactions.get_by_id(reaction.id)
+        expected = {met.id: evaluate(value)
+                    for met, value in reaction.metabolites.items()}
+        assert {met.id: evaluate(value)
+                for met, value in numeric.metabolites.items()} == \
+            pytest.approx(expected, rel=1e-12)
+        assert evaluate(numeric.upper_bound) == \
+            pytest.approx(evaluate(reaction.upper_bound))
+    for met in symbolic.metabolites:
+        assert model.metabolites.get_by_id(met.id).formula == met.formula
+
+
+def test_sequence_cache():
+    model = MEModel("sequence")
+    model.global_info = {"met_start_codons": {"AUG"}}
+    data = TranslationData("g", model, "RNA_g", "protein_g")
+    data.nucleotide_sequence = "ATGAAAGCTTAA"
+    assert data.amino_acid_sequence == "MKA"
+    mass = data.mass
+    # changes to the returned counts do not affect the cached values
+    data.codon_count["AAA"] += 1
+    assert data.codon_count == {"AUG": 0, "AAA": 1, "GCU": 1}
+    # assigning a new sequence invalidates the cached values
+    data.nucleotide_sequence = "ATGAAAAAAGCTTAA"
+    assert data.amino_acid_sequence == "MKKA"
+    assert data.codon_count["AAA"] == 2
+    assert data.mass > mass
+
+
+def test_cache_sequence_properties():
+    from cobrame.util.building import cache_sequence_properties
+    model = MEModel("sequence")
+    model.global_info = {"met_start_codons": {"AUG", "GUG"}}
+    sequences = ["ATGAAAGCTTAA", "GTGTGAGGCAAAGCTTAGTAA", "ATGCCNGCTAAATAA",
+                 "CCCAAATAA"]
+    for i, sequence in enumerate(sequences):
+        data = TranslationData("g%d" % i, model, "RNA_g%d" % i,
+                               "protein_g%d" % i)
+        data.nucleotide_sequence = sequence
+    properties = ("amino_acid_sequence", "codon_count", "amino_acid_count",
+                  "mass")
+    expected = [[getattr(data, i) for i in properties]
+                for data in model.translation_data]
+    for data in model.translation_data:
+        data.nucleotide_sequence = data.nucleotide_sequence
+    cache_sequence_properties(model)
+    # sequences with an N or without a start codon are not cached
+    assert [len(i._sequence_cache) for i in model.translation_data] == \
+        [4, 4, 0, 1]
+    for data, values in zip(model.translation_data, expected):
+        assert [getattr(data, i) for i in properties] == values
+
+
+def test_cache_transcription_properties():
+    from cobrame.util.building import cache_sequence_properties
+    model = MEModel("sequence")
+    sequences = ["ATGAAAGCTTAA", "ACGTNACGT", "AAATTTAAA", "atgc", ""]
+    for i, sequence in enumerate(sequences):
+        data = TranscriptionData("TU%d" % i, model)
+        data.nucleotide_sequence = sequence
+        gene = TranscribedGene("RNA_g%d" % i)
+        gene.nucleotide_sequence = sequence
+        model.add_metabolites([gene])
+    genes = model.metabolites.query("RNA_g")
+    expected_counts = [i.nucleotide_count for i in model.transcription_data]
+    expected_gene_counts = [i.nucleotide_count for i in genes]
+    for item in list(model.transcription_data) + genes:
+        item.nucleotide_sequence = item.nucleotide_sequence
+    cache_sequence_properties(model)
+    # sequences with other characters than A, C, G and T are not cached
+    assert ["nucleotide_count" in i._sequence_cache
+            for i in model.transcription_data] == \
+        [True, False, True, False, True]
+    assert [i.nucleotide_count for i in model.transcription_data] == \
+        expected_counts
+    assert [i.nucleotide_count for i in genes] == expected_gene_counts
+    # compute_RNA_mass needs every base, so only the first mass is cached
+    assert ["mass" in i._sequence_cache for i in genes] == \
+        [True, False, False, False, False]
+    assert genes[0].mass == pytest.approx(compute_RNA_mass(sequences[0]))
+
+
+def test_get_components_from_ids():
+    model = get_metabolic_model()
+    reaction = model.reactions.R0_FWD
+    n_metabolites = len(model.metabolites)
+    stoichiometry = reaction.get_components_from_ids(
+        {"a": -1, "c": 1, "d": 2}, verbose=False)
+    assert stoichiometry[model.metabolites.a] == -1
+    # missing components are created and added to the model
+    assert len(model.metabolites) == n_metabolites + 2
+    assert stoichiometry[model.metabolites.d] == 2
+    assert reaction.get_components_from_ids({"c": 3}, verbose=False) == \
+        {model.metabolites.c: 3}
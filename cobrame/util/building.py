@@ -1,11 +1,15 @@
 from __future__ import print_function, division, absolute_import
 
+from bisect import bisect_right
+from collections import defaultdict
+
 import cobra
-import pandas
 from Bio import SeqIO
 from six import iteritems
 
 from cobrame import *
+from cobrame.util.sequences import SequenceTable, amino_acid_counts, \
+    protein_masses
 
 
 def add_transcription_reaction(me_model, TU_name, locus_ids, sequence,
@@ -194,94 +198,79 @@ def convert_aa_codes_and_add_charging(me_model, tRNA_aa, tRNA_to_codon,
             charging_reaction.update(verbose=verbose)
 
 
-def build_reactions_from_genbank(me_model, gb_filename, TU_frame=None,
-                                 element_types={'CDS', 'rRNA', 'tRNA', 'ncRNA'},
-                                 verbose=True, frameshift_dict={},
-                                 tRNA_to_codon={}, update=True):
-
-    # TODO handle special RNAse without type ('b3123')
-    """Creates and adds transcription and translation reactions using genomic
-     information from the organism's genbank file. Adds in the basic
-     requirements for these reactions. Organism specific components are added
-     ...
-
-    Args:
-        me_model: cobra.model.MEModel
-            The MEModel object to which the reaction will be added
+class _TUIndex(object):
+    """Index of TUs for finding the TUs which contain a gene
 
-        gb_filename: String
-            Local name of the genbank file that will be used for ME-model
-            construction
-
-        TU_frame: pandas.DataFrame
-            DataFrame with indexes of the transcription unit name and columns
-            containing the transcription unit starting and stopping location on
-            the genome and whether the transcription unit is found on the
-            main (+) strand or complementary (-) strand.
-
-            If no transcription unit DataFrame is passed into the function,
-            transcription units are added corresponding to each transcribed
-            gene in the genbank file.
-
-        element_types: Set
-            Transcription reactions will be added to the ME-model for all RNA
-            feature.types in this set. This uses the nomenclature of the
-            genbank file (gb_filename)
-
-
-        verbose: Boolean
-            If True, display metabolites that were not previously added to the
-            model and were thus added when creating charging reactions
-
-        translation_terminators: Dict
-            {stop_codon: release_factor}
-
-            Used to determine which ProcessData.SubReaction to add to the
-            TranslationReaction to account for termination of peptide
-
-        frameshift_dict: Dict
-            {locus_id: genome_position_of_TU}
-
-            If a locus_id is in the frameshift_dict, update it's nucleotide
-            sequence to account of the frameshift
+    The TUs of each strand are sorted by start, and a binary tree of the
+    largest stop in each block of TUs is used to skip the blocks which can
+    not contain the gene. A lookup then takes O(log n) per TU found instead
+    of a scan over all TUs.
 
+    TUs: list
+        (TU_id, start, stop, strand) tuples, with 1-based starts
     """
-
-    # Load genbank file and extract DNA sequence
-    gb_file = SeqIO.read(gb_filename, 'gb')
-    full_seq = str(gb_file.seq)
-
-    # Dictionary of tRNA locus ID to the 3 letter code for the amino acid it
-    # contributes
-    tRNA_aa = {}
-
-    # If no TU_frame is provided generate a new TU frame where each mRNA gets
-    # its own TU
-    using_TUs = TU_frame is not None
-    if not using_TUs:
-        TU_frame = pandas.DataFrame.from_dict(
-            {"TU_" + i.qualifiers["locus_tag"][0]:
-                {"start": int(i.location.start),
-                 "stop": int(i.location.end),
-                 "strand": "+" if i.strand == 1 else "-"}
-             for i in gb_file.features if
-             i.type in element_types},
-            orient="index")
+    def __init__(self, TUs):
+        intervals = defaultdict(list)
+        for TU_id, start, stop, strand in TUs:
+            intervals[strand].append((int(start) - 1, int(stop), TU_id))
+        self._strands = {}
+        for strand, strand_intervals in iteritems(intervals):
+            strand_intervals.sort(key=lambda i: i[0])
+            size = 1
+            while size < len(strand_intervals):
+                size *= 2
+            tree = [float("-inf")] * (2 * size)
+            tree[size:size + len(strand_intervals)] = \
+                [i[1] for i in strand_intervals]
+            for i in range(size - 1, 0, -1):
+                tree[i] = max(tree[2 * i], tree[2 * i + 1])
+            self._strands[strand] = ([i[0] for i in strand_intervals],
+                                     [i[2] for i in strand_intervals],
+                                     tree, size)
+
+    def containing(self, left_pos, right_pos, strand):
+        """ids of the TUs on strand which contain [left_pos, right_pos)"""
+        if strand not in self._strands:
+            return []
+        starts, TU_ids, tree, size = self._strands[strand]
+        # only the TUs starting at or before left_pos can contain the gene
+        end = bisect_right(starts, left_pos)
+        found = []
+        nodes = [(1, 0, size)]
+        while nodes:
+            node, low, high = nodes.pop()
+            if low >= end or tree[node] < right_pos:
+                continue
+            if node >= size:
+                found.append(TU_ids[node - size])
+                continue
+            middle = (low + high) // 2
+            nodes.append((2 * node + 1, middle, high))
+            nodes.append((2 * node, low, middle))
+        return found
+
+
+def _add_genbank_record(me_model, record, TUs, element_types, verbose,
+                        frameshift_dict, tRNA_aa):
+    """add the TUs and genes of a genbank record to the model
+
+    See build_reactions_from_genbank for the arguments"""
+    full_seq = str(record.seq)
 
     # Create transcription reactions for each TU and DNA sequence.
     # RNA_products will be added so no need to update now
-    for TU_id in TU_frame.index:
+    for TU_id, start, stop, strand in TUs:
         # subtract 1 from TU start site to account for 0 indexing
-        sequence = dogma.extract_sequence(full_seq, TU_frame.start[TU_id]-1,
-                                          TU_frame.stop[TU_id],
-                                          TU_frame.strand[TU_id])
+        sequence = dogma.extract_sequence(full_seq, int(start) - 1,
+                                          int(stop), strand)
 
         add_transcription_reaction(me_model, TU_id, set(), sequence,
                                    update=False)
+    TU_index = _TUIndex(TUs)
 
     # Associate each feature (RNA_product) with a TU and add translation
     # reactions and demands
-    for feature in gb_file.features:
+    for feature in record.features:
 
         # Skip if not a gene used in ME construction
         if feature.type not in element_types or 'pseudo' in feature.qualifiers:
@@ -292,7 +281,7 @@ def build_reactions_from_genbank(me_model, gb_filename, TU_frame=None,
         left_pos = int(feature.location.start)
         right_pos = int(feature.location.end)
         RNA_type = 'mRNA' if feature.type == 'CDS' else feature.type
-        strand = '+' if feature.strand == 1 else '-'
+        strand = '+' if feature.location.strand == 1 else '-'
         seq = dogma.extract_sequence(full_seq, left_pos, right_pos, strand)
 
         # ---- Add gene metabolites and apply frameshift mutations----
@@ -339,9 +328,7 @@ def build_reactions_from_genbank(me_model, gb_filename, TU_frame=None,
                 me_model._mRNA_biomass: -compute_RNA_mass(seq)})
 
         # ---- Associate TranscribedGene to a TU ----
-        parent_TU = TU_frame[
-            (TU_frame.start - 1 <= left_pos) & (TU_frame.stop >= right_pos) & (
-            TU_frame.strand == strand)].index
+        parent_TU = TU_index.containing(left_pos, right_pos, strand)
 
         if len(parent_TU) == 0:
             if verbose:
@@ -355,15 +342,167 @@ def build_reactions_from_genbank(me_model, gb_filename, TU_frame=None,
             me_model.transcription_data.get_by_id(TU_id).RNA_products.add(
                     "RNA_" + bnum)
 
+
+def build_reactions_from_genbank(me_model, gb_filename, TU_frame=None,
+                                 element_types={'CDS', 'rRNA', 'tRNA', 'ncRNA'},
+                                 verbose=True, frameshift_dict={},
+                                 tRNA_to_codon={}, update=True):
+
+    # TODO handle special RNAse without type ('b3123')
+    """Creates and adds transcription and translation reactions using genomic
+     information from the organism's genbank file. Adds in the basic
+     requirements for these reactions. Organism specific components are added
+     ...
+
+    Args:
+        me_model: cobra.model.MEModel
+            The MEModel object to which the reaction will be added
+
+        gb_filename: String
+            Local name of the genbank file that will be used for ME-model
+            construction
+
+        TU_frame: pandas.DataFrame
+            DataFrame with indexes of the transcription unit name and columns
+            containing the transcription unit starting and stopping location on
+            the genome and whether the transcription unit is found on the
+            main (+) strand or complementary (-) strand.
+
+            If no transcription unit DataFrame is passed into the function,
+            transcription units are added corresponding to each transcribed
+            gene in the genbank file.
+
+        element_types: Set
+            Transcription reactions will be added to the ME-model for all RNA
+            feature.types in this set. This uses the nomenclature of the
+            genbank file (gb_filename)
+
+
+        verbose: Boolean
+            If True, display metabolites that were not previously added to the
+            model and were thus added when creating charging reactions
+
+        translation_terminators: Dict
+            {stop_codon: release_factor}
+
+            Used to determine which ProcessData.SubReaction to add to the
+            TranslationReaction to account for termination of peptide
+
+        frameshift_dict: Dict
+            {locus_id: genome_position_of_TU}
+
+            If a locus_id is in the frameshift_dict, update it's nucleotide
+            sequence to account of the frameshift
+
+    """
+
+    # Dictionary of tRNA locus ID to the 3 letter code for the amino acid it
+    # contributes
+    tRNA_aa = {}
+
+    # Records are read one at a time. If no TU_frame is provided, each mRNA
+    # gets its own TU, so the file can contain multiple records (i.e.
+    # chromosomes and plasmids). Otherwise the TU positions refer to a
+    # single record.
+    using_TUs = TU_frame is not None
+    if using_TUs:
+        records = [SeqIO.read(gb_filename, 'gb')]
+        TUs = list(zip(TU_frame.index, TU_frame.start, TU_frame.stop,
+                       TU_frame.strand))
+    else:
+        records = SeqIO.parse(gb_filename, 'gb')
+
+    for record in records:
+        if not using_TUs:
+            TUs = {"TU_" + i.qualifiers["locus_tag"][0]:
+                   (int(i.location.start), int(i.location.end),
+                    "+" if i.location.strand == 1 else "-")
+                   for i in record.features if i.type in element_types}
+            TUs = [(TU_id,) + TU for TU_id, TU in iteritems(TUs)]
+        _add_genbank_record(me_model, record, TUs, element_types, verbose,
+                            frameshift_dict, tRNA_aa)
+
     convert_aa_codes_and_add_charging(me_model, tRNA_aa, tRNA_to_codon,
                                       verbose=verbose)
 
+    cache_sequence_properties(me_model)
+
     if update:
         for r in me_model.reactions:
             if isinstance(r, (TranscriptionReaction, TranslationReaction)):
                 r.update()
 
 
+def cache_sequence_properties(me_model):
+    """Compute the sequence properties of all genes in a few vectorized passes
+
+    The sequences of all TranslationData, TranscriptionData and
+    TranscribedGenes are analyzed with SequenceTables, and the results are
+    stored as their cached codon and amino acid counts, amino acid
+    sequences, nucleotide counts and masses. Reaction updates then use these
+    instead of processing each sequence on its own. Sequences with unusual
+    content (i.e. characters other than A, C, G and T or no start codon) are
+    left to be processed by the properties themselves.
+
+    Args:
+        me_model: cobra.model.MEModel
+            The MEModel whose sequence properties will be computed
+    """
+    start_codons = me_model.global_info.get("met_start_codons", ())
+
+    # translation
+    data = list(me_model.translation_data)
+    table = SequenceTable(i.nucleotide_sequence for i in data)
+    valid = table.valid.tolist()
+    amino_acid_sequences = table.translate()
+    for i, codon_count in enumerate(table.codon_counts()):
+        if not valid[i]:
+            continue
+        data[i]._sequence_cache["codon_count"] = dict(codon_count)
+        sequence = amino_acid_sequences[i]
+        if not sequence.startswith("M"):
+            if data[i].first_codon not in start_codons:
+                valid[i] = False
+                continue
+            amino_acid_sequences[i] = "M" + sequence[1:]
+    aa_counts, aa_table = amino_acid_counts(amino_acid_sequences)
+    masses = protein_masses(aa_table).tolist()
+    for i, translation_data in enumerate(data):
+        if valid[i]:
+            cache = translation_data._sequence_cache
+            cache["amino_acid_sequence"] = amino_acid_sequences[i]
+            cache["amino_acid_count"] = dict(aa_counts[i])
+            cache["mass"] = masses[i]
+
+    # transcription
+    nucleotides = ("A", "T", "G", "C")
+    columns = ["ACGT".index(i) for i in nucleotides]
+    data = list(me_model.transcription_data)
+    table = SequenceTable(i.nucleotide_sequence for i in data)
+    valid = table.valid.tolist()
+    counts = table.nucleotide_counts[:, columns].tolist()
+    for i, transcription_data in enumerate(data):
+        if valid[i]:
+            transcription_data._sequence_cache["nucleotide_count"] = \
+                {transcription_table[b]: n
+                 for b, n in zip(nucleotides, counts[i])}
+
+    genes = [i for i in me_model.metabolites
+             if isinstance(i, TranscribedGene)]
+    table = SequenceTable(i.nucleotide_sequence for i in genes)
+    valid = table.valid.tolist()
+    counts = table.nucleotide_counts[:, columns].tolist()
+    masses = table.RNA_masses.tolist()
+    for i, gene in enumerate(genes):
+        if valid[i]:
+            gene._sequence_cache["nucleotide_count"] = \
+                {transcription_table[b].replace("tp_c", "mp_c"): n
+                 for b, n in zip(nucleotides, counts[i])}
+            # compute_RNA_mass requires every base to be present
+            if all(counts[i]):
+                gene._sequence_cache["mass"] = masses[i]
+
+
 def add_m_model_content(me_model, m_model, complex_metabolite_ids=[]):
     """
     Add metabolite and reaction attributes to me_model from m_model. Also
@@ -582,6 +721,20 @@ def add_metabolic_reaction_to_model(me_model, stoichiometric_data_id,
             catalyzed)
 
     """
+    r = _create_metabolic_reaction(me_model, stoichiometric_data_id,
+                                   directionality, complex_id=complex_id,
+                                   spontaneous=spontaneous, keff=keff)
+    me_model.add_reaction(r)
+    if update:
+        r.update(verbose=True)
+
+
+def _create_metabolic_reaction(me_model, stoichiometric_data_id,
+                               directionality, complex_id=None,
+                               spontaneous=False, keff=65):
+    """create a MetabolicReaction without adding it to the model
+
+    See add_metabolic_reaction_to_model for the arguments"""
     # Get stoichiometric data for reaction being added
     try:
         stoichiometric_data = \
@@ -617,14 +770,12 @@ def add_metabolic_reaction_to_model(me_model, stoichiometric_data_id,
         raise NameError("Reaction direction must be 'forward' or 'reverse'")
 
     r = MetabolicReaction(stoichiometric_data_id + direction + complex_id)
-    me_model.add_reaction(r)
     r.keff = keff
     r.stoichiometric_data = stoichiometric_data
     r.reverse = reverse_flag
     if complex_data is not None:
         r.complex_data = complex_data
-    if update:
-        r.update(verbose=True)
+    return r
 
 
 def add_reactions_from_stoichiometric_data(me_model, rxn_to_cplx_dict,
@@ -652,6 +803,9 @@ def add_reactions_from_stoichiometric_data(me_model, rxn_to_cplx_dict,
             spontaneous
     """
 
+    # the reactions are created first and added to the model at once, which
+    # is much faster than adding them one at a time
+    reactions = []
     for reaction_data in me_model.stoichiometric_data:
 
         try:
@@ -687,8 +841,12 @@ def add_reactions_from_stoichiometric_data(me_model, rxn_to_cplx_dict,
                 directionality_list.append('forward')
                 warn('Reaction (%s) cannot carry flux' % reaction_data.id)
             for directionality in directionality_list:
-                add_metabolic_reaction_to_model(me_model, reaction_data.id,
-                                                directionality,
-                                                complex_id=complex_id,
-                                                spontaneous=spontaneous,
-                                                update=update, keff=keff)
+                reactions.append(_create_metabolic_reaction(
+                    me_model, reaction_data.id, directionality,
+                    complex_id=complex_id, spontaneous=spontaneous,
+                    keff=keff))
+
+    me_model.add_reactions(reactions)
+    if update:
+        for r in reactions:
+            r.update(verbose=True)
@@ -0,0 +1,269 @@
+from __future__ import division, absolute_import
+
+from numbers import Number
+
+from numpy.polynomial.polynomial import polyval
+from sympy import Add, Basic
+
+
+def _polyadd(a, b):
+    """add two polynomials (coefficients in increasing powers)"""
+    if len(a) < len(b):
+        a, b = b, a
+    return [i + j for i, j in zip(a, b)] + list(a[len(b):])
+
+
+def _polymul(a, b):
+    """multiply two polynomials (coefficients in increasing powers)"""
+    if len(a) == 1:
+        return [a[0] * j for j in b]
+    if len(b) == 1:
+        return [i * b[0] for i in a]
+    result = [0.] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        for j, y in enumerate(b):
+            result[i + j] += x * y
+    return result
+
+
+def _strip(coefficients):
+    """remove the zero coefficients of the highest powers"""
+    coefficients = list(coefficients)
+    while len(coefficients) > 1 and coefficients[-1] == 0:
+        coefficients.pop()
+    return coefficients
+
+
+def _create(numerator, denominator):
+    """create a normalized RationalFunction, or a float if it is constant"""
+    numerator = _strip(numerator)
+    denominator = _strip(denominator)
+    if denominator == [0]:
+        raise ZeroDivisionError("denominator is 0")
+    if numerator == [0]:
+        return 0.
+    # cancel common powers of mu
+    while numerator[0] == 0 and denominator[0] == 0:
+        numerator.pop(0)
+        denominator.pop(0)
+    if len(numerator) == 1 and len(denominator) == 1:
+        return float(numerator[0] / denominator[0])
+    # scale the coefficient of the highest power in the denominator to 1
+    scale = float(denominator[-1])
+    return RationalFunction([i / scale for i in numerator],
+                            [i / scale for i in denominator])
+
+
+def _coefficients(value):
+    """(numerator, denominator) of a number or RationalFunction"""
+    if isinstance(value, RationalFunction):
+        return value.numerator, value.denominator
+    if isinstance(value, Number):
+        return (value,), (1.,)
+    return None
+
+
+def _sign(coefficients):
+    """sign of a polynomial for all positive mu, or None if it varies"""
+    if all(i >= 0 for i in coefficients):
+        return 1
+    if all(i <= 0 for i in coefficients):
+        return -1
+    return None
+
+
+class RationalFunction(object):
+    """A rational function of the growth rate (mu)
+
+    The numerator and denominator are stored as tuples of polynomial
+    coefficients in increasing powers of mu, so (a*mu + b) / (c*mu + d) is
+    RationalFunction((b, a), (d, c)). This supports the arithmetic used to
+    build mu-dependent stoichiometries much faster than sympy, and can be
+    evaluated (also on numpy arrays) and serialized without sympy.
+
+    Arithmetic results which do not depend on mu are returned as floats.
+    Use numeric_mu instead of the sympy symbol cobrame.mu to create them.
+
+    :param tuple numerator: coefficients of the numerator
+    :param tuple denominator: coefficients of the denominator
+    """
+    __slots__ = ("numerator", "denominator")
+
+    def __init__(self, numerator, denominator=(1.,)):
+        self.numerator = tuple(float(i) for i in numerator)
+        self.denominator = tuple(float(i) for i in denominator)
+
+    def __call__(self, mu):
+        """evaluate at a growth rate (or an array of growth rates)"""
+        return polyval(mu, self.numerator) / polyval(mu, self.denominator)
+
+    def subs(self, variable, value):
+        """substitute mu, as with a sympy expression
+
+        Returns a float if value is a number, or a sympy expression if value
+        is a sympy expression."""
+        if isinstance(value, Basic):
+            return self.to_sympy(value)
+        return float(self(value))
+
+    def to_sympy(self, variable=None):
+        """convert to a sympy expression of variable (default cobrame.mu)"""
+        if variable is None:
+            from cobrame.util import mu as variable
+        return Add(*[c * variable ** i for i, c in
+                     enumerate(self.numerator) if c != 0]) / \
+            Add(*[c * variable ** i for i, c in
+                  enumerate(self.denominator) if c != 0])
+
+    @classmethod
+    def from_sympy(cls, expr, variable=None):
+        """convert a sympy rational function of variable (default
+        cobrame.mu), returning a float if it does not depend on variable"""
+        from sympy import Poly, fraction, together
+        if variable is None:
+            from cobrame.util import mu as variable
+        numerator, denominator = fraction(together(expr))
+        return _create(*[[float(i) for i in
+                          reversed(Poly(part, variable).all_coeffs())]
+                         for part in (numerator, denominator)])
+
+    def _sign(self):
+        sign = _sign(self.numerator)
+        denominator_sign = _sign(self.denominator)
+        if sign is None or denominator_sign is None:
+            raise TypeError("the sign of %s depends on mu" % self)
+        return sign * denominator_sign
+
+    # arithmetic
+    def __add__(self, other):
+        other = _coefficients(other)
+        if other is None:
+            return NotImplemented
+        numerator, denominator = other
+        if denominator == self.denominator:
+            return _create(_polyadd(self.numerator, numerator), denominator)
+        return _create(_polyadd(_polymul(self.numerator, denominator),
+                               _polymul(numerator, self.denominator)),
+                       _polymul(self.denominator, denominator))
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return RationalFunction([-i for i in self.numerator],
+                                self.denominator)
+
+    def __pos__(self):
+        return self
+
+    def __sub__(self, other):
+        if _coefficients(other) is None:
+            return NotImplemented
+        return self + (-other)
+
+    def __rsub__(self, other):
+        if _coefficients(other) is None:
+            return NotImplemented
+        return (-self) + other
+
+    def __mul__(self, other):
+        other = _coefficients(other)
+        if other is None:
+            return NotImplemented
+        numerator, denominator = other
+        return _create(_polymul(self.numerator, numerator),
+                       _polymul(self.denominator, denominator))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        other = _coefficients(other)
+        if other is None:
+            return NotImplemented
+        numerator, denominator = other
+        return _create(_polymul(self.numerator, denominator),
+                       _polymul(self.denominator, numerator))
+
+    def __rtruediv__(self, other):
+        other = _coefficients(other)
+        if other is None:
+            return NotImplemented
+        numerator, denominator = other
+        return _create(_polymul(numerator, self.denominator),
+                       _polymul(denominator, self.numerator))
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __pow__(self, exponent):
+        if int(exponent) != exponent:
+            return NotImplemented
+        result = 1.
+        base = self if exponent >= 0 else 1. / self
+        for i in range(abs(int(exponent))):
+            result = result * base
+        return result
+
+    def __abs__(self):
+        return self if self._sign() > 0 else -self
+
+    # comparisons, which only hold if they are true for all positive mu
+    def __eq__(self, other):
+        return isinstance(other, RationalFunction) and \
+            self.numerator == other.numerator and \
+            self.denominator == other.denominator
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.numerator, self.denominator))
+
+    def __lt__(self, other):
+        difference = self - other
+        return difference._sign() < 0 \
+            if isinstance(difference, RationalFunction) else difference < 0
+
+    def __le__(self, other):
+        return self < other or self == other
+
+    def __gt__(self, other):
+        difference = self - other
+        return difference._sign() > 0 \
+            if isinstance(difference, RationalFunction) else difference > 0
+
+    def __ge__(self, other):
+        return self > other or self == other
+
+    def __float__(self):
+        raise TypeError("can not convert a function of mu to a float")
+
+    def __str__(self):
+        def polynomial(coefficients):
+            terms = []
+            for i, c in enumerate(coefficients):
+                if c == 0:
+                    continue
+                term = repr(abs(c)) if i == 0 else \
+                    "%r*mu" % abs(c) if i == 1 else "%r*mu**%d" % (abs(c), i)
+                terms.append(("- " if c < 0 else "+ ") + term)
+            string = " ".join(terms)
+            return "(" + (string[2:] if string[0] == "+" else "-" +
+                          string[2:]) + ")"
+        if self.denominator == (1.,):
+            return polynomial(self.numerator)
+        return polynomial(self.numerator) + "/" + \
+            polynomial(self.denominator)
+
+    def __repr__(self):
+        return "<RationalFunction %s>" % self
+
+    def __reduce__(self):
+        return (RationalFunction, (self.numerator, self.denominator))
+
+
+def is_symbolic(value):
+    """whether a coefficient or bound depends on mu"""
+    return isinstance(value, (Basic, RationalFunction))
+
+
+numeric_mu = RationalFunction((0., 1.))
@@ -0,0 +1,163 @@
+from __future__ import division, absolute_import
+
+from itertools import product
+
+from numpy import arange, array, bincount, concatenate, cumsum, frombuffer, \
+    full, maximum, repeat, uint8, unique
+
+from cobrame.util.dogma import amino_acids, codon_table, transcription_table
+from cobrame.util.mass import amino_acid_no_h2o, rna_no_ppi
+
+# bases are encoded as their index in "ACGT", anything else as 4
+bases = "ACGT"
+_encoding = full(256, 4, dtype=uint8)
+for _i, _base in enumerate(bases):
+    _encoding[ord(_base)] = _i
+
+# codons are encoded as 16 * first + 4 * second + third base
+codons = ["".join(i) for i in product(bases, repeat=3)]
+_RNA_codons = array([i.replace("T", "U") for i in codons], dtype=object)
+_codon_letters = array([ord(codon_table[i]) for i in codons], dtype=uint8)
+
+amino_acid_ids = sorted(set(amino_acids.values()))
+_amino_acid_ids = array(amino_acid_ids, dtype=object)
+_amino_acid_index = full(256, -1, dtype=int)
+for _letter, _amino_acid in amino_acids.items():
+    _amino_acid_index[ord(_letter)] = amino_acid_ids.index(_amino_acid)
+
+
+def _encode(strings):
+    """concatenate strings into one uint8 array"""
+    return frombuffer("".join(strings).encode("ascii"), dtype=uint8)
+
+
+def _ordered_counts(groups, values, n_groups, names):
+    """count the values in each group in order of their first appearance
+
+    groups must be sorted, and values are indexes into the names array.
+    Returns a list with a list of (name, count) for each group."""
+    _, first, counts = unique(groups * len(names) + values,
+                              return_index=True, return_counts=True)
+    order = first.argsort()
+    first = first[order]
+    pairs = list(zip(names[values[first]].tolist(), counts[order].tolist()))
+    bounds = concatenate(([0], cumsum(bincount(
+        groups[first], minlength=n_groups)))).tolist()
+    return [pairs[bounds[i]:bounds[i + 1]] for i in range(n_groups)]
+
+
+class SequenceTable(object):
+    """Nucleotide sequences of many genes encoded in a single buffer
+
+    The sequences are concatenated into one uint8 array with the offset of
+    every sequence, so counts and masses are computed for all of them in a
+    few vectorized operations instead of one gene at a time.
+
+    sequences: list of str
+        DNA sequences of the genes
+
+    nucleotide_counts: numpy.array
+        (n_sequences, 5) array with the counts of A, C, G, T and any other
+        characters in each sequence
+    """
+    def __init__(self, sequences):
+        self.sequences = list(sequences)
+        self.lengths = array([len(i) for i in self.sequences], dtype=int)
+        self.offsets = concatenate(([0], cumsum(self.lengths)))
+        self.buffer = _encoding[_encode(self.sequences)]
+        self._genes = repeat(arange(len(self.sequences)), self.lengths)
+        self.nucleotide_counts = bincount(
+            self._genes * 5 + self.buffer, minlength=5 * len(self)).reshape(
+                len(self), 5)
+
+    def __len__(self):
+        return len(self.sequences)
+
+    @property
+    def valid(self):
+        """whether each sequence only contains A, C, G and T"""
+        return self.nucleotide_counts[:, 4] == 0
+
+    @property
+    def RNA_masses(self):
+        """RNA mass (kDa) of each sequence as computed by compute_RNA_mass"""
+        weights = array([rna_no_ppi[transcription_table[i]] for i in bases])
+        return self.nucleotide_counts[:, :4].dot(weights) / 1000
+
+    def _codons(self, include_last):
+        """gene and codon index of the codons of every sequence
+
+        Codons with other characters than A, C, G and T have an index of 64,
+        and an incomplete codon at the end of a sequence has an index of
+        65."""
+        if include_last:
+            n_codons = (self.lengths + 2) // 3
+        else:
+            # the codons in range(0, len(seq) - 3, 3)
+            n_codons = maximum(self.lengths - 1, 0) // 3
+        genes = repeat(arange(len(self)), n_codons)
+        starts = concatenate(([0], cumsum(n_codons)))
+        positions = self.offsets[genes] + \
+            3 * (arange(len(genes)) - starts[genes])
+        # pad the buffer so an incomplete codon at the end can be read
+        buffer = concatenate((self.buffer, full(2, 4, dtype=uint8)))
+        first = buffer[positions].astype(int)
+        second = buffer[positions + 1].astype(int)
+        third = buffer[positions + 2].astype(int)
+        codon_indexes = 16 * first + 4 * second + third
+        codon_indexes[(first > 3) | (second > 3) | (third > 3)] = 64
+        codon_indexes[positions + 3 > self.offsets[genes + 1]] = 65
+        return genes, codon_indexes
+
+    def codon_counts(self):
+        """counts of the codons in each sequence, excluding the stop codon
+
+        Returns a list with a list of (codon, count) for each sequence, in
+        order of the first appearance of each codon. This matches
+        TranslationData.codon_count before the start codon is removed, for
+        sequences which only contain A, C, G and T."""
+        genes, codon_indexes = self._codons(include_last=False)
+        known = codon_indexes < 64
+        return _ordered_counts(genes[known], codon_indexes[known], len(self),
+                               _RNA_codons)
+
+    def translate(self):
+        """translate every sequence to an amino acid sequence
+
+        This matches TranslationData.amino_acid_sequence for sequences which
+        start with a methionine codon: stop codons at the end are removed,
+        and other stop codons as well as codons which can not be translated
+        are read as lysine (K)."""
+        genes, codon_indexes = self._codons(include_last=True)
+        letters = full(len(codon_indexes), ord("K"), dtype=uint8)
+        known = codon_indexes < 64
+        letters[known] = _codon_letters[codon_indexes[known]]
+        letters = letters.tobytes().decode("ascii")
+        starts = concatenate(([0], cumsum((self.lengths + 2) // 3))).tolist()
+        return [letters[starts[i]:starts[i + 1]].rstrip("*").replace("*", "K")
+                for i in range(len(self))]
+
+
+def amino_acid_counts(amino_acid_sequences):
+    """counts of the amino acids in amino acid sequences
+
+    Returns a list with a list of (amino acid id, count) for each sequence,
+    in order of the first appearance of each amino acid, and an
+    (n_sequences, len(amino_acid_ids)) array of the same counts."""
+    n_amino_acids = len(amino_acid_ids)
+    lengths = array([len(i) for i in amino_acid_sequences], dtype=int)
+    sequences = repeat(arange(len(lengths)), lengths)
+    indexes = _amino_acid_index[_encode(amino_acid_sequences)]
+    table = bincount(sequences * n_amino_acids + indexes,
+                     minlength=len(lengths) * n_amino_acids).reshape(
+                         len(lengths), n_amino_acids)
+    counts = _ordered_counts(sequences, indexes, len(lengths),
+                             _amino_acid_ids)
+    return counts, table
+
+
+def protein_masses(amino_acid_table):
+    """protein mass (kDa) of each row of an amino acid count table, as
+    computed by compute_protein_mass"""
+    weights = array([amino_acid_no_h2o[i] for i in amino_acid_ids])
+    return (amino_acid_table.dot(weights) + 18.015) / 1000